@@ -0,0 +1,123 @@
+"""
+Download throughput per user under a global bandwidth cap, across workers.
+
+This seeds a throwaway database and starts gunicorn with --workers
+threaded workers, configured by gunicorn.conf.py. Two users each upload one --size MB file. For --seconds, the
+greedy user downloads theirs over --greedy concurrent connections while
+the other user downloads over one.
+
+The run happens twice: without shaping, and with
+BANDWIDTH_GLOBAL_DOWNLOAD_BYTES_PER_SECOND set to --cap MB/s. Each run
+reports MB/s per user and in total. With the cap, the two users should
+split it about evenly, however many connections the greedy one opens, and
+the total should stay near the cap even though the transfers run in
+different worker processes.
+
+Usage:
+    python benchmarks/bench_bandwidth.py [--cap 50] [--greedy 3] [--seconds 10] [--size 8] [--workers 5]
+"""
+import argparse
+import json
+import os
+import shutil
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from loadtest import BACKEND_DIR, Client, free_port, manage, multipart_body, start_server  # noqa: E402
+
+
+def shell(env, code):
+    result = subprocess.run([sys.executable, 'manage.py', 'shell', '-c', code], cwd=BACKEND_DIR, env=env,
+                            check=True, capture_output=True, text=True)
+    return json.loads(result.stdout.strip().splitlines()[-1])
+
+
+def download_for(client, user_id, file_id, seconds, received, lock):
+    deadline = time.monotonic() + seconds
+    while time.monotonic() < deadline:
+        status, data = client.request('GET', f'/api/files/{file_id}/download/', user_id)
+        assert status == 200, status
+        with lock:
+            received[user_id] += len(data)
+
+
+def run(cap, args):
+    workdir = tempfile.mkdtemp(prefix='filevault-bandwidth-')
+    env = dict(
+        os.environ,
+        DJANGO_DB_PATH=os.path.join(workdir, 'db.sqlite3'),
+        DJANGO_MEDIA_ROOT=os.path.join(workdir, 'media'),
+        DJANGO_DEBUG='False',
+        METRICS_ENABLED='False',
+        BANDWIDTH_STATE_PATH=os.path.join(workdir, 'bandwidth.state'),
+        BANDWIDTH_GLOBAL_DOWNLOAD_BYTES_PER_SECOND=str(int(cap * 1000 * 1000)),
+    )
+    manifest_path = os.path.join(workdir, 'manifest.json')
+    server = None
+    try:
+        manage(env, 'migrate')
+        manage(env, 'seed_benchmark', '--users', '2', '--files', '0', '--manifest', manifest_path)
+        with open(manifest_path) as f:
+            greedy_user, fair_user = [int(user_id) for user_id in json.load(f)['users']]
+        shell(env, (
+            "import json; from files.models import UserProfile; "
+            "UserProfile.objects.update(storage_limit_mb=10 ** 6, api_calls_per_second=10 ** 6); print(json.dumps(True))"
+        ))
+
+        port = free_port()
+        server = start_server(env, port, 'gunicorn', args.workers)
+        client = Client(port)
+        files = {}
+        for user_id in (greedy_user, fair_user):
+            body, content_type = multipart_body('big.bin', os.urandom(args.size * 1024 * 1024))
+            status, data = client.request('POST', '/api/files/', user_id, body, content_type)
+            assert status == 201, status
+            files[user_id] = json.loads(data)['id']
+
+        received = {greedy_user: 0, fair_user: 0}
+        lock = threading.Lock()
+        connections = [greedy_user] * args.greedy + [fair_user]
+        start = time.perf_counter()
+        with ThreadPoolExecutor(max_workers=len(connections)) as executor:
+            for future in [
+                executor.submit(download_for, client, user_id, files[user_id], args.seconds, received, lock)
+                for user_id in connections
+            ]:
+                future.result()
+        wall = time.perf_counter() - start
+    finally:
+        if server:
+            server.kill()
+            server.wait()
+        shutil.rmtree(workdir, ignore_errors=True)
+
+    to_mb_s = lambda value: round(value / wall / 1000 / 1000, 1)  # noqa: E731
+    return {
+        'cap_mb_s': cap or None,
+        'greedy_user_mb_s': to_mb_s(received[greedy_user]),
+        'other_user_mb_s': to_mb_s(received[fair_user]),
+        'total_mb_s': to_mb_s(sum(received.values())),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--cap', type=float, default=50, help='Global download cap in MB/s')
+    parser.add_argument('--greedy', type=int, default=3, help='Concurrent downloads of the greedy user')
+    parser.add_argument('--seconds', type=float, default=10)
+    parser.add_argument('--size', type=int, default=8, help='File size in MB')
+    parser.add_argument('--workers', type=int, default=5)
+    args = parser.parse_args()
+
+    results = {'unshaped': run(0, args), 'capped': run(args.cap, args)}
+    print(json.dumps(results, indent=2))
+
+
+if __name__ == '__main__':
+    main()
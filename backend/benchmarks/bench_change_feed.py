@@ -0,0 +1,98 @@
+"""
+Cost of a sync poll: the full file listing compared with the change feed.
+
+In a throwaway test database, for each --library size this bulk-creates
+that many files for one user. It then takes a change feed cursor and
+uploads --changes files through the API. Finally it times, as the median
+of --repeat polls, GET /api/files/ against GET /api/files/changes/?cursor=,
+and reports their response sizes.
+
+Usage:
+    python benchmarks/bench_change_feed.py [--library 1000 10000] [--changes 10] [--repeat 5]
+"""
+import argparse
+import json
+import os
+import shutil
+import statistics
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'core.settings')
+
+import django  # noqa: E402
+
+django.setup()
+
+from django.contrib.auth.models import User  # noqa: E402
+from django.core.files.uploadedfile import SimpleUploadedFile  # noqa: E402
+from django.db import connection  # noqa: E402
+from django.test import Client  # noqa: E402
+from django.test.utils import override_settings, setup_test_environment  # noqa: E402
+
+from files.models import File, UserProfile  # noqa: E402
+
+
+def poll(client, user, url, repeat):
+    timings = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        response = client.get(url, HTTP_USERID=str(user.pk))
+        timings.append(time.perf_counter() - start)
+        assert response.status_code == 200, response.status_code
+    return round(statistics.median(timings) * 1000, 3), len(response.content)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--library', type=int, nargs='+', default=[1000, 10000])
+    parser.add_argument('--changes', type=int, default=10)
+    parser.add_argument('--repeat', type=int, default=5)
+    args = parser.parse_args()
+
+    media_root = tempfile.mkdtemp(prefix='filevault-changes-')
+    setup_test_environment()
+    old_name = connection.creation.create_test_db(verbosity=0)
+    rows = []
+    try:
+        with override_settings(MEDIA_ROOT=media_root, PREVIEWS={'EAGER': False}):
+            client = Client()
+            for library in args.library:
+                user = User.objects.create_user(username=f'bench-{library}', password='bench')
+                UserProfile.objects.filter(user=user).update(api_calls_per_second=10 ** 6, storage_limit_mb=10 ** 6)
+                File.objects.bulk_create([
+                    File(original_filename=f'file-{index}.txt', file_type='text/plain', size=100,
+                         file_hash=f'{library}-{index}', owner=user)
+                    for index in range(library)
+                ], batch_size=2000)
+
+                cursor = client.get('/api/files/changes/', HTTP_USERID=str(user.pk)).json()['cursor']
+                for index in range(args.changes):
+                    client.post(
+                        '/api/files/',
+                        {'file': SimpleUploadedFile(f'new-{index}.txt', os.urandom(64), content_type='text/plain')},
+                        HTTP_USERID=str(user.pk),
+                    )
+
+                listing_ms, listing_bytes = poll(client, user, '/api/files/', args.repeat)
+                feed_ms, feed_bytes = poll(client, user, f'/api/files/changes/?cursor={cursor}', args.repeat)
+                rows.append({
+                    'library': library + args.changes,
+                    'changes': args.changes,
+                    'full_listing_ms': listing_ms,
+                    'full_listing_bytes': listing_bytes,
+                    'change_feed_ms': feed_ms,
+                    'change_feed_bytes': feed_bytes,
+                })
+                print(json.dumps(rows[-1]), file=sys.stderr)
+    finally:
+        connection.creation.destroy_test_db(old_name, verbosity=0)
+        shutil.rmtree(media_root, ignore_errors=True)
+
+    print(json.dumps(rows, indent=2))
+
+
+if __name__ == '__main__':
+    main()
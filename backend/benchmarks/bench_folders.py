@@ -0,0 +1,135 @@
+"""
+Folder listing, subtree stats and move cost: folders encoded in
+original_filename compared with the Folder model.
+
+In a throwaway test database this builds one user's tree of --dirs
+top-level folders. Each has --subdirs subfolders holding --files files
+each. Every file exists twice: once with its path encoded in the filename
+('dir3/sub4/file7.txt'), the way clients fake folders today, and once in
+real folders. It then times, as the median of --repeat runs:
+
+- listing one subfolder: a case-insensitive prefix scan against the children query;
+- the size of one top-level folder: an aggregate over the scan against the
+  totals kept on the folder row;
+- renaming a top-level folder and moving it under another one: rewriting
+  the filename of every file below it against files.folders.move_folder.
+  Both are rolled back after each run.
+
+Usage:
+    python benchmarks/bench_folders.py [--dirs 20] [--subdirs 10] [--files 100] [--repeat 5]
+"""
+import argparse
+import json
+import os
+import statistics
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'core.settings')
+
+import django  # noqa: E402
+
+django.setup()
+
+from django.contrib.auth.models import User  # noqa: E402
+from django.db import connection, transaction  # noqa: E402
+from django.db.models import Count, Sum, Value  # noqa: E402
+from django.db.models.functions import Replace  # noqa: E402
+from django.test.utils import setup_test_environment  # noqa: E402
+
+from files import folders  # noqa: E402
+from files.models import File, Folder  # noqa: E402
+
+
+class Rollback(Exception):
+    pass
+
+
+def median_ms(fn, repeat, rollback=False):
+    timings = []
+    for _ in range(repeat):
+        try:
+            with transaction.atomic():
+                start = time.perf_counter()
+                fn()
+                timings.append(time.perf_counter() - start)
+                if rollback:
+                    raise Rollback()
+        except Rollback:
+            pass
+    return round(statistics.median(timings) * 1000, 3)
+
+
+def build_tree(user, dirs, subdirs, files):
+    records = []
+    for d in range(dirs):
+        top = folders.create_folder(user, f'dir{d}')
+        for s in range(subdirs):
+            sub = folders.create_folder(user, f'sub{s}', top)
+            for f in range(files):
+                common = dict(file_type='text/plain', size=1000 + f, owner=user, file_hash=f'{d}-{s}-{f}')
+                records.append(File(original_filename=f'dir{d}/sub{s}/file{f}.txt', **common))
+                records.append(File(original_filename=f'file{f}.txt', folder=sub, **common))
+        File.objects.bulk_create(records, batch_size=2000)
+        records = []
+    # bulk_create skips the signals that keep the totals, so they're filled in here
+    for folder in Folder.objects.filter(owner=user, depth=1):
+        usage = File.objects.filter(folder=folder).aggregate(count=Count('id'), bytes=Sum('size'))
+        folders.adjust_totals(folder.pk, usage['count'], usage['bytes'])
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--dirs', type=int, default=20)
+    parser.add_argument('--subdirs', type=int, default=10)
+    parser.add_argument('--files', type=int, default=100)
+    parser.add_argument('--repeat', type=int, default=5)
+    args = parser.parse_args()
+
+    setup_test_environment()
+    old_name = connection.creation.create_test_db(verbosity=0)
+    try:
+        user = User.objects.create_user(username='bench', password='bench')
+        build_tree(user, args.dirs, args.subdirs, args.files)
+        top = Folder.objects.get(owner=user, parent__isnull=True, name='dir3')
+        sub = Folder.objects.get(parent=top, name='sub4')
+        target = Folder.objects.get(owner=user, parent__isnull=True, name='dir0')
+        encoded = File.objects.filter(owner=user, folder__isnull=True)
+
+        def list_encoded():
+            # Direct children only: the prefix, then no further '/'
+            return [f for f in encoded.filter(original_filename__istartswith='dir3/sub4/') if '/' not in f.original_filename[10:]]
+
+        def list_folder():
+            return list(sub.children.all()), list(File.objects.filter(owner=user, folder=sub).order_by('original_filename'))
+
+        def move_encoded():
+            encoded.filter(original_filename__startswith='dir3/').update(
+                original_filename=Replace('original_filename', Value('dir3/'), Value('dir0/dir3/'))
+            )
+
+        result = {
+            'files_per_layout': args.dirs * args.subdirs * args.files,
+            'files_per_top_level_folder': args.subdirs * args.files,
+            'list_subfolder_ms': {
+                'encoded_paths': median_ms(list_encoded, args.repeat),
+                'folders': median_ms(list_folder, args.repeat),
+            },
+            'top_level_folder_size_ms': {
+                'encoded_paths': median_ms(lambda: encoded.filter(original_filename__istartswith='dir3/').aggregate(Sum('size')), args.repeat),
+                'folders': median_ms(lambda: Folder.objects.get(pk=top.pk).total_bytes, args.repeat),
+            },
+            'move_top_level_folder_ms': {
+                'encoded_paths': median_ms(move_encoded, args.repeat, rollback=True),
+                'folders': median_ms(lambda: folders.move_folder(top, target), args.repeat, rollback=True),
+            },
+        }
+    finally:
+        connection.creation.destroy_test_db(old_name, verbosity=0)
+
+    print(json.dumps(result, indent=2))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,93 @@
+"""
+Overhead of request instrumentation on the file list endpoint.
+
+Seeds a user with --files rows in a throwaway test database, then times
+GET /api/files/ with METRICS enabled and disabled in alternating rounds.
+It reports the median per-request latency of each mode and the relative
+overhead. The target is under 2%.
+
+Usage:
+    python benchmarks/bench_metrics_overhead.py [--files 25] [--requests 300] [--rounds 5]
+"""
+import argparse
+import json
+import os
+import statistics
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'core.settings')
+
+import django  # noqa: E402
+
+django.setup()
+
+from django.contrib.auth.models import User  # noqa: E402
+from django.db import connection  # noqa: E402
+from django.test import Client  # noqa: E402
+from django.test.utils import override_settings, setup_test_environment  # noqa: E402
+
+from files.models import File, UserProfile  # noqa: E402
+
+
+def seed(file_count):
+    user = User.objects.create_user(username='bench', password='bench')
+    UserProfile.objects.filter(user=user).update(api_calls_per_second=10 ** 6)
+    File.objects.bulk_create([
+        File(
+            file=f'uploads/bench-{i}.bin',
+            original_filename=f'bench-{i}.bin',
+            file_type='application/octet-stream',
+            size=1024 + i,
+            file_hash=f'{i:064x}',
+            owner=user,
+        )
+        for i in range(file_count)
+    ])
+    return user
+
+
+def time_requests(client, user, count):
+    start = time.perf_counter()
+    for _ in range(count):
+        response = client.get('/api/files/', HTTP_USERID=str(user.pk))
+        assert response.status_code == 200, response.status_code
+    return (time.perf_counter() - start) / count
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--files', type=int, default=25)
+    parser.add_argument('--requests', type=int, default=300)
+    parser.add_argument('--rounds', type=int, default=5)
+    args = parser.parse_args()
+
+    setup_test_environment()
+    old_name = connection.creation.create_test_db(verbosity=0)
+    try:
+        user = seed(args.files)
+        client = Client()
+        time_requests(client, user, 20)  # Warm up
+
+        samples = {'enabled': [], 'disabled': []}
+        for _ in range(args.rounds):
+            for mode in samples:
+                with override_settings(METRICS={'ENABLED': mode == 'enabled'}):
+                    samples[mode].append(time_requests(client, user, args.requests))
+    finally:
+        connection.creation.destroy_test_db(old_name, verbosity=0)
+
+    enabled = statistics.median(samples['enabled'])
+    disabled = statistics.median(samples['disabled'])
+    print(json.dumps({
+        'files': args.files,
+        'requests_per_round': args.requests,
+        'median_ms_enabled': round(enabled * 1000, 3),
+        'median_ms_disabled': round(disabled * 1000, 3),
+        'overhead_percent': round((enabled - disabled) / disabled * 100, 2),
+    }, indent=2))
+
+
+if __name__ == '__main__':
+    main()
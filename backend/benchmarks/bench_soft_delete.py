@@ -0,0 +1,131 @@
+"""
+DELETE latency against the number of duplicate references, and trash
+reaper throughput.
+
+In a throwaway test database, for each --references count this uploads an
+original and bulk-creates that many duplicate records pointing at it. It
+then times DELETE /api/files/<id>/, which only moves the file to the
+trash. For comparison, it also times a synchronous delete of the same
+rows, the way the old CASCADE ran it inside the request: one ORM delete
+of the original and its references, with a post_delete signal per row.
+That delete is rolled back afterwards.
+
+Finally it purges every trashed file with `manage.py reap_trash` and
+reports files per second. Originals that still have references hand
+their blob to one of them first.
+
+Usage:
+    python benchmarks/bench_soft_delete.py [--references 0 100 1000 10000] [--batch-size 500]
+"""
+import argparse
+import json
+import os
+import shutil
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'core.settings')
+
+import django  # noqa: E402
+
+django.setup()
+
+from django.contrib.auth.models import User  # noqa: E402
+from django.core.files.uploadedfile import SimpleUploadedFile  # noqa: E402
+from django.core.management import call_command  # noqa: E402
+from django.db import connection, transaction  # noqa: E402
+from django.test import Client  # noqa: E402
+from django.test.utils import override_settings, setup_test_environment  # noqa: E402
+from django.utils import timezone  # noqa: E402
+
+from files.models import File, UserProfile  # noqa: E402
+
+
+class Rollback(Exception):
+    pass
+
+
+def add_original(client, user, references):
+    content = os.urandom(4096)
+    response = client.post(
+        '/api/files/',
+        {'file': SimpleUploadedFile('bench.bin', content, content_type='application/octet-stream')},
+        HTTP_USERID=str(user.pk),
+    )
+    assert response.status_code == 201, response.status_code
+    original = File.objects.get(pk=response.json()['id'])
+    File.objects.bulk_create([
+        File(original_filename=f'copy-{index}.bin', file_type=original.file_type, size=original.size,
+             file_hash=original.file_hash, owner=user, is_duplicate=True, original_file_ref=original)
+        for index in range(references)
+    ], batch_size=1000)
+    return original
+
+
+def cascade_seconds(original):
+    """A synchronous delete of the original and every reference, rolled back afterwards."""
+    start = time.perf_counter()
+    try:
+        with transaction.atomic():
+            File.objects.filter(original_file_ref=original).delete()
+            File.objects.filter(pk=original.pk).delete()
+            elapsed = time.perf_counter() - start
+            raise Rollback()
+    except Rollback:
+        pass
+    return elapsed
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--references', type=int, nargs='+', default=[0, 100, 1000, 10000])
+    parser.add_argument('--batch-size', type=int, default=500, help='Reaper batch size')
+    args = parser.parse_args()
+
+    media_root = tempfile.mkdtemp(prefix='filevault-trash-')
+    setup_test_environment()
+    old_name = connection.creation.create_test_db(verbosity=0)
+    try:
+        with override_settings(MEDIA_ROOT=media_root, PREVIEWS={'EAGER': False}):
+            user = User.objects.create_user(username='bench', password='bench')
+            UserProfile.objects.filter(user=user).update(api_calls_per_second=10 ** 6, storage_limit_mb=10 ** 6)
+            client = Client()
+
+            rows = []
+            for references in args.references:
+                original = add_original(client, user, references)
+                cascade = cascade_seconds(original)
+                start = time.perf_counter()
+                response = client.delete(f'/api/files/{original.pk}/?permanent=true', HTTP_USERID=str(user.pk))
+                elapsed = time.perf_counter() - start
+                assert response.status_code == 204, response.status_code
+                rows.append({
+                    'references': references,
+                    'soft_delete_ms': round(elapsed * 1000, 3),
+                    'synchronous_cascade_ms': round(cascade * 1000, 3),
+                })
+                print(json.dumps(rows[-1]), file=sys.stderr)
+
+            # Trash every reference too, so the reaper purges originals and references alike
+            File.objects.update(deleted_at=timezone.now(), purge_after=timezone.now())
+            total = File.objects.count()
+            start = time.perf_counter()
+            call_command('reap_trash', '--batch-size', str(args.batch_size), stdout=open(os.devnull, 'w'))
+            reap_seconds = time.perf_counter() - start
+            assert not File.objects.exists()
+    finally:
+        connection.creation.destroy_test_db(old_name, verbosity=0)
+        shutil.rmtree(media_root, ignore_errors=True)
+
+    print(json.dumps({
+        'delete': rows,
+        'reaped_files': total,
+        'reap_seconds': round(reap_seconds, 3),
+        'reap_files_per_s': round(total / reap_seconds, 1),
+    }, indent=2))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,177 @@
+"""
+Gunicorn boot cost: time-to-first-request and per-worker memory.
+
+Starts gunicorn with gunicorn.conf.py against a throwaway migrated database
+in three configurations:
+
+    full          core.settings, every worker loads the app itself
+    api           core.settings_api, every worker loads the app itself
+    api_preload   core.settings_api, the app is loaded once in the master
+                  and the workers are forked from it (the default)
+
+For each it reports the time from spawn to the first answered request and
+to the last worker finishing its boot. It also reports per-worker RSS, PSS
+(shared pages split between the processes sharing them) and USS (private
+pages), read from /proc after some warm-up traffic. It also times the
+`makemigrations` + `migrate` pass that start.sh used to run on every
+container start. Linux only.
+
+Usage:
+    python benchmarks/bench_startup.py [--workers 4] [--repeat 3]
+"""
+import argparse
+import glob
+import http.client
+import json
+import os
+import shutil
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from loadtest import BACKEND_DIR, free_port, manage  # noqa: E402
+
+CONFIGURATIONS = {
+    'full': ('core.settings', False),
+    'api': ('core.settings_api', False),
+    'api_preload': ('core.settings_api', True),
+}
+
+# Loads gunicorn.conf.py and records when each worker has finished booting
+HOOK_CONFIG = """
+import os, runpy, time
+globals().update({{k: v for k, v in runpy.run_path({conf!r}).items() if not k.startswith('__')}})
+
+def post_worker_init(worker):
+    with open(os.path.join({ready_dir!r}, str(os.getpid())), 'w') as f:
+        f.write(repr(time.time()))
+"""
+
+
+def memory(pid):
+    """RSS, PSS and USS of a process in KiB."""
+    values = {}
+    with open(f'/proc/{pid}/smaps_rollup') as f:
+        for line in f:
+            parts = line.split()
+            if len(parts) == 3 and parts[2] == 'kB':
+                values[parts[0].rstrip(':')] = int(parts[1])
+    return {
+        'rss_kb': values['Rss'],
+        'pss_kb': values['Pss'],
+        'uss_kb': values['Private_Clean'] + values['Private_Dirty'],
+    }
+
+
+def get(port, path):
+    connection = http.client.HTTPConnection('127.0.0.1', port, timeout=5)
+    connection.request('GET', path)
+    response = connection.getresponse()
+    response.read()
+    connection.close()
+    return response.status
+
+
+def boot(env, workdir, settings_module, preload, workers, warmup_requests):
+    ready_dir = tempfile.mkdtemp(dir=workdir)
+    config_path = os.path.join(ready_dir, 'bench.conf.py')
+    with open(config_path, 'w') as f:
+        f.write(HOOK_CONFIG.format(conf=os.path.join(BACKEND_DIR, 'gunicorn.conf.py'), ready_dir=ready_dir))
+    port = free_port()
+    env = dict(env, DJANGO_SETTINGS_MODULE=settings_module, GUNICORN_PRELOAD=str(preload),
+               GUNICORN_WORKERS=str(workers), GUNICORN_BIND=f'127.0.0.1:{port}')
+
+    started = time.time()
+    process = subprocess.Popen(['gunicorn', '-c', config_path], cwd=BACKEND_DIR, env=env,
+                               stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    try:
+        deadline = time.monotonic() + 60
+        while True:
+            try:
+                if get(port, '/api/info/') == 200:
+                    break
+            except OSError:
+                pass
+            if time.monotonic() > deadline:
+                raise RuntimeError('gunicorn did not answer within 60s')
+            time.sleep(0.005)
+        first_request = time.time() - started
+
+        while len(os.listdir(ready_dir)) - 1 < workers:
+            if time.monotonic() > deadline:
+                raise RuntimeError('Not every worker booted within 60s')
+            time.sleep(0.005)
+        stamps = []
+        for path in glob.glob(os.path.join(ready_dir, '[0-9]*')):
+            with open(path) as f:
+                stamps.append(float(f.read()))
+        all_workers = max(stamps) - started
+
+        for _ in range(warmup_requests):
+            get(port, '/api/info/')
+        pids = [int(os.path.basename(path)) for path in glob.glob(os.path.join(ready_dir, '[0-9]*'))]
+        samples = [memory(pid) for pid in pids]
+        master = memory(process.pid)
+    finally:
+        process.terminate()
+        process.wait()
+
+    per_worker = {key: round(statistics.mean(sample[key] for sample in samples)) for key in samples[0]}
+    return {
+        'first_request_ms': round(first_request * 1000, 1),
+        'all_workers_ms': round(all_workers * 1000, 1),
+        'worker': per_worker,
+        'master_rss_kb': master['rss_kb'],
+        # What the host actually pays for the whole pool
+        'total_pss_kb': master['pss_kb'] + sum(sample['pss_kb'] for sample in samples),
+    }
+
+
+def median_run(runs):
+    def merge(values):
+        if isinstance(values[0], dict):
+            return {key: merge([value[key] for value in values]) for key in values[0]}
+        return statistics.median(values)
+    return merge(runs)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--workers', type=int, default=4)
+    parser.add_argument('--repeat', type=int, default=3, help='Boots per configuration; medians are reported')
+    parser.add_argument('--warmup-requests', type=int, default=200, help='Requests sent before sampling memory')
+    args = parser.parse_args()
+
+    workdir = tempfile.mkdtemp(prefix='filevault-startup-')
+    env = dict(
+        os.environ,
+        DJANGO_DB_PATH=os.path.join(workdir, 'db.sqlite3'),
+        DJANGO_MEDIA_ROOT=os.path.join(workdir, 'media'),
+        DJANGO_DEBUG='False',
+    )
+    try:
+        manage(env, 'migrate')
+        # The per-container cost start.sh used to pay, against an already migrated database
+        started = time.perf_counter()
+        manage(env, 'makemigrations', '--check', '--dry-run')
+        manage(env, 'migrate')
+        results = {
+            'workers': args.workers,
+            'migrations_on_start_ms': round((time.perf_counter() - started) * 1000, 1),
+        }
+        for name, (settings_module, preload) in CONFIGURATIONS.items():
+            runs = [boot(env, workdir, settings_module, preload, args.workers, args.warmup_requests)
+                    for _ in range(args.repeat)]
+            results[name] = median_run(runs)
+            print(f'{name:>12}: {json.dumps(results[name])}', file=sys.stderr)
+    finally:
+        shutil.rmtree(workdir, ignore_errors=True)
+    print(json.dumps(results, indent=2))
+
+
+if __name__ == '__main__':
+    main()
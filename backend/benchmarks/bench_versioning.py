@@ -0,0 +1,140 @@
+"""
+Reconstruction latency of older file versions against delta chain length.
+
+Uploads one file and --versions edited versions of it through the API in a
+throwaway test database, with keyframes disabled so version N sits N deltas
+below the current content. It then times GET /api/files/<id>/versions/<n>/
+for each chain length and reports the median latency, the stored delta
+sizes and the space saved compared with keeping every version in full.
+
+Usage:
+    python benchmarks/bench_versioning.py [--size 4194304] [--versions 16] [--edits 5] [--repeat 5]
+"""
+import argparse
+import json
+import os
+import random
+import shutil
+import statistics
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'core.settings')
+
+import django  # noqa: E402
+
+django.setup()
+
+from django.contrib.auth.models import User  # noqa: E402
+from django.core.files.uploadedfile import SimpleUploadedFile  # noqa: E402
+from django.db import connection  # noqa: E402
+from django.test import Client  # noqa: E402
+from django.test.utils import override_settings, setup_test_environment  # noqa: E402
+
+from files.models import FileVersion, UserProfile  # noqa: E402
+
+
+def edited(content, rng, edits):
+    """Content with a few scattered insertions, deletions and overwrites, like a document edit."""
+    data = bytearray(content)
+    for _ in range(edits):
+        position = rng.randrange(len(data))
+        choice = rng.randrange(3)
+        if choice == 0:
+            data[position:position] = rng.randbytes(rng.randint(1, 4096))
+        elif choice == 1:
+            del data[position:position + rng.randint(1, 4096)]
+        else:
+            data[position:position + 512] = rng.randbytes(512)
+    return bytes(data)
+
+
+def upload(client, user, url, content):
+    response = client.post(
+        url,
+        {'file': SimpleUploadedFile('bench.bin', content, content_type='application/octet-stream')},
+        HTTP_USERID=str(user.pk),
+    )
+    assert response.status_code in (200, 201), response.status_code
+    return response.json()
+
+
+def fetch(client, user, url):
+    start = time.perf_counter()
+    response = client.get(url, HTTP_USERID=str(user.pk))
+    assert response.status_code == 200, response.status_code
+    size = sum(len(chunk) for chunk in response.streaming_content)
+    response.close()
+    return time.perf_counter() - start, size
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--size', type=int, default=4 * 1024 * 1024, help='Bytes in the first version')
+    parser.add_argument('--versions', type=int, default=16, help='Versions uploaded after the first')
+    parser.add_argument('--edits', type=int, default=5, help='Edits between consecutive versions')
+    parser.add_argument('--repeat', type=int, default=5)
+    parser.add_argument('--seed', type=int, default=42)
+    args = parser.parse_args()
+
+    rng = random.Random(args.seed)
+    media_root = tempfile.mkdtemp(prefix='filevault-versions-')
+    setup_test_environment()
+    old_name = connection.creation.create_test_db(verbosity=0)
+    try:
+        with override_settings(
+            MEDIA_ROOT=media_root,
+            PREVIEWS={'EAGER': False},
+            VERSIONING={'MAX_CHAIN': args.versions + 1},
+        ):
+            user = User.objects.create_user(username='bench', password='bench')
+            UserProfile.objects.filter(user=user).update(api_calls_per_second=10 ** 6, storage_limit_mb=10 ** 6)
+            client = Client()
+
+            contents = [rng.randbytes(args.size)]
+            file_id = upload(client, user, '/api/files/', contents[0])['id']
+            upload_seconds = []
+            for _ in range(args.versions):
+                contents.append(edited(contents[-1], rng, args.edits))
+                start = time.perf_counter()
+                upload(client, user, f'/api/files/{file_id}/versions/', contents[-1])
+                upload_seconds.append(time.perf_counter() - start)
+
+            current = args.versions + 1
+            rows = []
+            for number in range(current, 0, -1):
+                samples = []
+                for _ in range(args.repeat):
+                    elapsed, size = fetch(client, user, f'/api/files/{file_id}/versions/{number}/')
+                    assert size == len(contents[number - 1])
+                    samples.append(elapsed)
+                median = statistics.median(samples)
+                rows.append({
+                    'version': number,
+                    'chain_length': current - number,
+                    'median_ms': round(median * 1000, 3),
+                    'mb_per_s': round(size / median / 1024 / 1024, 1),
+                })
+
+            stored = sum(FileVersion.objects.filter(file_id=file_id).values_list('stored_size', flat=True))
+            logical = sum(len(content) for content in contents[:-1])
+    finally:
+        connection.creation.destroy_test_db(old_name, verbosity=0)
+        shutil.rmtree(media_root, ignore_errors=True)
+
+    print(json.dumps({
+        'size': args.size,
+        'versions': args.versions,
+        'edits_per_version': args.edits,
+        'median_upload_ms': round(statistics.median(upload_seconds) * 1000, 3),
+        'older_versions_logical_bytes': logical,
+        'older_versions_stored_bytes': stored,
+        'space_saved_percent': round((logical - stored) / logical * 100, 2),
+        'reconstruction': rows,
+    }, indent=2))
+
+
+if __name__ == '__main__':
+    main()
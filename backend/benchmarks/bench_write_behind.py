@@ -0,0 +1,163 @@
+"""
+Upload throughput of one account under concurrent writers, with and without
+the write-behind journal for profile and counter updates.
+
+For each mode, this seeds a throwaway database and starts a local server.
+--clients uploaders then post unique files to the same account. It reports
+uploads/s and p50/p95/p99 latency. The server is then killed without a
+clean shutdown and `manage.py flush_journal` is run, as a crash recovery
+would do.
+
+It then checks that the stored usage matches the uploaded bytes. A quota
+phase then points the same clients at an account that fits exactly
+--quota-files uploads, and checks that no more than that many were
+accepted.
+
+Usage:
+    python benchmarks/bench_write_behind.py [--clients 50] [--uploads 20] [--upload-size 4096]
+"""
+import argparse
+import json
+import os
+import random
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from loadtest import BACKEND_DIR, Client, free_port, manage, multipart_body, percentile, start_server  # noqa: E402
+
+
+def shell(env, code):
+    result = subprocess.run([sys.executable, 'manage.py', 'shell', '-c', code], cwd=BACKEND_DIR, env=env,
+                            check=True, capture_output=True, text=True)
+    return json.loads(result.stdout.strip().splitlines()[-1])
+
+
+def upload_burst(client, user_id, clients, uploads, size, seed):
+    def worker(index):
+        rng = random.Random(seed * 1000 + index)
+        latencies, accepted, rejected, errors = [], 0, 0, 0
+        for number in range(uploads):
+            body, content_type = multipart_body(f'burst-{index}-{number}.bin', rng.randbytes(size))
+            start = time.perf_counter()
+            try:
+                status, _ = client.request('POST', '/api/files/', user_id, body, content_type)
+            except OSError:
+                status = None
+            latencies.append(time.perf_counter() - start)
+            if status == 201:
+                accepted += 1
+            elif status == 429:
+                rejected += 1
+            else:
+                errors += 1
+        return latencies, accepted, rejected, errors
+
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=clients) as executor:
+        results = list(executor.map(worker, range(clients)))
+    wall = time.perf_counter() - start
+
+    latencies = sorted(value for result in results for value in result[0])
+    accepted = sum(result[1] for result in results)
+    to_ms = lambda value: round(value * 1000, 3)  # noqa: E731
+    return {
+        'accepted': accepted,
+        'rejected': sum(result[2] for result in results),
+        'errors': sum(result[3] for result in results),
+        'uploads_per_s': round(accepted / wall, 1),
+        'p50_ms': to_ms(percentile(latencies, 0.50)),
+        'p95_ms': to_ms(percentile(latencies, 0.95)),
+        'p99_ms': to_ms(percentile(latencies, 0.99)),
+    }
+
+
+def run_mode(write_behind, args):
+    workdir = tempfile.mkdtemp(prefix='filevault-writebehind-')
+    env = dict(
+        os.environ,
+        DJANGO_DB_PATH=os.path.join(workdir, 'db.sqlite3'),
+        DJANGO_MEDIA_ROOT=os.path.join(workdir, 'media'),
+        DJANGO_DEBUG='False',
+        METRICS_ENABLED='False',
+        WRITE_BEHIND_ENABLED=str(write_behind),
+        WRITE_BEHIND_PATH=os.path.join(workdir, 'journal.sqlite3'),
+    )
+    manifest_path = os.path.join(workdir, 'manifest.json')
+    server = None
+    try:
+        manage(env, 'migrate')
+        manage(env, 'seed_benchmark', '--users', '2', '--files', '0', '--seed', str(args.seed), '--manifest', manifest_path)
+        with open(manifest_path) as f:
+            burst_user, quota_user = list(json.load(f)['users'])
+        quota_bytes = args.quota_files * args.upload_size
+        # storage_limit_mb is whole megabytes, so fill the rest of the last megabyte up front
+        limit_mb = -(-quota_bytes // (1024 * 1024))
+        shell(env, (
+            "import json; from files.models import UserProfile; "
+            f"UserProfile.objects.filter(user_id={quota_user}).update("
+            f"storage_limit_mb={limit_mb}, current_storage_used={limit_mb * 1024 * 1024 - quota_bytes}); "
+            "print(json.dumps(True))"
+        ))
+
+        port = free_port()
+        server = start_server(env, port, args.server, args.workers)
+        client = Client(port)
+        burst = upload_burst(client, burst_user, args.clients, args.uploads, args.upload_size, args.seed)
+        quota = upload_burst(client, quota_user, args.clients, max(1, 2 * args.quota_files // args.clients),
+                             args.upload_size, args.seed + 1)
+
+        # Kill without a clean shutdown; queued deltas must survive in the journal
+        server.kill()
+        server.wait()
+        server = None
+        if write_behind:
+            manage(env, 'flush_journal')
+
+        usage = shell(env, (
+            "import json; from files.models import UserProfile; "
+            "print(json.dumps(dict(UserProfile.objects.values_list('user_id', 'current_storage_used'))))"
+        ))
+        burst['stored_usage_matches'] = usage[str(burst_user)] == burst['accepted'] * args.upload_size
+        quota['quota_files'] = args.quota_files
+        quota['quota_respected'] = quota['accepted'] == args.quota_files
+        return {'burst': burst, 'quota': quota}
+    finally:
+        if server:
+            server.kill()
+            server.wait()
+        shutil.rmtree(workdir, ignore_errors=True)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--clients', type=int, default=50)
+    parser.add_argument('--uploads', type=int, default=20, help='Uploads per client')
+    parser.add_argument('--upload-size', type=int, default=4096)
+    parser.add_argument('--quota-files', type=int, default=200, help='Uploads that fit in the quota phase account')
+    # runserver's listen backlog of 5 resets connections under 50 concurrent clients
+    parser.add_argument('--server', choices=['runserver', 'gunicorn'], default='gunicorn')
+    parser.add_argument('--workers', type=int, default=4, help='gunicorn workers')
+    parser.add_argument('--seed', type=int, default=42)
+    args = parser.parse_args()
+
+    results = {
+        'clients': args.clients,
+        'uploads_per_client': args.uploads,
+        'upload_size': args.upload_size,
+        'server': args.server,
+    }
+    for write_behind in (False, True):
+        mode = 'write_behind' if write_behind else 'direct'
+        results[mode] = run_mode(write_behind, args)
+        print(f'{mode:>12}: {json.dumps(results[mode])}', file=sys.stderr)
+    print(json.dumps(results, indent=2))
+
+
+if __name__ == '__main__':
+    main()
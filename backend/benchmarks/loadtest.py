@@ -0,0 +1,306 @@
+"""
+Reproducible API load test with baseline comparison.
+
+Seeds a throwaway database and media root with `manage.py seed_benchmark`,
+starts a local server against them, drives each scenario with concurrent
+HTTP clients, and writes per-scenario p50/p95/p99 latency and throughput
+to JSON. With --baseline, results are compared against a stored run. The
+exit status is 1 if any scenario regressed by more than --threshold percent.
+
+Usage:
+    python benchmarks/loadtest.py --files 10000 --users 10 --dup-ratio 0.2 \\
+        --concurrency 16 --requests 500 --output results.json
+
+    # Record a baseline, then check later runs against it
+    python benchmarks/loadtest.py --output benchmarks/baselines/local.json
+    python benchmarks/loadtest.py --baseline benchmarks/baselines/local.json --threshold 15
+
+Scenarios: upload, list, search, stats, download, delete (run in that order;
+delete only removes files created by the upload scenario).
+"""
+import argparse
+import http.client
+import json
+import os
+import platform
+import random
+import shutil
+import socket
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+
+BACKEND_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+SCENARIOS = ['upload', 'list', 'search', 'stats', 'download', 'delete']
+SEARCH_TERMS = ['report', 'invoice', 'photo', 'backup', 'notes', 'draft', 'config', 'archive', 'scan', 'slides']
+
+# Lower is better for latencies, higher is better for throughput
+LATENCY_KEYS = ['p50_ms', 'p95_ms', 'p99_ms']
+
+
+def free_port():
+    with socket.socket() as s:
+        s.bind(('127.0.0.1', 0))
+        return s.getsockname()[1]
+
+
+def manage(env, *args):
+    subprocess.run([sys.executable, 'manage.py', *args], cwd=BACKEND_DIR, env=env, check=True,
+                   stdout=subprocess.DEVNULL)
+
+
+def start_server(env, port, server, workers):
+    if server == 'gunicorn':
+        command = ['gunicorn', '--bind', f'127.0.0.1:{port}', '--workers', str(workers), 'core.wsgi:application']
+    else:
+        command = [sys.executable, 'manage.py', 'runserver', f'127.0.0.1:{port}', '--noreload']
+    process = subprocess.Popen(command, cwd=BACKEND_DIR, env=env, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+
+    deadline = time.monotonic() + 60
+    while time.monotonic() < deadline:
+        try:
+            connection = http.client.HTTPConnection('127.0.0.1', port, timeout=2)
+            connection.request('GET', '/api/info/')
+            connection.getresponse().read()
+            return process
+        except OSError:
+            time.sleep(0.2)
+    process.terminate()
+    raise RuntimeError('Server did not start within 60s')
+
+
+def multipart_body(filename, content):
+    boundary = uuid.uuid4().hex
+    body = (
+        f'--{boundary}\r\n'
+        f'Content-Disposition: form-data; name="file"; filename="{filename}"\r\n'
+        f'Content-Type: application/octet-stream\r\n\r\n'
+    ).encode() + content + f'\r\n--{boundary}--\r\n'.encode()
+    return body, f'multipart/form-data; boundary={boundary}'
+
+
+class Client:
+    """One keep-alive connection per worker thread."""
+    def __init__(self, port):
+        self.port = port
+        self._local = threading.local()
+
+    def request(self, method, path, user_id, body=None, content_type=None):
+        headers = {'UserId': str(user_id)}
+        if content_type:
+            headers['Content-Type'] = content_type
+        for attempt in range(2):
+            connection = getattr(self._local, 'connection', None)
+            if connection is None:
+                connection = self._local.connection = http.client.HTTPConnection('127.0.0.1', self.port, timeout=60)
+            try:
+                connection.request(method, path, body=body, headers=headers)
+                response = connection.getresponse()
+                data = response.read()
+                return response.status, data
+            except (http.client.HTTPException, OSError):
+                # The server closed the keep-alive connection; reconnect once
+                connection.close()
+                self._local.connection = None
+                if attempt:
+                    raise
+
+
+def percentile(sorted_values, fraction):
+    if not sorted_values:
+        return None
+    index = max(0, min(len(sorted_values) - 1, int(round(fraction * len(sorted_values) + 0.5)) - 1))
+    return sorted_values[index]
+
+
+def run_scenario(name, client, manifest, args, rng, uploaded):
+    users = list(manifest['users'])
+    tasks = []
+    for _ in range(args.requests):
+        user_id = rng.choice(users)
+        if name == 'upload':
+            size = rng.randint(256, args.upload_size)
+            tasks.append(('POST', '/api/files/', user_id, (f'load-{uuid.uuid4().hex}.bin', rng.randbytes(size))))
+        elif name == 'list':
+            tasks.append(('GET', '/api/files/', user_id, None))
+        elif name == 'search':
+            tasks.append(('GET', f'/api/files/?search={rng.choice(SEARCH_TERMS)}', user_id, None))
+        elif name == 'stats':
+            tasks.append(('GET', '/api/storage_stats/', user_id, None))
+        elif name == 'download':
+            file_id = rng.choice(manifest['users'][user_id])
+            tasks.append(('GET', f'/api/files/{file_id}/download/', user_id, None))
+        elif name == 'delete':
+            if not uploaded:
+                break
+            user_id, file_id = uploaded.pop()
+            tasks.append(('DELETE', f'/api/files/{file_id}/', user_id, None))
+
+    lock = threading.Lock()
+    latencies = []
+    errors = {}
+
+    def execute(task):
+        method, path, user_id, payload = task
+        body = content_type = None
+        if payload:
+            body, content_type = multipart_body(*payload)
+        start = time.perf_counter()
+        try:
+            status, data = client.request(method, path, user_id, body, content_type)
+        except OSError as exc:
+            status, data = type(exc).__name__, b''
+        elapsed = time.perf_counter() - start
+        with lock:
+            if isinstance(status, int) and 200 <= status < 300:
+                latencies.append(elapsed)
+                if method == 'POST':
+                    uploaded.append((user_id, json.loads(data)['id'] if status == 201 else json.loads(data)['file']['id']))
+            else:
+                errors[str(status)] = errors.get(str(status), 0) + 1
+
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=args.concurrency) as executor:
+        list(executor.map(execute, tasks))
+    wall = time.perf_counter() - start
+
+    latencies.sort()
+    to_ms = lambda value: round(value * 1000, 3) if value is not None else None  # noqa: E731
+    return {
+        'requests': len(tasks),
+        'ok': len(latencies),
+        'errors': errors,
+        'throughput_rps': round(len(latencies) / wall, 2) if wall else 0,
+        'p50_ms': to_ms(percentile(latencies, 0.50)),
+        'p95_ms': to_ms(percentile(latencies, 0.95)),
+        'p99_ms': to_ms(percentile(latencies, 0.99)),
+    }
+
+
+def compare(results, baseline, threshold):
+    """Return a list of human-readable regressions beyond threshold percent."""
+    regressions = []
+    for name, current in results['scenarios'].items():
+        previous = baseline.get('scenarios', {}).get(name)
+        if not previous:
+            continue
+        for key in LATENCY_KEYS:
+            if current[key] is not None and previous.get(key):
+                change = (current[key] - previous[key]) / previous[key] * 100
+                if change > threshold:
+                    regressions.append(f'{name} {key}: {previous[key]} -> {current[key]} (+{change:.1f}%)')
+        if previous.get('throughput_rps'):
+            change = (current['throughput_rps'] - previous['throughput_rps']) / previous['throughput_rps'] * 100
+            if change < -threshold:
+                regressions.append(
+                    f"{name} throughput_rps: {previous['throughput_rps']} -> {current['throughput_rps']} ({change:.1f}%)"
+                )
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--users', type=int, default=10)
+    parser.add_argument('--files', type=int, default=10000, help='Seeded file rows (10k-1M)')
+    parser.add_argument('--dup-ratio', type=float, default=0.2)
+    parser.add_argument('--size-mix', choices=['small', 'mixed', 'large'], default='mixed')
+    parser.add_argument('--seed', type=int, default=42)
+    parser.add_argument('--scenarios', default=','.join(SCENARIOS))
+    parser.add_argument('--requests', type=int, default=500, help='Requests per scenario')
+    parser.add_argument('--concurrency', type=int, default=16)
+    parser.add_argument('--upload-size', type=int, default=64 * 1024, help='Maximum bytes per uploaded file')
+    parser.add_argument('--server', choices=['runserver', 'gunicorn'], default='runserver')
+    parser.add_argument('--workers', type=int, default=4, help='gunicorn workers')
+    parser.add_argument('--workdir', default=None, help='Keep the seeded database and media here (default: temporary)')
+    parser.add_argument('--output', default=None, help='Write results JSON here')
+    parser.add_argument('--baseline', default=None, help='Compare against this results JSON')
+    parser.add_argument('--threshold', type=float, default=10.0, help='Allowed regression in percent')
+    args = parser.parse_args()
+
+    scenarios = [name.strip() for name in args.scenarios.split(',') if name.strip()]
+    unknown = set(scenarios) - set(SCENARIOS)
+    if unknown:
+        parser.error(f"Unknown scenario(s): {', '.join(sorted(unknown))}")
+
+    workdir = args.workdir or tempfile.mkdtemp(prefix='filevault-loadtest-')
+    os.makedirs(workdir, exist_ok=True)
+    env = dict(
+        os.environ,
+        DJANGO_DB_PATH=os.path.join(workdir, 'db.sqlite3'),
+        DJANGO_MEDIA_ROOT=os.path.join(workdir, 'media'),
+        DJANGO_DEBUG='False',
+    )
+    manifest_path = os.path.join(workdir, 'manifest.json')
+
+    server = None
+    try:
+        # Same schema setup as start.sh
+        manage(env, 'migrate')
+        seed_started = time.perf_counter()
+        manage(env, 'seed_benchmark', '--users', str(args.users), '--files', str(args.files),
+               '--dup-ratio', str(args.dup_ratio), '--size-mix', args.size_mix, '--seed', str(args.seed),
+               '--manifest', manifest_path)
+        seed_seconds = time.perf_counter() - seed_started
+        with open(manifest_path) as f:
+            manifest = json.load(f)
+
+        port = free_port()
+        server = start_server(env, port, args.server, args.workers)
+        client = Client(port)
+        rng = random.Random(args.seed)
+        uploaded = []
+
+        results = {
+            'meta': {
+                'timestamp': time.strftime('%Y-%m-%dT%H:%M:%S%z'),
+                'python': platform.python_version(),
+                'platform': platform.platform(),
+                'server': args.server,
+                'users': args.users,
+                'files': args.files,
+                'dup_ratio': args.dup_ratio,
+                'size_mix': args.size_mix,
+                'seed': args.seed,
+                'requests_per_scenario': args.requests,
+                'concurrency': args.concurrency,
+                'seed_seconds': round(seed_seconds, 2),
+            },
+            'scenarios': {},
+        }
+        for name in SCENARIOS:
+            if name in scenarios:
+                results['scenarios'][name] = run_scenario(name, client, manifest, args, rng, uploaded)
+                print(f"{name:>9}: {json.dumps(results['scenarios'][name])}", file=sys.stderr)
+    finally:
+        if server:
+            server.terminate()
+            server.wait()
+        if not args.workdir:
+            shutil.rmtree(workdir, ignore_errors=True)
+
+    output = json.dumps(results, indent=2)
+    if args.output:
+        os.makedirs(os.path.dirname(os.path.abspath(args.output)), exist_ok=True)
+        with open(args.output, 'w') as f:
+            f.write(output + '\n')
+    else:
+        print(output)
+
+    if args.baseline:
+        with open(args.baseline) as f:
+            regressions = compare(results, json.load(f), args.threshold)
+        if regressions:
+            print(f'Regressions beyond {args.threshold}%:', file=sys.stderr)
+            for line in regressions:
+                print(f'  {line}', file=sys.stderr)
+            sys.exit(1)
+        print(f'No regressions beyond {args.threshold}% against {args.baseline}', file=sys.stderr)
+
+
+if __name__ == '__main__':
+    main()
@@ -44,6 +44,7 @@ INSTALLED_APPS = [
 ]
 
 MIDDLEWARE = [
+  "files.middleware.RequestMetricsMiddleware",  # First, so it times the whole stack
   "django.middleware.security.SecurityMiddleware",
   "whitenoise.middleware.WhiteNoiseMiddleware",
   "django.contrib.sessions.middleware.SessionMiddleware",
@@ -81,7 +82,7 @@ WSGI_APPLICATION = "core.wsgi.application"
 DATABASES = {
   "default": {
     "ENGINE": "django.db.backends.sqlite3",
-    "NAME": os.path.join(BASE_DIR, 'data', 'db.sqlite3'),
+    "NAME": os.environ.get('DJANGO_DB_PATH', os.path.join(BASE_DIR, 'data', 'db.sqlite3')),
   }
 }
 
@@ -126,7 +127,7 @@ STATICFILES_STORAGE = 'whitenoise.storage.CompressedManifestStaticFilesStorage'
 
 # Media files
 MEDIA_URL = '/media/'
-MEDIA_ROOT = os.path.join(BASE_DIR, 'media')
+MEDIA_ROOT = os.environ.get('DJANGO_MEDIA_ROOT', os.path.join(BASE_DIR, 'media'))
 
 # Default primary key field type
 # https://docs.djangoproject.com/en/5.1/ref/settings/#default-auto-field
@@ -150,3 +151,119 @@ REST_FRAMEWORK = {
         'rest_framework.parsers.FormParser',
     ],
 }
+
+# Hot/cold storage tiering
+# Blobs not read for COLD_AFTER_DAYS are moved from MEDIA_ROOT to COLD_ROOT by
+# `manage.py apply_tiering`; COLD_TIER is 'cold' (plain copy) or 'archive' (gzip)
+STORAGE_TIERING = {
+    'COLD_ROOT': os.environ.get('COLD_STORAGE_ROOT', os.path.join(BASE_DIR, 'cold_storage')),
+    'COLD_TIER': os.environ.get('COLD_STORAGE_TIER', 'archive'),
+    'COLD_AFTER_DAYS': int(os.environ.get('COLD_AFTER_DAYS', 90)),
+    'MAX_ACCESS_COUNT': 0,  # Only demote files read at most this many times (0 = ignore hit count)
+    'ACCESS_FLUSH_INTERVAL': 5.0,  # Seconds between batched access-statistics writes
+    'ACCESS_FLUSH_BATCH_SIZE': 500,  # Flush early once this many files have pending hits
+}
+
+# In-process LRU cache of small file contents, keyed by file_hash
+CONTENT_CACHE = {
+    'MAX_BYTES': int(os.environ.get('CONTENT_CACHE_MAX_BYTES', 64 * 1024 * 1024)),  # Total budget per worker
+    'MAX_ENTRY_BYTES': int(os.environ.get('CONTENT_CACHE_MAX_ENTRY_BYTES', 256 * 1024)),  # Only files up to this size are admitted
+}
+
+# Hashing service
+HASHING = {
+    'BUFFER_SIZE': 1024 * 1024,  # Read buffer when hashlib.file_digest isn't available
+    'WORKERS': int(os.environ.get('HASHING_WORKERS', min(32, (os.cpu_count() or 1) * 2))),  # Threads for bulk hashing
+    'PREFILTER_SAMPLE_BYTES': 64 * 1024,  # Head/tail bytes fingerprinted before confirming duplicates with SHA-256
+}
+
+# Request instrumentation exposed at /metrics
+METRICS = {
+    'ENABLED': os.environ.get('METRICS_ENABLED', 'True') == 'True',
+    'SLOW_REQUEST_MS': int(os.environ.get('SLOW_REQUEST_MS', 1000)),  # Requests slower than this are logged
+    # Workers write their values here and a scrape merges them all; unset, each process reports only its own
+    'MULTIPROCESS_DIR': os.environ.get('METRICS_MULTIPROCESS_DIR') or None,
+    'SNAPSHOT_INTERVAL': 1.0,  # Seconds between snapshots of a worker's values
+    # /metrics is unauthenticated; per-user bandwidth gauges label user ids, so they're off unless it's firewalled
+    'PER_USER_LABELS': os.environ.get('METRICS_PER_USER_LABELS', 'False') == 'True',
+}
+
+# Derived artifacts (thumbnails, text previews, metadata), keyed by file_hash
+PREVIEWS = {
+    'ROOT': os.environ.get('PREVIEWS_ROOT') or None,  # Defaults to MEDIA_ROOT/derived
+    'THUMBNAIL_SIZES': [64, 256, 1024],  # Pixel bounding boxes; requires Pillow
+    'TEXT_LINES': 50,  # Lines kept in text previews
+    'TEXT_MAX_BYTES': 64 * 1024,
+    'EAGER': True,  # Generate default artifacts in the background after upload
+    'WORKERS': 2,
+    'CACHE_MAX_AGE': 60,  # Seconds a client may reuse a preview before revalidating; new versions change it
+}
+
+# Checks run on every uploaded chunk in the same pass as the SHA-256 hash; see files/inspection.py.
+# Signature scanning is a local stand-in for an anti-virus engine and is off unless enabled
+UPLOAD_INSPECTION = {
+    'INSPECTORS': ['files.inspection.MimeSniffer'] + (
+        ['files.inspection.SignatureScanner'] if os.environ.get('UPLOAD_SIGNATURE_SCAN', 'False') == 'True' else []
+    ),
+    'SNIFF_BYTES': 4096,  # Leading bytes kept for MIME sniffing
+    'SIGNATURES_PATH': os.environ.get('UPLOAD_SIGNATURES_PATH') or None,  # `name:hexbytes` lines, added to the EICAR test signature
+}
+
+# File version history: older versions are reverse deltas against the next
+# newer one, with a full keyframe at least every MAX_CHAIN versions
+VERSIONING = {
+    'ROOT': os.environ.get('VERSIONS_ROOT') or None,  # Defaults to MEDIA_ROOT/versions
+    'MAX_CHAIN': int(os.environ.get('VERSIONING_MAX_CHAIN', 8)),  # Deltas applied at most to rebuild a version
+    'MAX_DELTA_BYTES': 64 * 1024 * 1024,  # Larger versions are always stored in full
+    'BLOCK_SIZE': 2048,  # Granularity of matches between versions
+    'SPOOL_BYTES': 8 * 1024 * 1024,  # Intermediate versions above this spill to disk
+}
+
+# Fleet-wide analytics, served from daily rollup tables
+ANALYTICS = {
+    'TOP_USERS': 10,  # Default length of the top users list
+    'GROWTH_DAYS': 30,  # Default window of the growth report
+}
+
+# Write-behind batching of counter updates (storage usage, file type counts,
+# analytics rollups) through a durable local journal. The journal is per
+# host, so enable it only when one host serves each account's uploads.
+WRITE_BEHIND = {
+    'ENABLED': os.environ.get('WRITE_BEHIND_ENABLED', 'False') == 'True',
+    'PATH': os.environ.get('WRITE_BEHIND_PATH', os.path.join(BASE_DIR, 'data', 'writebehind.sqlite3')),
+    'FLUSH_INTERVAL_MS': int(os.environ.get('WRITE_BEHIND_FLUSH_INTERVAL_MS', 200)),
+    'FLUSH_BATCH_SIZE': 5000,  # Journal entries folded into one database transaction
+}
+
+# Soft delete: deleted files sit in the trash, restorable, until `manage.py reap_trash`
+# purges them in batches RETENTION_DAYS later (or right away once the trash is emptied)
+TRASH = {
+    'RETENTION_DAYS': int(os.environ.get('TRASH_RETENTION_DAYS', 30)),
+    'REAP_BATCH_SIZE': 500,  # Files purged per batch, one transaction each
+}
+
+# Folder hierarchy (see files/folders.py)
+FOLDERS = {
+    'MAX_DEPTH': 32,  # Bounds the ancestors a file's size is added to
+}
+
+# Change feed for sync clients (GET /api/files/changes/). `manage.py compact_changes` drops
+# superseded events and expires tombstones; cursors older than an expired one must resync
+CHANGE_FEED = {
+    'PAGE_SIZE': 500,  # Events per response
+    # Longest long-poll; holds a worker thread meanwhile, so keep it well below the gunicorn worker timeout
+    'MAX_WAIT_SECONDS': int(os.environ.get('CHANGE_FEED_MAX_WAIT_SECONDS', 20)),
+    'POLL_INTERVAL_SECONDS': 1.0,  # How often a long-poll checks for changes made by other workers
+    'TOMBSTONE_RETENTION_DAYS': int(os.environ.get('CHANGE_FEED_TOMBSTONE_RETENTION_DAYS', 30)),
+    'COMPACT_BATCH_SIZE': 5000,  # Event ids compacted per transaction
+}
+
+# Bandwidth shaping (see files/bandwidth.py). Per-user limits are UserProfile.upload_bytes_per_second
+# and download_bytes_per_second; these caps are shared fairly by every transfer on the host. 0 disables
+BANDWIDTH = {
+    'GLOBAL_UPLOAD_BYTES_PER_SECOND': int(os.environ.get('BANDWIDTH_GLOBAL_UPLOAD_BYTES_PER_SECOND', 0)),
+    'GLOBAL_DOWNLOAD_BYTES_PER_SECOND': int(os.environ.get('BANDWIDTH_GLOBAL_DOWNLOAD_BYTES_PER_SECOND', 0)),
+    'PATH': os.environ.get('BANDWIDTH_STATE_PATH', os.path.join(BASE_DIR, 'data', 'bandwidth.state')),
+    'BURST_SECONDS': 0.5,  # Bucket size, in seconds of the rate
+    'SHAPED_BLOCK_SIZE': 64 * 1024,  # Pacing granularity of shaped downloads
+}
@@ -0,0 +1,38 @@
+"""
+API-only settings for the gunicorn workers.
+
+The workers serve the JSON API and, with DEBUG, the uploaded files it links
+to. Requests authenticate with the UserId header, so the admin, sessions,
+messages, templates, static files and token auth are dropped to cut boot
+time and per-worker memory. Management
+commands and the test suite keep using core.settings.
+
+Usage:
+    DJANGO_SETTINGS_MODULE=core.settings_api gunicorn -c gunicorn.conf.py core.wsgi:application
+"""
+from .settings import *  # noqa: F401,F403
+
+INSTALLED_APPS = [
+  "django.contrib.auth",  # User model and AnonymousUser
+  "django.contrib.contenttypes",  # Required by auth
+  "rest_framework",
+  "files",
+]
+
+MIDDLEWARE = [
+  "files.middleware.RequestMetricsMiddleware",  # First, so it times the whole stack
+  "django.middleware.security.SecurityMiddleware",
+  "django.middleware.common.CommonMiddleware",
+]
+
+ROOT_URLCONF = "core.urls_api"
+
+# No template-rendered pages; DRF's browsable API is disabled below
+TEMPLATES = []
+
+REST_FRAMEWORK = {
+    **REST_FRAMEWORK,  # noqa: F405
+    'DEFAULT_RENDERER_CLASSES': [
+        'rest_framework.renderers.JSONRenderer',
+    ],
+}
@@ -18,8 +18,10 @@ from django.contrib import admin
 from django.urls import path, include
 from django.conf import settings
 from django.conf.urls.static import static
+from files.views import prometheus_metrics
 
 urlpatterns = [
     path('admin/', admin.site.urls),
     path('api/', include('files.urls')),
+    path('metrics', prometheus_metrics, name='metrics'),  # Prometheus scrape endpoint
 ] + static(settings.MEDIA_URL, document_root=settings.MEDIA_ROOT)
@@ -0,0 +1,14 @@
+"""
+URL configuration for the API-only settings profile (core.settings_api):
+the API, the Prometheus endpoint and, with DEBUG, the media files that
+FileSerializer links to, without the admin.
+"""
+from django.urls import path, include
+from django.conf import settings
+from django.conf.urls.static import static
+from files.views import prometheus_metrics
+
+urlpatterns = [
+    path('api/', include('files.urls')),
+    path('metrics', prometheus_metrics, name='metrics'),  # Prometheus scrape endpoint
+] + static(settings.MEDIA_URL, document_root=settings.MEDIA_ROOT)
@@ -14,3 +14,23 @@ from django.core.wsgi import get_wsgi_application
 os.environ.setdefault("DJANGO_SETTINGS_MODULE", "core.settings")
 
 application = get_wsgi_application()
+
+
+def warm_up():
+    """
+    Import the URLconf, views, serializers and DRF's configured classes now
+    instead of on the first request. Nothing imported by django.setup()
+    pulls these in, so management commands never pay for them; under
+    gunicorn --preload this runs once in the master and the workers share
+    the pages copy-on-write.
+    """
+    from django.urls import get_resolver
+    from rest_framework.settings import api_settings
+
+    get_resolver().url_patterns
+    for name in ('DEFAULT_AUTHENTICATION_CLASSES', 'DEFAULT_THROTTLE_CLASSES',
+                 'DEFAULT_PARSER_CLASSES', 'DEFAULT_RENDERER_CLASSES'):
+        getattr(api_settings, name)
+
+
+warm_up()
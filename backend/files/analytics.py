@@ -0,0 +1,188 @@
+from collections import defaultdict
+from datetime import timedelta
+
+from django.conf import settings
+from django.db import transaction
+from django.db.models import Count, Q, Sum
+from django.db.models.functions import TruncDate
+from django.utils import timezone
+
+from . import counters
+
+DEFAULTS = {
+    'TOP_USERS': 10,
+    'GROWTH_DAYS': 30,
+}
+
+
+def get_setting(name):
+    """Read an analytics option from settings.ANALYTICS, falling back to defaults."""
+    return getattr(settings, 'ANALYTICS', {}).get(name, DEFAULTS[name])
+
+
+def record_added(file_type, files, logical_bytes, physical_bytes, day=None):
+    """
+    Count new File rows in today's rollups. physical_bytes is the part that
+    took new blob space, i.e. zero for duplicates.
+    """
+    from .models import DailyFileTypeRollup, DailyStorageRollup
+
+    day = day or timezone.localdate()
+    counters.increment(
+        DailyStorageRollup, {'date': day},
+        files_added=files, bytes_added=logical_bytes, physical_bytes_added=physical_bytes,
+    )
+    counters.increment(
+        DailyFileTypeRollup, {'date': day, 'file_type': file_type},
+        files_added=files, bytes_added=logical_bytes,
+    )
+
+
+def record_removed(file_type, files, logical_bytes, physical_bytes, day=None):
+    """Count deleted File rows in today's rollups."""
+    from .models import DailyFileTypeRollup, DailyStorageRollup
+
+    day = day or timezone.localdate()
+    counters.increment(
+        DailyStorageRollup, {'date': day},
+        files_removed=files, bytes_removed=logical_bytes, physical_bytes_removed=physical_bytes,
+    )
+    counters.increment(
+        DailyFileTypeRollup, {'date': day, 'file_type': file_type},
+        files_removed=files, bytes_removed=logical_bytes,
+    )
+
+
+def record_bulk(records):
+    """Count rows inserted with bulk_create, which sends no post_save signals."""
+    by_type = defaultdict(lambda: [0, 0, 0])
+    for record in records:
+        totals = by_type[record.file_type]
+        totals[0] += 1
+        totals[1] += record.size
+        if not record.is_duplicate:
+            totals[2] += record.size
+    for file_type, (files, logical_bytes, physical_bytes) in by_type.items():
+        record_added(file_type, files, logical_bytes, physical_bytes)
+
+
+def _net(row, prefix=''):
+    return (row[f'{prefix}added'] or 0) - (row[f'{prefix}removed'] or 0)
+
+
+def summary():
+    """Fleet-wide file and byte totals, with dedup savings."""
+    from .models import DailyStorageRollup, UserProfile
+
+    totals = DailyStorageRollup.objects.aggregate(
+        files_added=Sum('files_added'), files_removed=Sum('files_removed'),
+        bytes_added=Sum('bytes_added'), bytes_removed=Sum('bytes_removed'),
+        physical_bytes_added=Sum('physical_bytes_added'), physical_bytes_removed=Sum('physical_bytes_removed'),
+    )
+    logical = _net(totals, 'bytes_')
+    physical = _net(totals, 'physical_bytes_')
+    savings = logical - physical
+    return {
+        'users': UserProfile.objects.count(),
+        'files': _net(totals, 'files_'),
+        'logical_bytes': logical,
+        'physical_bytes': physical,
+        'dedup_savings': savings,
+        'dedup_savings_percentage': round(savings / logical * 100, 2) if logical > 0 else 0,
+    }
+
+
+def top_users(limit=None):
+    """Users with the most stored bytes, read from the indexed profile counter."""
+    from .models import UserProfile
+
+    limit = limit or get_setting('TOP_USERS')
+    rows = (
+        UserProfile.objects.order_by('-current_storage_used')
+        .values('user_id', 'user__username', 'current_storage_used', 'storage_limit_mb')[:limit]
+    )
+    return [
+        {
+            'user_id': row['user_id'],
+            'username': row['user__username'],
+            'storage_used': row['current_storage_used'],
+            'storage_limit_bytes': row['storage_limit_mb'] * 1024 * 1024,
+        }
+        for row in rows
+    ]
+
+
+def file_type_distribution():
+    """Current file count and bytes per MIME type, largest first."""
+    from .models import DailyFileTypeRollup
+
+    rows = DailyFileTypeRollup.objects.values('file_type').annotate(
+        files_added=Sum('files_added'), files_removed=Sum('files_removed'),
+        bytes_added=Sum('bytes_added'), bytes_removed=Sum('bytes_removed'),
+    )
+    distribution = [
+        {'file_type': row['file_type'], 'files': _net(row, 'files_'), 'bytes': _net(row, 'bytes_')}
+        for row in rows
+    ]
+    return sorted((row for row in distribution if row['files'] > 0), key=lambda row: -row['bytes'])
+
+
+def growth(days=None):
+    """Per-day uploads, deletions and net growth over the last `days` days."""
+    from .models import DailyStorageRollup
+
+    days = days or get_setting('GROWTH_DAYS')
+    since = timezone.localdate() - timedelta(days=days - 1)
+    rows = DailyStorageRollup.objects.filter(date__gte=since).order_by('date').values()
+    return [
+        {
+            'date': row['date'].isoformat(),
+            'files_added': row['files_added'],
+            'files_removed': row['files_removed'],
+            'bytes_added': row['bytes_added'],
+            'bytes_removed': row['bytes_removed'],
+            'net_bytes': row['bytes_added'] - row['bytes_removed'],
+            'net_physical_bytes': row['physical_bytes_added'] - row['physical_bytes_removed'],
+        }
+        for row in rows
+    ]
+
+
+def rebuild():
+    """
+    Recompute the rollups from the File table with grouped aggregate queries.
+
+    Deletions that happened before the rebuild can't be recovered, so each
+    day ends up with the uploads that still exist. Returns the number of
+    daily rows written.
+    """
+    from .models import DailyFileTypeRollup, DailyStorageRollup, File
+
+    rows = (
+        File.objects.order_by()
+        .annotate(day=TruncDate('uploaded_at'))
+        .values('day', 'file_type')
+        .annotate(
+            files=Count('id'),
+            logical_bytes=Sum('size'),
+            physical_bytes=Sum('size', filter=Q(is_duplicate=False)),
+        )
+    )
+    by_day = {}
+    type_rollups = []
+    for row in rows:
+        totals = by_day.setdefault(row['day'], DailyStorageRollup(date=row['day']))
+        totals.files_added += row['files']
+        totals.bytes_added += row['logical_bytes']
+        totals.physical_bytes_added += row['physical_bytes'] or 0
+        type_rollups.append(DailyFileTypeRollup(
+            date=row['day'], file_type=row['file_type'],
+            files_added=row['files'], bytes_added=row['logical_bytes'],
+        ))
+
+    with transaction.atomic():
+        DailyStorageRollup.objects.all().delete()
+        DailyFileTypeRollup.objects.all().delete()
+        DailyStorageRollup.objects.bulk_create(by_day.values(), batch_size=1000)
+        DailyFileTypeRollup.objects.bulk_create(type_rollups, batch_size=1000)
+    return len(by_day)
@@ -0,0 +1,364 @@
+"""
+Byte-rate shaping for uploads and downloads.
+
+Each direction has a global token bucket capped at
+GLOBAL_<DIRECTION>_BYTES_PER_SECOND. Each user has a bucket of their own,
+limited by UserProfile.upload_bytes_per_second / download_bytes_per_second.
+A value of 0 means no limit. A transfer takes tokens from both buckets for
+every chunk it sends or receives, then sleeps off any debt. The sleep
+delays the next read from the socket or the disk, so the client sees TCP
+backpressure.
+
+The buckets live in a small memory-mapped file (PATH), guarded by flock,
+so every worker process on the host draws from the same buckets. Their
+timestamps come from the monotonic clock, so gunicorn.conf.py resets the
+file when the server starts.
+
+Fair scheduling works at two levels. When a global cap applies, the
+active users' buckets refill at max-min fair shares of it:
+- no user gets more than their own limit;
+- what a capped user leaves unused is split evenly among the others.
+The shares are recomputed only when a transfer starts or ends, and they
+add up to at most the global rate. One user's burst therefore can't
+starve another. A user's own concurrent transfers take turns on the
+user's bucket in SHAPED_BLOCK_SIZE pieces.
+
+Transfers with no limit on them skip all of this, so unlimited downloads
+keep the zero-copy sendfile path. Shaped transfers report their current
+throughput to the Prometheus metrics, per user if METRICS PER_USER_LABELS
+is set.
+
+A shaped transfer sleeps in the thread serving it for as long as it
+lasts. gunicorn.conf.py therefore uses threaded workers: a slow transfer
+ties up one thread rather than a whole worker, and the worker timeout
+doesn't cut it off.
+"""
+import fcntl
+import math
+import mmap
+import os
+import struct
+import threading
+import time
+import zlib
+from contextlib import contextmanager
+
+from django.conf import settings
+from django.core.files.uploadhandler import FileUploadHandler
+
+from . import metrics
+
+DEFAULTS = {
+    'GLOBAL_UPLOAD_BYTES_PER_SECOND': 0,
+    'GLOBAL_DOWNLOAD_BYTES_PER_SECOND': 0,
+    'PATH': None,  # Defaults to BASE_DIR/data/bandwidth.state
+    'SLOTS': 4096,
+    'BURST_SECONDS': 0.5,
+    'SHAPED_BLOCK_SIZE': 64 * 1024,
+    'IDLE_SECONDS': 30,
+    'THROUGHPUT_WINDOW_SECONDS': 5.0,
+}
+
+UPLOAD = 'upload'
+DOWNLOAD = 'download'
+DIRECTIONS = (UPLOAD, DOWNLOAD)
+
+# Per direction: global tokens, last refill
+GLOBAL = struct.Struct('<dd')
+# Per (user, direction): key, active transfers, limit, fair share, tokens, last refill,
+# throughput (exponentially decayed bytes/s) and when it was last updated
+SLOT = struct.Struct('<qqdddddd')
+HEADER_SIZE = GLOBAL.size * len(DIRECTIONS)
+
+
+def get_setting(name):
+    """Read a bandwidth option from settings.BANDWIDTH, falling back to defaults."""
+    return getattr(settings, 'BANDWIDTH', {}).get(name, DEFAULTS[name])
+
+
+def global_rate(direction):
+    return get_setting(f'GLOBAL_{direction.upper()}_BYTES_PER_SECOND')
+
+
+def _elapsed(now, stamp):
+    """
+    Seconds from a monotonic stamp to now. The clock restarts with the host,
+    so a stamp ahead of now was left by a previous boot and counts as long ago.
+    """
+    return now - stamp if stamp <= now else math.inf
+
+
+def fair_shares(limits, capacity):
+    """
+    Max-min fair split of capacity between transfers with the given limits
+    (0 for none). Returns the shares in the same order.
+    """
+    shares = [0.0] * len(limits)
+    remaining = float(capacity)
+    pending = sorted(range(len(limits)), key=lambda i: limits[i] or math.inf)
+    for position, index in enumerate(pending):
+        fair = remaining / (len(pending) - position)
+        shares[index] = min(limits[index], fair) if limits[index] else fair
+        remaining -= shares[index]
+    return shares
+
+
+class SharedBuckets:
+    """The bucket table, mapped by this process."""
+
+    def __init__(self, path, slots):
+        self.path = path
+        self.slots = slots
+        self.pid = os.getpid()
+        # flock only excludes other processes; threads of this one take the lock too
+        self._lock = threading.Lock()
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        self._fd = os.open(path, os.O_RDWR | os.O_CREAT, 0o600)
+        size = HEADER_SIZE + SLOT.size * slots
+        if os.fstat(self._fd).st_size < size:
+            os.ftruncate(self._fd, size)
+        self._map = mmap.mmap(self._fd, size)
+
+    @contextmanager
+    def _locked(self):
+        with self._lock:
+            fcntl.flock(self._fd, fcntl.LOCK_EX)
+            try:
+                yield
+            finally:
+                fcntl.flock(self._fd, fcntl.LOCK_UN)
+
+    def _offset(self, index):
+        return HEADER_SIZE + SLOT.size * index
+
+    def _read(self, index):
+        return list(SLOT.unpack_from(self._map, self._offset(index)))
+
+    def _write(self, index, slot):
+        SLOT.pack_into(self._map, self._offset(index), *slot)
+
+    def _find(self, key, now, claim):
+        """Index of key's slot, claiming an empty or idle one if claim is set. None if there's none."""
+        start = zlib.crc32(key.to_bytes(8, 'little')) % self.slots
+        reusable = None
+        for probe in range(self.slots):
+            index = (start + probe) % self.slots
+            slot = self._read(index)
+            if slot[0] == key:
+                return index
+            # Slots unused for IDLE_SECONDS are up for grabs, even if a crashed worker left transfers counted
+            if reusable is None and (slot[0] == 0 or _elapsed(now, slot[5]) > get_setting('IDLE_SECONDS')):
+                reusable = index
+            if slot[0] == 0:
+                break
+        if claim and reusable is not None:
+            self._write(reusable, [key, 0, 0.0, 0.0, 0.0, 0.0, 0.0, now])
+        return reusable if claim else None
+
+    def _rebalance(self, direction, now):
+        """Give the direction's active users their fair shares of the global rate."""
+        capacity = global_rate(direction)
+        active = []
+        for index in range(self.slots):
+            slot = self._read(index)
+            if slot[0] and slot[0] % 2 == DIRECTIONS.index(direction) and slot[1] > 0 and _elapsed(now, slot[5]) <= get_setting('IDLE_SECONDS'):
+                active.append((index, slot))
+        shares = fair_shares([slot[2] for _, slot in active], capacity) if capacity else [slot[2] for _, slot in active]
+        for (index, slot), share in zip(active, shares):
+            slot[3] = share
+            self._write(index, slot)
+
+    def begin(self, user_id, direction, limit):
+        key = user_id * 2 + DIRECTIONS.index(direction)
+        now = time.monotonic()
+        with self._locked():
+            index = self._find(key, now, claim=True)
+            if index is None:
+                return None
+            slot = self._read(index)
+            slot[1] += 1
+            slot[2] = float(limit)
+            slot[3] = float(limit)
+            # An idle bucket is full; this also marks the slot active for the rebalance
+            if _elapsed(now, slot[5]) > get_setting('BURST_SECONDS'):
+                slot[5] = now - get_setting('BURST_SECONDS')
+            self._write(index, slot)
+            self._rebalance(direction, now)
+        return key
+
+    def end(self, key, direction):
+        now = time.monotonic()
+        with self._locked():
+            index = self._find(key, now, claim=False)
+            if index is not None:
+                slot = self._read(index)
+                slot[1] = max(slot[1] - 1, 0)
+                self._write(index, slot)
+            self._rebalance(direction, now)
+
+    def consume(self, key, direction, nbytes):
+        """Take nbytes from the user's and the global bucket. Returns the seconds to wait."""
+        burst = get_setting('BURST_SECONDS')
+        window = get_setting('THROUGHPUT_WINDOW_SECONDS')
+        now = time.monotonic()
+        wait = 0.0
+        with self._locked():
+            capacity = global_rate(direction)
+            if capacity:
+                offset = GLOBAL.size * DIRECTIONS.index(direction)
+                tokens, updated = GLOBAL.unpack_from(self._map, offset)
+                tokens = min(capacity * burst, tokens + _elapsed(now, updated) * capacity) - nbytes
+                GLOBAL.pack_into(self._map, offset, tokens, now)
+                wait = max(wait, -tokens / capacity)
+
+            index = self._find(key, now, claim=False) if key is not None else None
+            if index is not None:
+                slot = self._read(index)
+                rate = slot[3]
+                if rate:
+                    slot[4] = min(rate * burst, slot[4] + _elapsed(now, slot[5]) * rate) - nbytes
+                    wait = max(wait, -slot[4] / rate)
+                slot[5] = now
+                slot[6] = slot[6] * math.exp(-_elapsed(now, slot[7]) / window) + nbytes / window
+                slot[7] = now
+                self._write(index, slot)
+        return wait
+
+    def snapshot(self):
+        """(user_id, direction, active transfers, fair share, current bytes/s) for every recently used bucket."""
+        window = get_setting('THROUGHPUT_WINDOW_SECONDS')
+        now = time.monotonic()
+        rows = []
+        with self._locked():
+            for index in range(self.slots):
+                key, transfers, _, share, _, _, throughput, throughput_at = self._read(index)
+                if not key:
+                    continue
+                throughput *= math.exp(-_elapsed(now, throughput_at) / window)
+                if transfers > 0 or throughput >= 1:
+                    rows.append((key // 2, DIRECTIONS[key % 2], transfers, share, throughput))
+        return rows
+
+
+_buckets = None
+_buckets_lock = threading.Lock()
+
+
+def state_path():
+    return get_setting('PATH') or os.path.join(settings.BASE_DIR, 'data', 'bandwidth.state')
+
+
+def reset_state():
+    """Drop the bucket table, which only describes transfers of the server that wrote it."""
+    try:
+        os.remove(state_path())
+    except FileNotFoundError:
+        pass
+
+
+def shared_buckets():
+    """This process's mapping of the bucket table, remapped after a fork."""
+    global _buckets
+    path = state_path()
+    with _buckets_lock:
+        if _buckets is None or _buckets.pid != os.getpid() or _buckets.path != path:
+            _buckets = SharedBuckets(path, get_setting('SLOTS'))
+        return _buckets
+
+
+class Shaper:
+    """One shaped transfer. Call throttle() for every chunk and close() once it's over."""
+
+    def __init__(self, user_id, direction, limit):
+        self.direction = direction
+        self._buckets = shared_buckets()
+        self._key = self._buckets.begin(user_id, direction, limit)
+        self._closed = False
+
+    def throttle(self, nbytes):
+        wait = self._buckets.consume(self._key, self.direction, nbytes)
+        if wait > 0:
+            metrics.SHAPING_WAIT.inc(wait, labels=(self.direction,))
+            time.sleep(wait)
+
+    def close(self):
+        if not self._closed:
+            self._closed = True
+            if self._key is not None:
+                self._buckets.end(self._key, self.direction)
+
+
+def shaper_for(user, direction):
+    """A Shaper for a transfer by user, or None when no limit applies to it."""
+    profile = getattr(user, 'profile', None)
+    limit = getattr(profile, f'{direction}_bytes_per_second', 0) or 0
+    if not limit and not global_rate(direction):
+        return None
+    return Shaper(user.pk, direction, limit)
+
+
+class ShapedChunks:
+    """Response content that passes every chunk through a shaper first."""
+
+    def __init__(self, chunks, shaper):
+        self._chunks = iter(chunks)
+        self._shaper = shaper
+
+    def __iter__(self):
+        return self
+
+    def __next__(self):
+        chunk = next(self._chunks)
+        self._shaper.throttle(len(chunk))
+        return chunk
+
+    def close(self):
+        self._shaper.close()
+
+
+def shape_response(response, user):
+    """
+    Shape a streaming download response for user. Shaped responses are
+    iterated in SHAPED_BLOCK_SIZE pieces rather than handed to sendfile.
+    """
+    shaper = shaper_for(user, DOWNLOAD)
+    if shaper is None or not response.streaming:
+        return response
+    if getattr(response, 'file_to_stream', None) is not None:
+        # Read lazily, so the smaller block size applies
+        response.block_size = get_setting('SHAPED_BLOCK_SIZE')
+    # Replacing the content also drops file_to_stream, which keeps wsgi.file_wrapper from sendfile'ing it
+    response.streaming_content = ShapedChunks(response.streaming_content, shaper)
+    return response
+
+
+class ShapingUploadHandler(FileUploadHandler):
+    """
+    Paces an upload as it's received. It goes first in the handler chain,
+    so the body is read no faster than the user's share allows.
+    """
+
+    def __init__(self, request, user):
+        super().__init__(request)
+        self.user = user
+        self.shaper = None
+
+    def new_file(self, *args, **kwargs):
+        super().new_file(*args, **kwargs)
+        if self.shaper is None:
+            self.shaper = shaper_for(self.user, UPLOAD)
+
+    def receive_data_chunk(self, raw_data, start):
+        if self.shaper is not None:
+            self.shaper.throttle(len(raw_data))
+        return raw_data
+
+    def file_complete(self, file_size):
+        return None
+
+    def upload_complete(self):
+        if self.shaper is not None:
+            self.shaper.close()
+
+    def upload_interrupted(self):
+        self.upload_complete()
@@ -0,0 +1,99 @@
+import threading
+from collections import OrderedDict
+
+from django.conf import settings
+
+DEFAULTS = {
+    'MAX_BYTES': 64 * 1024 * 1024,
+    'MAX_ENTRY_BYTES': 256 * 1024,
+}
+
+
+def get_setting(name):
+    """Read a cache option from settings.CONTENT_CACHE, falling back to defaults."""
+    return getattr(settings, 'CONTENT_CACHE', {}).get(name, DEFAULTS[name])
+
+
+class ContentCache:
+    """
+    Size-bounded, in-process LRU of file contents keyed by file_hash.
+
+    Content is immutable per hash, so entries never need revalidation and
+    duplicate records share the entry of their original.
+    """
+    def __init__(self, max_bytes=None, max_entry_bytes=None):
+        self._max_bytes = max_bytes
+        self._max_entry_bytes = max_entry_bytes
+        self._lock = threading.Lock()
+        self._entries = OrderedDict()
+        self.current_bytes = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    @property
+    def max_bytes(self):
+        return self._max_bytes if self._max_bytes is not None else get_setting('MAX_BYTES')
+
+    @property
+    def max_entry_bytes(self):
+        return self._max_entry_bytes if self._max_entry_bytes is not None else get_setting('MAX_ENTRY_BYTES')
+
+    def admits(self, size):
+        """Whether a file of this size may be cached at all."""
+        return 0 < size <= min(self.max_entry_bytes, self.max_bytes)
+
+    def get(self, file_hash):
+        with self._lock:
+            content = self._entries.get(file_hash)
+            if content is None:
+                self.misses += 1
+                return None
+            self._entries.move_to_end(file_hash)
+            self.hits += 1
+            return content
+
+    def put(self, file_hash, content):
+        if not file_hash or not self.admits(len(content)):
+            return False
+        with self._lock:
+            if file_hash in self._entries:
+                self._entries.move_to_end(file_hash)
+                return True
+            self._entries[file_hash] = content
+            self.current_bytes += len(content)
+            # Evict least recently used entries until we're back under budget
+            while self.current_bytes > self.max_bytes:
+                _, evicted = self._entries.popitem(last=False)
+                self.current_bytes -= len(evicted)
+                self.evictions += 1
+        return True
+
+    def evict(self, file_hash):
+        with self._lock:
+            content = self._entries.pop(file_hash, None)
+            if content is None:
+                return False
+            self.current_bytes -= len(content)
+            self.evictions += 1
+            return True
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self.current_bytes = 0
+
+    def stats(self):
+        with self._lock:
+            return {
+                'entries': len(self._entries),
+                'current_bytes': self.current_bytes,
+                'max_bytes': self.max_bytes,
+                'max_entry_bytes': self.max_entry_bytes,
+                'hits': self.hits,
+                'misses': self.misses,
+                'evictions': self.evictions,
+            }
+
+
+content_cache = ContentCache()
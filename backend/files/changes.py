@@ -0,0 +1,143 @@
+"""
+Per-user change feed for sync clients.
+
+Every change to a file appends a FileChange row in the same transaction.
+Clients keep the id of the last event they've seen as a cursor and fetch
+only the events after it (GET /api/files/changes/?cursor=). The cost of a
+sync then follows the amount of change rather than the size of the
+library. With ?wait=, a request with nothing to return waits for the next
+change instead of returning empty.
+
+Cursor order must match commit order. SQLite serializes writers, so ids
+are committed in order.
+
+compact() keeps the log bounded in two ways:
+- It drops every event superseded by a newer one for the same file. This
+  is safe at any cursor, since clients act on a file's latest state. What
+  remains is one event per live file plus 'deleted' tombstones.
+- It expires tombstones older than TOMBSTONE_RETENTION_DAYS. It then
+  raises the user's horizon, and an older cursor gets 410 and must resync
+  from a full listing.
+"""
+import threading
+import time
+from datetime import timedelta
+
+from django.conf import settings
+from django.db import transaction
+from django.db.models import Exists, Max, OuterRef
+from django.utils import timezone
+
+DEFAULTS = {
+    'PAGE_SIZE': 500,
+    # Well below gunicorn's worker timeout, which would otherwise kill a waiting request
+    'MAX_WAIT_SECONDS': 20,
+    'POLL_INTERVAL_SECONDS': 1.0,
+    'TOMBSTONE_RETENTION_DAYS': 30,
+    'COMPACT_BATCH_SIZE': 5000,
+}
+
+CREATED = 'created'
+UPDATED = 'updated'
+MOVED = 'moved'
+TRASHED = 'trashed'
+RESTORED = 'restored'
+DELETED = 'deleted'
+
+ACTION_CHOICES = [(action, action) for action in (CREATED, UPDATED, MOVED, TRASHED, RESTORED, DELETED)]
+
+# Wakes this worker's long-polls as soon as one of its own changes commits;
+# changes made by other workers are picked up by polling
+_changed = threading.Condition()
+
+
+class CursorExpired(Exception):
+    pass
+
+
+def get_setting(name):
+    """Read a change feed option from settings.CHANGE_FEED, falling back to defaults."""
+    return getattr(settings, 'CHANGE_FEED', {}).get(name, DEFAULTS[name])
+
+
+def _notify():
+    with _changed:
+        _changed.notify_all()
+
+
+def record(owner_id, file_id, action):
+    """Append an event to the owner's feed, as part of the current transaction."""
+    from .models import FileChange
+
+    FileChange.objects.create(owner_id=owner_id, file_id=file_id, action=action)
+    transaction.on_commit(_notify)
+
+
+def record_bulk(records, action):
+    """Append the same event for many files, such as rows inserted with bulk_create, in one INSERT per batch."""
+    from .models import FileChange
+
+    events = [FileChange(owner_id=record.owner_id, file_id=record.pk, action=action) for record in records]
+    if events:
+        FileChange.objects.bulk_create(events, batch_size=500)
+        transaction.on_commit(_notify)
+
+
+def latest_cursor(owner_id):
+    from .models import FileChange
+
+    return FileChange.objects.filter(owner_id=owner_id).aggregate(cursor=Max('id'))['cursor'] or 0
+
+
+def since(owner_id, cursor, limit=None, wait=0):
+    """
+    Events after cursor, oldest first, at most limit of them. If there are
+    none, wait up to `wait` seconds for one. Raises CursorExpired if
+    compaction has dropped events the cursor hasn't seen.
+    """
+    from .models import FileChange, UserProfile
+
+    limit = limit or get_setting('PAGE_SIZE')
+    horizon = UserProfile.objects.filter(user_id=owner_id).values_list('changes_horizon', flat=True).first() or 0
+    if cursor < horizon:
+        raise CursorExpired()
+
+    pending = FileChange.objects.filter(owner_id=owner_id, id__gt=cursor).order_by('id')
+    deadline = time.monotonic() + min(wait, get_setting('MAX_WAIT_SECONDS'))
+    while True:
+        events = list(pending[:limit])
+        remaining = deadline - time.monotonic()
+        if events or remaining <= 0:
+            return events
+        with _changed:
+            _changed.wait(min(remaining, get_setting('POLL_INTERVAL_SECONDS')))
+
+
+def compact(batch_size=None, now=None):
+    """
+    Drop superseded events and expired tombstones, batch_size ids per
+    transaction. Returns the number of events removed.
+    """
+    from .models import FileChange, UserProfile
+
+    batch_size = batch_size or get_setting('COMPACT_BATCH_SIZE')
+    now = now or timezone.now()
+    newer = FileChange.objects.filter(file_id=OuterRef('file_id'), id__gt=OuterRef('id'))
+    expired = now - timedelta(days=get_setting('TOMBSTONE_RETENTION_DAYS'))
+
+    removed = 0
+    start = 0
+    end = FileChange.objects.aggregate(end=Max('id'))['end'] or 0
+    while start < end:
+        window = FileChange.objects.filter(id__gt=start, id__lte=start + batch_size)
+        with transaction.atomic():
+            removed += window.filter(Exists(newer)).delete()[0]
+            tombstones = window.filter(action=DELETED, created_at__lt=expired)
+            horizons = tombstones.order_by().values('owner_id').annotate(horizon=Max('id'))
+            for row in horizons:
+                UserProfile.objects.filter(user_id=row['owner_id'], changes_horizon__lt=row['horizon']).update(
+                    changes_horizon=row['horizon']
+                )
+            removed += tombstones.delete()[0]
+        start += batch_size
+    return removed
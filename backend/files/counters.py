@@ -0,0 +1,152 @@
+from collections import defaultdict
+
+from django.db import IntegrityError, transaction
+from django.db.models import Count, F, Sum
+from django.db.models.functions import Greatest
+
+from . import journal
+
+
+def apply_increment(model, keys, deltas):
+    """
+    Atomically add deltas to the counter row of model identified by keys,
+    creating the row on first use.
+
+    The UPDATE with F() expressions never reads the row into Python, so
+    concurrent writers don't overwrite each other's increments.
+    """
+    deltas = {field: value for field, value in deltas.items() if value}
+    if not deltas:
+        return
+    updates = {field: F(field) + value for field, value in deltas.items()}
+    if model.objects.filter(**keys).update(**updates):
+        return
+    try:
+        # Savepoint, so losing the creation race doesn't break the caller's transaction
+        with transaction.atomic():
+            model.objects.create(**keys, **deltas)
+    except IntegrityError:
+        model.objects.filter(**keys).update(**updates)
+
+
+def increment(model, keys, **deltas):
+    """
+    Add deltas to a counter row, through the write-behind journal when it's
+    enabled and straight to the database otherwise.
+    """
+    deltas = {field: value for field, value in deltas.items() if value}
+    if not deltas:
+        return
+    if journal.enabled():
+        # Queued once the surrounding transaction commits, so rolled back work isn't counted
+        transaction.on_commit(lambda: journal.get_journal().append(model, keys, deltas))
+    else:
+        apply_increment(model, keys, deltas)
+
+
+def storage_used(user_id):
+    """A user's charged storage, including charges still queued in the journal."""
+    from .models import UserProfile
+
+    if journal.enabled():
+        return journal.get_journal().storage_used(user_id)
+    return UserProfile.objects.filter(user_id=user_id).values_list('current_storage_used', flat=True).first() or 0
+
+
+def reserve_storage(user_id, nbytes, limit_bytes):
+    """
+    Charge nbytes to a user if it fits within limit_bytes, atomically.
+
+    Returns the new usage, or None when the quota would be exceeded. With
+    the journal, the charge is queued at once so concurrent checks see it,
+    even inside a transaction; undo it with release_storage() if the work
+    it paid for fails.
+    """
+    from .models import UserProfile
+
+    if journal.enabled():
+        try:
+            return journal.get_journal().reserve(user_id, nbytes, limit_bytes)
+        except journal.QuotaExceeded:
+            return None
+    # The check and the increment are one conditional UPDATE, so concurrent uploads can't both pass
+    if not UserProfile.objects.filter(user_id=user_id, current_storage_used__lte=limit_bytes - nbytes).update(
+        current_storage_used=F('current_storage_used') + nbytes
+    ):
+        return None
+    return storage_used(user_id)
+
+
+def _apply_charge(user_id, nbytes):
+    from .models import UserProfile
+
+    if journal.enabled():
+        journal.get_journal().append(UserProfile, {'user_id': user_id}, {'current_storage_used': nbytes},
+                                     user_id=user_id, charged_bytes=nbytes)
+    else:
+        UserProfile.objects.filter(user_id=user_id).update(
+            current_storage_used=Greatest(F('current_storage_used') + nbytes, 0)
+        )
+
+
+def charge_storage(user_id, nbytes):
+    """
+    Add (or with a negative nbytes, release) charged storage without a quota
+    check. Like increment(), a journaled charge is queued once the
+    surrounding transaction commits, so rolled back work isn't charged.
+    """
+    if not nbytes:
+        return
+    if journal.enabled():
+        transaction.on_commit(lambda: _apply_charge(user_id, nbytes))
+    else:
+        _apply_charge(user_id, nbytes)
+
+
+def release_storage(user_id, nbytes):
+    """
+    Give back a reservation from reserve_storage() whose upload failed.
+
+    Applied straight away like the reservation itself, rather than at
+    commit: the transaction around a failed upload is usually rolled back,
+    which would drop a deferred release but keep a journaled reservation.
+    """
+    if nbytes:
+        _apply_charge(user_id, -nbytes)
+
+
+def count_file_type(user_id, file_type, files, total_bytes):
+    """Adjust a user's counters for one MIME type; negative values count deletions."""
+    from .models import UserFileType
+    increment(UserFileType, {'user_id': user_id, 'file_type': file_type}, file_count=files, total_bytes=total_bytes)
+
+
+def count_file_types_bulk(records):
+    """Count rows inserted with bulk_create, one increment per (user, type)."""
+    totals = defaultdict(lambda: [0, 0])
+    for record in records:
+        entry = totals[record.owner_id, record.file_type]
+        entry[0] += 1
+        entry[1] += record.size
+    for (user_id, file_type), (files, total_bytes) in totals.items():
+        count_file_type(user_id, file_type, files, total_bytes)
+
+
+def rebuild_file_types():
+    """Recompute every user's file type counters from the File table. Returns the number of rows."""
+    from .models import File, UserFileType
+
+    rows = (
+        File.objects.order_by()
+        .values('owner_id', 'file_type')
+        .annotate(file_count=Count('id'), total_bytes=Sum('size'))
+    )
+    counts = [
+        UserFileType(user_id=row['owner_id'], file_type=row['file_type'],
+                     file_count=row['file_count'], total_bytes=row['total_bytes'])
+        for row in rows
+    ]
+    with transaction.atomic():
+        UserFileType.objects.all().delete()
+        UserFileType.objects.bulk_create(counts, batch_size=1000)
+    return len(counts)
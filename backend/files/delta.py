@@ -0,0 +1,161 @@
+"""
+Binary delta encoding between two versions of a file.
+
+A delta describes `target` as a sequence of COPY (offset, length) ranges
+from `base` and INSERT literals. Blocks of `base` are indexed by their
+first bytes, and `target` is scanned for them, so an insertion or deletion
+only costs literal bytes around the edit. The serialized delta is
+zlib-compressed.
+"""
+import struct
+import zlib
+
+MAGIC = b'FVD1'
+OP_COPY = b'C'
+OP_INSERT = b'I'
+COPY_STRUCT = struct.Struct('>QI')
+INSERT_STRUCT = struct.Struct('>I')
+HEADER_STRUCT = struct.Struct('>4sQ')
+
+DEFAULT_BLOCK_SIZE = 2048
+PREFIX_SIZE = 8
+MAX_CANDIDATES = 4
+STREAM_CHUNK_SIZE = 1024 * 1024
+
+
+class DeltaNotWorthwhile(Exception):
+    """The versions differ too much for a delta to save space."""
+
+
+def _index(base, block_size):
+    """Map the first bytes of each aligned block of base to its offsets."""
+    index = {}
+    for offset in range(0, len(base) - block_size + 1, block_size):
+        offsets = index.setdefault(base[offset:offset + PREFIX_SIZE], [])
+        if len(offsets) < MAX_CANDIDATES:
+            offsets.append(offset)
+    return index
+
+
+def _common_length(a, a_start, b, b_start, limit):
+    """Length of the common run of a[a_start:] and b[b_start:], up to limit bytes."""
+    # Compare big slices first, then binary-search the partial one
+    length = 0
+    step = DEFAULT_BLOCK_SIZE
+    while length + step <= limit and a[a_start + length:a_start + length + step] == b[b_start + length:b_start + length + step]:
+        length += step
+    low, high = 0, min(step, limit - length)
+    while low < high:
+        mid = (low + high + 1) // 2
+        if a[a_start + length:a_start + length + mid] == b[b_start + length:b_start + length + mid]:
+            low = mid
+        else:
+            high = mid - 1
+    return length + low
+
+
+def encode(target, base, block_size=DEFAULT_BLOCK_SIZE, max_literal=None):
+    """
+    Encode target as a delta against base; both are bytes.
+
+    Raises DeltaNotWorthwhile as soon as literal bytes exceed max_literal
+    (default: half of target), since storing target in full is then cheaper.
+    """
+    if max_literal is None:
+        max_literal = len(target) // 2
+
+    index = _index(base, block_size)
+    lookup = index.get
+    ops = []
+    literal_bytes = 0
+    literal_start = 0
+    position = 0
+    end = len(target) - block_size
+    # A later match can only grow back over the last couple of blocks of the pending
+    # literal; once the scan is further than that past the budget, the delta is a loss
+    give_up_at = max_literal + 2 * block_size
+
+    while position <= end:
+        match = None
+        offsets = lookup(target[position:position + PREFIX_SIZE])
+        if offsets:
+            block = target[position:position + block_size]
+            for offset in offsets:
+                if base[offset:offset + block_size] == block:
+                    match = offset
+                    break
+        if match is None:
+            position += 1
+            if position > give_up_at:
+                raise DeltaNotWorthwhile()
+            continue
+
+        # Grow the match backwards into the pending literal and forwards past the block
+        start = position
+        while start > literal_start and match > 0 and target[start - 1] == base[match - 1]:
+            start -= 1
+            match -= 1
+        length = _common_length(target, start, base, match, min(len(target) - start, len(base) - match))
+
+        if start > literal_start:
+            ops.append((OP_INSERT, target[literal_start:start]))
+            literal_bytes += start - literal_start
+            if literal_bytes > max_literal:
+                raise DeltaNotWorthwhile()
+        ops.append((OP_COPY, match, length))
+        position = literal_start = start + length
+        give_up_at = literal_start + max_literal - literal_bytes + 2 * block_size
+
+    if literal_start < len(target):
+        ops.append((OP_INSERT, target[literal_start:]))
+        literal_bytes += len(target) - literal_start
+        if literal_bytes > max_literal:
+            raise DeltaNotWorthwhile()
+
+    parts = [HEADER_STRUCT.pack(MAGIC, len(target))]
+    for op in ops:
+        if op[0] == OP_COPY:
+            parts.append(OP_COPY + COPY_STRUCT.pack(op[1], op[2]))
+        else:
+            parts.append(OP_INSERT + INSERT_STRUCT.pack(len(op[1])) + op[1])
+    return zlib.compress(b''.join(parts), 6)
+
+
+def patch_stream(delta, base_file, chunk_size=STREAM_CHUNK_SIZE):
+    """
+    Rebuild the target of a delta, yielding it in chunks.
+
+    base_file must be a seekable binary file holding the base version.
+    """
+    data = zlib.decompress(delta)
+    magic, target_size = HEADER_STRUCT.unpack_from(data, 0)
+    if magic != MAGIC:
+        raise ValueError('Not a delta')
+
+    position = HEADER_STRUCT.size
+    while position < len(data):
+        op = data[position:position + 1]
+        position += 1
+        if op == OP_COPY:
+            offset, length = COPY_STRUCT.unpack_from(data, position)
+            position += COPY_STRUCT.size
+            base_file.seek(offset)
+            while length:
+                chunk = base_file.read(min(length, chunk_size))
+                if not chunk:
+                    raise ValueError('Delta refers past the end of its base')
+                length -= len(chunk)
+                yield chunk
+        elif op == OP_INSERT:
+            (length,) = INSERT_STRUCT.unpack_from(data, position)
+            position += INSERT_STRUCT.size
+            yield data[position:position + length]
+            position += length
+        else:
+            raise ValueError('Corrupt delta')
+
+
+def target_size(delta):
+    """Size of the version a delta rebuilds, read from its header."""
+    header = zlib.decompressobj().decompress(delta, HEADER_STRUCT.size)
+    return HEADER_STRUCT.unpack(header)[1]
@@ -0,0 +1,162 @@
+"""
+Folder hierarchy with materialized paths.
+
+Each folder stores the ids of its ancestors and itself as a path such as
+'/3/17/42/'. A subtree is then the folders whose path starts with its
+root's path. Renaming never touches other rows. Moving a folder rewrites
+the path prefix of its subtree in one UPDATE. Files reference their
+folder by id, so they aren't touched at all.
+
+Each folder also keeps the file count and logical bytes of its whole
+subtree. A change to one file adds its delta to every ancestor in one
+UPDATE, touching at most MAX_DEPTH rows. Like the other usage counters,
+the totals include files in the trash until the trash reaper purges them.
+"""
+from django.conf import settings
+from django.db import transaction
+from django.db.models import F, Value
+from django.db.models.functions import Concat, Substr
+
+from . import changes
+
+DEFAULTS = {
+    'MAX_DEPTH': 32,
+}
+
+
+class FolderError(Exception):
+    pass
+
+
+def get_setting(name):
+    """Read a folder option from settings.FOLDERS, falling back to defaults."""
+    return getattr(settings, 'FOLDERS', {}).get(name, DEFAULTS[name])
+
+
+def ancestor_ids(path):
+    """Ids of the folders on a path, root first, including the folder itself."""
+    return [int(part) for part in path.strip('/').split('/')]
+
+
+def child_path(parent, pk):
+    return f"{parent.path if parent else '/'}{pk}/"
+
+
+def _adjust(ids, files, nbytes):
+    from .models import Folder
+
+    if ids and (files or nbytes):
+        Folder.objects.filter(pk__in=ids).update(
+            file_count=F('file_count') + files, total_bytes=F('total_bytes') + nbytes
+        )
+
+
+def adjust_totals(folder_id, files, nbytes):
+    """Add files and nbytes to the totals of a folder and all its ancestors."""
+    from .models import Folder
+
+    if folder_id is None or not (files or nbytes):
+        return
+    # Locked so a concurrent move of an ancestor can't shift the path under us. Callers such as
+    # the post_save signal may run outside a transaction, where select_for_update() is an error
+    with transaction.atomic():
+        path = Folder.objects.select_for_update().filter(pk=folder_id).values_list('path', flat=True).first()
+        if path is not None:
+            _adjust(ancestor_ids(path), files, nbytes)
+
+
+def _check_name(owner_id, parent, name, exclude=None):
+    from .models import Folder
+
+    if not name or '/' in name:
+        raise FolderError('Folder names must be non-empty and cannot contain "/"')
+    siblings = Folder.objects.filter(owner_id=owner_id, parent=parent, name=name)
+    if exclude is not None:
+        siblings = siblings.exclude(pk=exclude.pk)
+    if siblings.exists():
+        raise FolderError(f'A folder named "{name}" already exists here')
+
+
+def create_folder(owner, name, parent=None):
+    from .models import Folder
+
+    depth = parent.depth + 1 if parent else 0
+    if depth >= get_setting('MAX_DEPTH'):
+        raise FolderError('Folders are nested too deeply')
+    with transaction.atomic():
+        _check_name(owner.pk, parent, name)
+        folder = Folder.objects.create(owner=owner, parent=parent, name=name, depth=depth, path='')
+        # The path ends with the folder's own id, which is only known after the insert
+        folder.path = child_path(parent, folder.pk)
+        Folder.objects.filter(pk=folder.pk).update(path=folder.path)
+    return folder
+
+
+def move_folder(folder, parent=None, name=None):
+    """
+    Rename folder and/or move it under parent (None for the top level). The
+    subtree's paths and depths change in one UPDATE. The subtree totals move
+    from the old ancestors to the new ones in one UPDATE each. Every file in
+    the subtree gets a 'moved' event, since its location changed with it.
+    """
+    from .models import File, Folder
+
+    name = name if name is not None else folder.name
+    with transaction.atomic():
+        # Locks the whole subtree, so uploads into it wait for the move
+        subtree = Folder.objects.select_for_update().filter(owner_id=folder.owner_id, path__startswith=folder.path)
+        folder = subtree.get(pk=folder.pk)
+        if parent is not None and parent.path.startswith(folder.path):
+            raise FolderError('A folder cannot be moved into itself or one of its subfolders')
+        _check_name(folder.owner_id, parent, name, exclude=folder)
+
+        if parent != folder.parent:
+            old_path = folder.path
+            new_path = child_path(parent, folder.pk)
+            depth_change = (parent.depth + 1 if parent else 0) - folder.depth
+            if depth_change > 0 and subtree.order_by('-depth').values_list('depth', flat=True).first() + depth_change >= get_setting('MAX_DEPTH'):
+                raise FolderError('Folders are nested too deeply')
+
+            _adjust(ancestor_ids(old_path)[:-1], -folder.file_count, -folder.total_bytes)
+            _adjust(ancestor_ids(new_path)[:-1], folder.file_count, folder.total_bytes)
+            subtree.update(
+                path=Concat(Value(new_path), Substr('path', len(old_path) + 1)),
+                depth=F('depth') + depth_change,
+            )
+            Folder.objects.filter(pk=folder.pk).update(parent=parent, name=name)
+        elif name != folder.name:
+            Folder.objects.filter(pk=folder.pk).update(name=name)
+        else:
+            return folder
+        moved = File.objects.filter(owner_id=folder.owner_id, folder__path__startswith=child_path(parent, folder.pk))
+        changes.record_bulk(moved.only('pk', 'owner_id'), changes.MOVED)
+    folder.refresh_from_db()
+    return folder
+
+
+def move_file(file_record, folder=None):
+    """Move a file into folder (None for the top level), carrying its size across the totals."""
+    from .models import File
+
+    with transaction.atomic():
+        adjust_totals(file_record.folder_id, -1, -file_record.size)
+        adjust_totals(folder.pk if folder else None, 1, file_record.size)
+        File.objects.filter(pk=file_record.pk).update(folder=folder)
+        changes.record(file_record.owner_id, file_record.pk, changes.MOVED)
+    file_record.folder = folder
+
+
+def delete_folder(folder):
+    """
+    Delete a folder with no subfolders and no files outside the trash.
+    Trashed files in it fall back to the top level, so their sizes leave the
+    ancestors' totals here.
+    """
+    from .models import File, Folder
+
+    with transaction.atomic():
+        folder = Folder.objects.select_for_update().get(pk=folder.pk)
+        if Folder.objects.filter(parent=folder).exists() or File.objects.filter(folder=folder, deleted_at__isnull=True).exists():
+            raise FolderError('Only empty folders can be deleted')
+        _adjust(ancestor_ids(folder.path)[:-1], -folder.file_count, -folder.total_bytes)
+        folder.delete()
@@ -0,0 +1,140 @@
+import hashlib
+import mmap
+import os
+from collections import defaultdict
+from concurrent.futures import ThreadPoolExecutor
+
+from django.conf import settings
+
+DEFAULTS = {
+    'BUFFER_SIZE': 1024 * 1024,
+    'WORKERS': min(32, (os.cpu_count() or 1) * 2),
+    'PREFILTER_SAMPLE_BYTES': 64 * 1024,
+}
+
+
+def get_setting(name):
+    """Read a hashing option from settings.HASHING, falling back to defaults."""
+    return getattr(settings, 'HASHING', {}).get(name, DEFAULTS[name])
+
+
+def sha256_path(path):
+    """
+    SHA-256 of a local file, hashed straight out of the page cache via mmap.
+    """
+    sha256_hash = hashlib.sha256()
+    with open(path, 'rb') as f:
+        if os.fstat(f.fileno()).st_size == 0:
+            # mmap refuses zero-length files
+            return sha256_hash.hexdigest()
+        with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+            # hashlib releases the GIL while hashing large buffers
+            sha256_hash.update(mm)
+    return sha256_hash.hexdigest()
+
+
+def sha256_fileobj(f):
+    """
+    SHA-256 of an open binary file-like object from its current position.
+
+    Uses hashlib.file_digest (Python 3.11+), which hashes in-memory buffers
+    without copying and reads files into a reused buffer; older versions fall
+    back to readinto() with a buffer of HASHING['BUFFER_SIZE'].
+    """
+    if hasattr(hashlib, 'file_digest'):
+        return hashlib.file_digest(f, 'sha256').hexdigest()
+
+    sha256_hash = hashlib.sha256()
+    buffer = bytearray(get_setting('BUFFER_SIZE'))
+    view = memoryview(buffer)
+    while True:
+        size = f.readinto(buffer)
+        if not size:
+            break
+        sha256_hash.update(view[:size])
+    return sha256_hash.hexdigest()
+
+
+def sha256_upload(uploaded_file):
+    """SHA-256 of an UploadedFile, leaving it rewound for saving."""
+    # Hash the underlying BytesIO/temporary file so file_digest can take its fast paths
+    f = getattr(uploaded_file, 'file', uploaded_file)
+    f.seek(0)
+    digest = sha256_fileobj(f)
+    f.seek(0)
+    return digest
+
+
+def hash_many(paths, workers=None, hash_fn=sha256_path):
+    """
+    Hash many local files concurrently, returning {path: hexdigest}.
+
+    Threads are enough here: hashlib drops the GIL while hashing the large
+    mmap buffers, so workers hash in parallel. Unreadable files map to None.
+    """
+    workers = workers or get_setting('WORKERS')
+
+    def _hash(path):
+        try:
+            return path, hash_fn(path)
+        except OSError:
+            return path, None
+
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        return dict(executor.map(_hash, paths))
+
+
+def _prefilter_hasher():
+    """Fast non-cryptographic hash if xxhash is installed, otherwise BLAKE2b."""
+    try:
+        import xxhash
+    except ImportError:
+        return hashlib.blake2b(digest_size=16)
+    return xxhash.xxh3_128()
+
+
+def prefilter_path(path):
+    """
+    Cheap fingerprint of a file: its size plus a hash of its head and tail.
+
+    Files with different fingerprints can't be identical, so only files that
+    share one need a full SHA-256 to confirm they're duplicates.
+    """
+    sample = get_setting('PREFILTER_SAMPLE_BYTES')
+    hasher = _prefilter_hasher()
+    with open(path, 'rb') as f:
+        size = os.fstat(f.fileno()).st_size
+        hasher.update(size.to_bytes(8, 'little'))
+        hasher.update(f.read(sample))
+        if size > sample * 2:
+            f.seek(-sample, os.SEEK_END)
+        hasher.update(f.read(sample))
+    return size, hasher.hexdigest()
+
+
+def find_duplicates(paths, workers=None):
+    """
+    Group local files with identical content, returning {sha256: [paths]}.
+
+    Candidates are shortlisted by size and the prefilter fingerprint, and only
+    those are confirmed with SHA-256. Groups with a single file are omitted.
+    """
+    by_size = defaultdict(list)
+    for path in paths:
+        try:
+            by_size[os.path.getsize(path)].append(path)
+        except OSError:
+            continue
+    same_size = [path for group in by_size.values() if len(group) > 1 for path in group]
+
+    by_fingerprint = defaultdict(list)
+    for path, fingerprint in hash_many(same_size, workers, hash_fn=prefilter_path).items():
+        if fingerprint is not None:
+            by_fingerprint[fingerprint].append(path)
+    candidates = [path for group in by_fingerprint.values() if len(group) > 1 for path in group]
+
+    by_digest = defaultdict(list)
+    for path, digest in hash_many(candidates, workers).items():
+        if digest is not None:
+            by_digest[digest].append(path)
+    return {digest: group for digest, group in by_digest.items() if len(group) > 1}
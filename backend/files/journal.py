@@ -0,0 +1,250 @@
+"""
+Write-behind journal for counter updates.
+
+Counter deltas (profile storage usage, per-user file type counts, daily
+analytics rollups) are appended to a local SQLite file. The file is shared
+by every worker process on the host and fsync'd on each commit. A
+background thread folds the deltas into the main database in batched
+transactions. A checkpoint row in the main database, written in the same
+transaction, records the last applied journal id, so replaying after a
+crash never applies a delta twice.
+
+Quota checks stay strongly consistent on one host. A reservation checks
+the profile's stored usage plus every unflushed storage delta, then
+appends its own charge. It does all of this under the journal's write
+lock, and the flusher holds the same lock while it moves deltas into the
+database.
+"""
+import atexit
+import json
+import logging
+import os
+import sqlite3
+import threading
+import uuid
+from collections import defaultdict
+from contextlib import contextmanager
+
+from django.apps import apps
+from django.conf import settings
+from django.core.serializers.json import DjangoJSONEncoder
+from django.db import transaction
+
+logger = logging.getLogger(__name__)
+
+DEFAULTS = {
+    'ENABLED': False,
+    'PATH': os.path.join(settings.BASE_DIR, 'data', 'writebehind.sqlite3'),
+    'FLUSH_INTERVAL_MS': 200,
+    'FLUSH_BATCH_SIZE': 5000,
+}
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS meta (key TEXT PRIMARY KEY, value TEXT NOT NULL);
+CREATE TABLE IF NOT EXISTS deltas (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    model TEXT NOT NULL,
+    keys TEXT NOT NULL,
+    deltas TEXT NOT NULL,
+    user_id INTEGER,
+    charged_bytes INTEGER NOT NULL DEFAULT 0
+);
+CREATE INDEX IF NOT EXISTS deltas_user ON deltas (user_id) WHERE user_id IS NOT NULL;
+"""
+
+
+class QuotaExceeded(Exception):
+    pass
+
+
+def get_setting(name):
+    """Read a journal option from settings.WRITE_BEHIND, falling back to defaults."""
+    return getattr(settings, 'WRITE_BEHIND', {}).get(name, DEFAULTS[name])
+
+
+def enabled():
+    return get_setting('ENABLED')
+
+
+class Journal:
+    def __init__(self, path):
+        self.path = path
+        self._local = threading.local()
+        self._flusher = None
+        self._flusher_lock = threading.Lock()
+        self._stop = threading.Event()
+        self.journal_id = self._setup()
+
+    def _connect(self):
+        connection = getattr(self._local, 'connection', None)
+        if connection is None:
+            # Autocommit mode; transactions are opened explicitly with BEGIN IMMEDIATE
+            connection = sqlite3.connect(self.path, timeout=30, isolation_level=None)
+            connection.execute('PRAGMA journal_mode=WAL')
+            connection.execute('PRAGMA synchronous=FULL')
+            self._local.connection = connection
+        return connection
+
+    def _setup(self):
+        os.makedirs(os.path.dirname(os.path.abspath(self.path)), exist_ok=True)
+        connection = self._connect()
+        connection.executescript(SCHEMA)
+        connection.execute('INSERT OR IGNORE INTO meta (key, value) VALUES (?, ?)', ('journal_id', uuid.uuid4().hex))
+        return connection.execute("SELECT value FROM meta WHERE key = 'journal_id'").fetchone()[0]
+
+    @contextmanager
+    def _locked(self):
+        """Hold the journal's write lock, which is shared across processes."""
+        connection = self._connect()
+        connection.execute('BEGIN IMMEDIATE')
+        try:
+            yield connection
+        except BaseException:
+            connection.execute('ROLLBACK')
+            raise
+        connection.execute('COMMIT')
+
+    def _applied_id(self):
+        from .models import JournalCheckpoint
+        checkpoint = JournalCheckpoint.objects.filter(journal_id=self.journal_id).values_list('applied_id', flat=True).first()
+        return checkpoint or 0
+
+    def append(self, model, keys, deltas, user_id=None, charged_bytes=0):
+        """Queue an increment of the counter row of `model` matching `keys`."""
+        with self._locked() as connection:
+            cursor = connection.execute(
+                'INSERT INTO deltas (model, keys, deltas, user_id, charged_bytes) VALUES (?, ?, ?, ?, ?)',
+                (model._meta.label, json.dumps(keys, sort_keys=True, cls=DjangoJSONEncoder), json.dumps(deltas), user_id, charged_bytes),
+            )
+        self._ensure_flusher()
+        return cursor.lastrowid
+
+    def pending_bytes(self, user_id, connection=None, applied_id=None):
+        """Storage charged to a user that hasn't reached the database yet."""
+        connection = connection or self._connect()
+        if applied_id is None:
+            applied_id = self._applied_id()
+        row = connection.execute(
+            'SELECT COALESCE(SUM(charged_bytes), 0) FROM deltas WHERE user_id = ? AND id > ?',
+            (user_id, applied_id),
+        ).fetchone()
+        return row[0]
+
+    def storage_used(self, user_id):
+        """Stored usage plus unflushed charges, read under the lock so a concurrent flush isn't counted twice."""
+        from .models import UserProfile
+
+        with self._locked() as connection:
+            stored = UserProfile.objects.filter(user_id=user_id).values_list('current_storage_used', flat=True).first() or 0
+            return stored + self.pending_bytes(user_id, connection)
+
+    def reserve(self, user_id, nbytes, limit_bytes):
+        """
+        Charge nbytes of storage to a user unless that would exceed limit_bytes.
+
+        Raises QuotaExceeded instead of charging. Undo a reservation whose
+        upload fails with another charge of -nbytes.
+        """
+        from .models import UserProfile
+
+        with self._locked() as connection:
+            stored = UserProfile.objects.filter(user_id=user_id).values_list('current_storage_used', flat=True).first() or 0
+            used = stored + self.pending_bytes(user_id, connection)
+            if used + nbytes > limit_bytes:
+                raise QuotaExceeded()
+            connection.execute(
+                'INSERT INTO deltas (model, keys, deltas, user_id, charged_bytes) VALUES (?, ?, ?, ?, ?)',
+                (UserProfile._meta.label, json.dumps({'user_id': user_id}),
+                 json.dumps({'current_storage_used': nbytes}), user_id, nbytes),
+            )
+        self._ensure_flusher()
+        return used + nbytes
+
+    def flush(self, batch_size=None):
+        """Apply queued deltas to the database in one transaction. Returns the number applied."""
+        from . import counters
+        from .models import JournalCheckpoint
+
+        batch_size = batch_size or get_setting('FLUSH_BATCH_SIZE')
+        with self._locked() as connection:
+            applied_id = self._applied_id()
+            rows = connection.execute(
+                'SELECT id, model, keys, deltas FROM deltas WHERE id > ? ORDER BY id LIMIT ?',
+                (applied_id, batch_size),
+            ).fetchall()
+            if rows:
+                # Many uploads to one account collapse into a single UPDATE per counter row
+                totals = defaultdict(lambda: defaultdict(int))
+                for _, model, keys, deltas in rows:
+                    for field, value in json.loads(deltas).items():
+                        totals[model, keys][field] += value
+
+                last_id = rows[-1][0]
+                with transaction.atomic():
+                    for (model, keys), deltas in totals.items():
+                        counters.apply_increment(apps.get_model(model), json.loads(keys), deltas)
+                    JournalCheckpoint.objects.update_or_create(
+                        journal_id=self.journal_id, defaults={'applied_id': last_id}
+                    )
+                applied_id = last_id
+            # Rows at or below the checkpoint are in the database; this also
+            # clears anything left over from a crash between the two commits
+            connection.execute('DELETE FROM deltas WHERE id <= ?', (applied_id,))
+        return len(rows)
+
+    def flush_all(self):
+        total = 0
+        while True:
+            applied = self.flush()
+            total += applied
+            if not applied:
+                return total
+
+    def _ensure_flusher(self):
+        if self._flusher is not None and self._flusher.is_alive():
+            return
+        with self._flusher_lock:
+            if self._flusher is None or not self._flusher.is_alive():
+                self._stop.clear()
+                self._flusher = threading.Thread(target=self._run, name='journal-flusher', daemon=True)
+                self._flusher.start()
+
+    def _run(self):
+        from django.db import connection
+
+        interval = get_setting('FLUSH_INTERVAL_MS') / 1000
+        while not self._stop.wait(interval):
+            try:
+                self.flush_all()
+            except Exception:
+                logger.exception('Write-behind flush failed; deltas stay queued')
+            finally:
+                connection.close()
+
+    def stop(self):
+        """Stop the flusher thread and apply everything still queued."""
+        self._stop.set()
+        if self._flusher is not None:
+            self._flusher.join()
+        self.flush_all()
+
+
+_journal = None
+_journal_lock = threading.Lock()
+
+
+def get_journal():
+    global _journal
+    with _journal_lock:
+        if _journal is None or _journal.path != get_setting('PATH'):
+            _journal = Journal(get_setting('PATH'))
+        return _journal
+
+
+@atexit.register
+def _flush_at_exit():
+    if _journal is not None and enabled():
+        try:
+            _journal.stop()
+        except Exception:
+            logger.exception('Write-behind flush at exit failed; deltas stay queued for the next flush')
@@ -0,0 +1,58 @@
+import json
+import time
+
+from django.core.management.base import BaseCommand
+
+from files import analytics, counters, journal
+
+
+class Command(BaseCommand):
+    help = 'Print fleet-wide storage analytics from the daily rollup tables'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--top', type=int, default=analytics.get_setting('TOP_USERS'), help='Number of top users to list')
+        parser.add_argument('--days', type=int, default=analytics.get_setting('GROWTH_DAYS'), help='Days of growth history')
+        parser.add_argument('--json', action='store_true', help='Print the report as JSON')
+        parser.add_argument('--rebuild', action='store_true',
+                            help='Recompute the rollups and per-user file type counters from the File table first')
+
+    def handle(self, *args, **options):
+        if options['rebuild']:
+            # Queued deltas would otherwise be applied on top of the recomputed totals
+            if journal.enabled():
+                journal.get_journal().flush_all()
+            days = analytics.rebuild()
+            types = counters.rebuild_file_types()
+            self.stderr.write(f"Rebuilt rollups for {days} day(s) and {types} user file type counter(s)")
+
+        start = time.perf_counter()
+        report = {
+            'summary': analytics.summary(),
+            'top_users': analytics.top_users(options['top']),
+            'file_types': analytics.file_type_distribution(),
+            'growth': analytics.growth(options['days']),
+        }
+        elapsed_ms = (time.perf_counter() - start) * 1000
+
+        if options['json']:
+            self.stdout.write(json.dumps(report, indent=2))
+            return
+
+        summary = report['summary']
+        self.stdout.write(
+            f"{summary['users']} user(s), {summary['files']} file(s), "
+            f"{summary['logical_bytes']} logical bytes, {summary['physical_bytes']} physical bytes, "
+            f"{summary['dedup_savings']} saved by dedup ({summary['dedup_savings_percentage']}%)"
+        )
+        self.stdout.write('\nTop users by bytes:')
+        for row in report['top_users']:
+            self.stdout.write(f"  {row['username']:<30} {row['storage_used']:>16}")
+        self.stdout.write('\nFile types:')
+        for row in report['file_types']:
+            self.stdout.write(f"  {row['file_type']:<40} {row['files']:>10} {row['bytes']:>16}")
+        self.stdout.write(f"\nGrowth over the last {options['days']} day(s):")
+        for row in report['growth']:
+            self.stdout.write(
+                f"  {row['date']}  +{row['files_added']}/-{row['files_removed']} files  {row['net_bytes']:+d} bytes"
+            )
+        self.stdout.write(self.style.SUCCESS(f"\nReport computed in {elapsed_ms:.1f} ms"))
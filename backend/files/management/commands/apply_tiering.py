@@ -0,0 +1,27 @@
+import time
+
+from django.core.management.base import BaseCommand
+
+from files import tiering
+
+
+class Command(BaseCommand):
+    help = 'Migrate cold blobs off the hot tier'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--limit', type=int, default=None, help='Maximum number of blobs to migrate')
+        parser.add_argument('--dry-run', action='store_true', help='Report what would be migrated without moving anything')
+        parser.add_argument('--interval', type=float, default=None,
+                            help='Keep running, applying the policy every INTERVAL seconds')
+
+    def handle(self, *args, **options):
+        while True:
+            moved_files, moved_bytes = tiering.apply_policy(limit=options['limit'], dry_run=options['dry_run'])
+
+            verb = 'Would migrate' if options['dry_run'] else 'Migrated'
+            self.stdout.write(self.style.SUCCESS(
+                f"{verb} {moved_files} blob(s), {moved_bytes} bytes, to the {tiering.get_setting('COLD_TIER')} tier"
+            ))
+            if options['interval'] is None:
+                return
+            time.sleep(options['interval'])
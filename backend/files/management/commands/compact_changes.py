@@ -0,0 +1,23 @@
+import time
+
+from django.core.management.base import BaseCommand
+
+from files import changes
+
+
+class Command(BaseCommand):
+    help = 'Drop superseded change feed events and expire old tombstones'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=changes.get_setting('COMPACT_BATCH_SIZE'),
+                            help='Event ids compacted per transaction')
+        parser.add_argument('--interval', type=float, default=None,
+                            help='Keep running, compacting every INTERVAL seconds')
+
+    def handle(self, *args, **options):
+        while True:
+            removed = changes.compact(options['batch_size'])
+            self.stdout.write(self.style.SUCCESS(f"Removed {removed} change event(s)"))
+            if options['interval'] is None:
+                return
+            time.sleep(options['interval'])
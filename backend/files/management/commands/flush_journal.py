@@ -0,0 +1,14 @@
+from django.core.management.base import BaseCommand, CommandError
+
+from files import journal
+
+
+class Command(BaseCommand):
+    help = 'Apply every counter delta queued in the write-behind journal to the database'
+
+    def handle(self, *args, **options):
+        if not journal.enabled():
+            raise CommandError('Write-behind is disabled (WRITE_BEHIND["ENABLED"]); there is nothing to flush')
+
+        applied = journal.get_journal().flush_all()
+        self.stdout.write(self.style.SUCCESS(f"Applied {applied} journal entr{'y' if applied == 1 else 'ies'}"))
@@ -0,0 +1,231 @@
+import fcntl
+import hashlib
+import mimetypes
+import os
+import shutil
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+from django.conf import settings
+from django.contrib.auth.models import User
+from django.core.files.storage import default_storage
+from django.core.management.base import BaseCommand, CommandError
+from django.db import transaction
+
+from files import analytics, changes, counters, hashing
+from files.models import File, UserProfile
+
+# ioctl request number for FICLONE on Linux (copy-on-write clone of a whole file)
+FICLONE = 0x40049409
+
+LINK_MODES = ['auto', 'reflink', 'hardlink', 'copy']
+
+
+def walk_tree(root):
+    """Yield (path, relative path, size) for every regular file under root, using os.scandir."""
+    stack = [root]
+    while stack:
+        directory = stack.pop()
+        try:
+            with os.scandir(directory) as entries:
+                for entry in entries:
+                    if entry.is_dir(follow_symlinks=False):
+                        stack.append(entry.path)
+                    elif entry.is_file(follow_symlinks=False):
+                        yield entry.path, os.path.relpath(entry.path, root), entry.stat(follow_symlinks=False).st_size
+        except PermissionError:
+            continue
+
+
+def reflink(src, dst):
+    with open(src, 'rb') as fin, open(dst, 'wb') as fout:
+        try:
+            fcntl.ioctl(fout.fileno(), FICLONE, fin.fileno())
+        except OSError:
+            fout.close()
+            os.remove(dst)
+            raise
+
+
+def place_blob(src, dst, mode):
+    """Put src at dst without copying where the filesystem allows it; returns the method used."""
+    os.makedirs(os.path.dirname(dst), exist_ok=True)
+    if mode in ('auto', 'reflink'):
+        try:
+            reflink(src, dst)
+            return 'reflink'
+        except OSError:
+            if mode == 'reflink':
+                raise
+    if mode in ('auto', 'hardlink'):
+        try:
+            os.link(src, dst)
+            return 'hardlink'
+        except OSError:
+            if mode == 'hardlink':
+                raise
+    shutil.copyfile(src, dst)
+    return 'copy'
+
+
+class Command(BaseCommand):
+    help = (
+        'Import an existing directory tree for a user, deduplicating like uploads do. '
+        'Files are reflinked or hardlinked into storage where possible; note that a '
+        'hardlinked source edited in place also changes the stored copy. '
+        'Interrupted imports resume from a journal of completed files.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('root', help='Directory to import')
+        parser.add_argument('--user', type=int, required=True, help='ID of the user who will own the files')
+        parser.add_argument('--batch-size', type=int, default=500, help='Files inserted per transaction')
+        parser.add_argument('--workers', type=int, default=os.cpu_count(), help='Hashing processes')
+        parser.add_argument('--link', choices=LINK_MODES, default='auto', help='How blobs are placed into storage')
+        parser.add_argument('--journal', default=None, help='Progress journal used to resume (default: under data/)')
+        parser.add_argument('--ignore-quota', action='store_true', help="Don't stop when the user's storage limit is reached")
+
+    def handle(self, *args, **options):
+        root = os.path.abspath(options['root'])
+        if not os.path.isdir(root):
+            raise CommandError(f"{root} is not a directory")
+        try:
+            self.user = User.objects.get(pk=options['user'])
+        except User.DoesNotExist:
+            raise CommandError(f"User {options['user']} does not exist")
+        self.profile, _ = UserProfile.objects.get_or_create(user=self.user)
+        self.options = options
+
+        journal_path = options['journal'] or os.path.join(
+            settings.BASE_DIR, 'data',
+            f"import_tree-{self.user.pk}-{hashlib.sha1(root.encode()).hexdigest()[:12]}.journal"
+        )
+        done = set()
+        if os.path.exists(journal_path):
+            with open(journal_path) as f:
+                done = {line.rstrip('\n') for line in f}
+            self.stdout.write(f"Resuming: {len(done)} file(s) already imported")
+
+        self.stats = {'files': 0, 'bytes': 0, 'duplicates': 0, 'skipped': 0, 'reflink': 0, 'hardlink': 0, 'copy': 0}
+        started = time.monotonic()
+
+        os.makedirs(os.path.dirname(journal_path), exist_ok=True)
+        with ProcessPoolExecutor(max_workers=options['workers']) as pool, open(journal_path, 'a') as journal:
+            batch = []
+            for path, relpath, size in walk_tree(root):
+                if relpath in done:
+                    continue
+                if len(relpath) > File._meta.get_field('original_filename').max_length:
+                    self.stderr.write(f"Skipping {relpath}: path too long")
+                    self.stats['skipped'] += 1
+                    continue
+                batch.append((path, relpath, size))
+                if len(batch) >= options['batch_size']:
+                    self._import_batch(batch, pool, journal)
+                    batch = []
+            if batch:
+                self._import_batch(batch, pool, journal)
+
+        elapsed = max(time.monotonic() - started, 1e-9)
+        self.stdout.write(self.style.SUCCESS(
+            f"Imported {self.stats['files']} file(s) ({self.stats['duplicates']} duplicate(s), "
+            f"{self.stats['bytes']} bytes) in {elapsed:.1f}s: "
+            f"{self.stats['files'] / elapsed:.1f} files/s, {self.stats['bytes'] / elapsed / 1024 / 1024:.1f} MB/s "
+            f"[reflink={self.stats['reflink']} hardlink={self.stats['hardlink']} copy={self.stats['copy']} "
+            f"skipped={self.stats['skipped']}]"
+        ))
+
+    def _import_batch(self, batch, pool, journal):
+        chunksize = max(1, len(batch) // (self.options['workers'] * 4))
+        digests = list(pool.map(hashing.sha256_path, [path for path, _, _ in batch], chunksize=chunksize))
+
+        # Files already committed by an interrupted run that didn't reach the journal
+        already_imported = set(
+            File.objects.filter(
+                owner=self.user,
+                original_filename__in=[relpath for _, relpath, _ in batch],
+            ).values_list('original_filename', 'file_hash')
+        )
+
+        # Same dedup semantics as uploads: the first record with a hash owns the blob,
+        # later ones are references to it
+        originals = dict(
+            File.objects.filter(owner=self.user, is_duplicate=False, file_hash__in=set(digests))
+            .values_list('file_hash', 'pk')
+        )
+
+        records = []
+        completed = []
+        placed = []
+        new_bytes = 0
+        for (path, relpath, size), file_hash in zip(batch, digests):
+            if (relpath, file_hash) in already_imported:
+                completed.append(relpath)
+                continue
+            file_type = mimetypes.guess_type(relpath)[0] or 'application/octet-stream'
+            record = File(
+                original_filename=relpath,
+                file_type=file_type,
+                size=size,
+                file_hash=file_hash,
+                owner=self.user,
+            )
+            if file_hash in originals:
+                record.is_duplicate = True
+                record.original_file_ref_id = originals[file_hash]
+                self.stats['duplicates'] += 1
+            else:
+                name = record.file.field.generate_filename(record, os.path.basename(relpath))
+                dst = default_storage.path(name)
+                try:
+                    method = place_blob(path, dst, self.options['link'])
+                except OSError as exc:
+                    self.stderr.write(f"Skipping {relpath}: {exc}")
+                    self.stats['skipped'] += 1
+                    continue
+                self.stats[method] += 1
+                placed.append(dst)
+                record.file.name = name
+                originals[file_hash] = record.pk
+                new_bytes += size
+            records.append(record)
+            completed.append(relpath)
+
+        if not self.options['ignore_quota']:
+            limit = self.profile.storage_limit_mb * 1024 * 1024
+            if counters.storage_used(self.user.pk) + new_bytes > limit:
+                self._remove(placed)
+                raise CommandError(
+                    f"Storage quota for user {self.user.pk} would be exceeded; "
+                    f"rerun with --ignore-quota or raise the limit to continue"
+                )
+
+        try:
+            with transaction.atomic():
+                # Originals come first so duplicates in the same batch can reference them
+                records.sort(key=lambda record: record.is_duplicate)
+                File.objects.bulk_create(records, batch_size=500)
+
+                # Counters are updated once per batch rather than once per file
+                counters.charge_storage(self.user.pk, new_bytes)
+                counters.count_file_types_bulk(records)
+                analytics.record_bulk(records)
+                changes.record_bulk(records, changes.CREATED)
+        except Exception:
+            self._remove(placed)
+            raise
+
+        for relpath in completed:
+            journal.write(relpath + '\n')
+        journal.flush()
+        os.fsync(journal.fileno())
+
+        self.stats['files'] += len(records)
+        self.stats['bytes'] += sum(record.size for record in records)
+        if self.options['verbosity'] > 1:
+            self.stdout.write(f"Imported batch of {len(records)} file(s)")
+
+    def _remove(self, paths):
+        for path in paths:
+            if os.path.isfile(path):
+                os.remove(path)
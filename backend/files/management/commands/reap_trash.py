@@ -0,0 +1,35 @@
+import time
+
+from django.core.management.base import BaseCommand
+
+from files import trash
+
+
+class Command(BaseCommand):
+    help = 'Purge trashed files whose retention has passed, in bounded batches'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=trash.get_setting('REAP_BATCH_SIZE'),
+                            help='Files purged per batch')
+        parser.add_argument('--max-batches', type=int, default=None, help='Stop after this many batches')
+        parser.add_argument('--interval', type=float, default=None,
+                            help='Keep running, checking for due files every INTERVAL seconds')
+
+    def handle(self, *args, **options):
+        while True:
+            purged, freed = self.reap(options['batch_size'], options['max_batches'])
+            self.stdout.write(self.style.SUCCESS(f"Purged {purged} file(s), freed {freed} bytes"))
+            if options['interval'] is None:
+                return
+            time.sleep(options['interval'])
+
+    def reap(self, batch_size, max_batches):
+        purged = freed = batches = 0
+        while max_batches is None or batches < max_batches:
+            batch_purged, batch_freed = trash.reap(batch_size)
+            purged += batch_purged
+            freed += batch_freed
+            batches += 1
+            if batch_purged < batch_size:
+                break
+        return purged, freed
@@ -0,0 +1,50 @@
+from django.core.management.base import BaseCommand
+
+from files import hashing, tiering
+from files.models import File
+
+
+class Command(BaseCommand):
+    help = 'Re-hash stored blobs in parallel and report any that are missing or corrupted'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--workers', type=int, default=None, help='Hashing threads (default: HASHING["WORKERS"])')
+        parser.add_argument('--batch-size', type=int, default=1000, help='Blobs hashed per batch')
+
+    def handle(self, *args, **options):
+        # Archived blobs are gzip-compressed on disk and can't be compared directly
+        blobs = (
+            File.objects.filter(is_duplicate=False)
+            .exclude(file='')
+            .exclude(storage_tier=tiering.TIER_ARCHIVE)
+            .only('id', 'file', 'file_hash', 'storage_tier')
+        )
+
+        checked = 0
+        problems = 0
+        batch = []
+        for file_record in blobs.iterator(chunk_size=options['batch_size']):
+            batch.append(file_record)
+            if len(batch) >= options['batch_size']:
+                problems += self._check(batch, options['workers'])
+                checked += len(batch)
+                batch = []
+        if batch:
+            problems += self._check(batch, options['workers'])
+            checked += len(batch)
+
+        style = self.style.SUCCESS if problems == 0 else self.style.ERROR
+        self.stdout.write(style(f"Checked {checked} blob(s), {problems} problem(s) found"))
+
+    def _check(self, batch, workers):
+        paths = {tiering.blob_path(file_record): file_record for file_record in batch}
+        problems = 0
+        for path, digest in hashing.hash_many(list(paths), workers).items():
+            file_record = paths[path]
+            if digest is None:
+                self.stdout.write(self.style.WARNING(f"{file_record.id}: blob missing at {path}"))
+                problems += 1
+            elif digest != file_record.file_hash:
+                self.stdout.write(self.style.WARNING(f"{file_record.id}: hash mismatch ({digest} != {file_record.file_hash})"))
+                problems += 1
+        return problems
@@ -0,0 +1,123 @@
+import hashlib
+import json
+import os
+import random
+
+from django.contrib.auth.models import User
+from django.core.files.storage import default_storage
+from django.core.management.base import BaseCommand
+from django.db import transaction
+
+from files import analytics, changes, counters
+from files.models import File, UserProfile
+
+# Words used in synthetic filenames so search scenarios have something to match
+WORDS = ['report', 'invoice', 'photo', 'backup', 'notes', 'draft', 'config', 'archive', 'scan', 'slides']
+
+FILE_TYPES = [
+    ('txt', 'text/plain'),
+    ('pdf', 'application/pdf'),
+    ('png', 'image/png'),
+    ('jpg', 'image/jpeg'),
+    ('json', 'application/json'),
+    ('zip', 'application/zip'),
+]
+
+# (weight, min bytes, max bytes) of the size mixes
+SIZE_MIXES = {
+    'small': [(1, 256, 16 * 1024)],
+    'mixed': [(70, 256, 16 * 1024), (25, 16 * 1024, 1024 * 1024), (5, 1024 * 1024, 8 * 1024 * 1024)],
+    'large': [(50, 1024 * 1024, 8 * 1024 * 1024), (50, 8 * 1024 * 1024, 64 * 1024 * 1024)],
+}
+
+
+class Command(BaseCommand):
+    help = 'Seed synthetic users and files for benchmarks (real blobs, configurable duplicate ratio)'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--users', type=int, default=10)
+        parser.add_argument('--files', type=int, default=10000, help='Total file rows across all users')
+        parser.add_argument('--dup-ratio', type=float, default=0.2, help='Fraction of rows that duplicate an earlier file')
+        parser.add_argument('--size-mix', choices=sorted(SIZE_MIXES), default='mixed')
+        parser.add_argument('--seed', type=int, default=42, help='Random seed, for reproducible datasets')
+        parser.add_argument('--batch-size', type=int, default=5000)
+        parser.add_argument('--no-blobs', action='store_true', help='Only create rows; downloads of them will fail')
+        parser.add_argument('--manifest', default=None, help='Write user ids and sample file ids to this JSON file')
+        parser.add_argument('--sample-size', type=int, default=200, help='File ids per user recorded in the manifest')
+
+    def handle(self, *args, **options):
+        rng = random.Random(options['seed'])
+        mix = SIZE_MIXES[options['size_mix']]
+        weights = [weight for weight, _, _ in mix]
+
+        users = []
+        for index in range(options['users']):
+            user, _ = User.objects.get_or_create(username=f'bench-{options["seed"]}-{index}')
+            users.append(user)
+        # Benchmark users must not hit the request throttle or storage quota
+        UserProfile.objects.filter(user__in=users).update(api_calls_per_second=10 ** 6, storage_limit_mb=10 ** 9)
+
+        manifest = {'users': {user.pk: [] for user in users}}
+        usage = {user.pk: 0 for user in users}
+        originals = {user.pk: [] for user in users}
+
+        batch = []
+        for index in range(options['files']):
+            user = users[index % len(users)]
+            word = rng.choice(WORDS)
+            ext, file_type = rng.choice(FILE_TYPES)
+            record = File(
+                original_filename=f'{word}-{index}.{ext}',
+                file_type=file_type,
+                owner=user,
+            )
+
+            user_originals = originals[user.pk]
+            if user_originals and rng.random() < options['dup_ratio']:
+                original = rng.choice(user_originals)
+                record.is_duplicate = True
+                record.original_file_ref_id = original.pk
+                record.size = original.size
+                record.file_hash = original.file_hash
+            else:
+                _, low, high = rng.choices(mix, weights)[0]
+                record.size = rng.randint(low, high)
+                content = rng.randbytes(record.size)
+                record.file_hash = hashlib.sha256(content).hexdigest()
+                record.file.name = record.file.field.generate_filename(record, record.original_filename)
+                if not options['no_blobs']:
+                    path = default_storage.path(record.file.name)
+                    os.makedirs(os.path.dirname(path), exist_ok=True)
+                    with open(path, 'wb') as f:
+                        f.write(content)
+                user_originals.append(record)
+                usage[user.pk] += record.size
+
+            if len(manifest['users'][user.pk]) < options['sample_size']:
+                manifest['users'][user.pk].append(str(record.pk))
+            batch.append(record)
+            if len(batch) >= options['batch_size']:
+                self._flush(batch)
+                batch = []
+        if batch:
+            self._flush(batch)
+
+        with transaction.atomic():
+            for user in users:
+                counters.charge_storage(user.pk, usage[user.pk])
+
+        if options['manifest']:
+            with open(options['manifest'], 'w') as f:
+                json.dump(manifest, f)
+        self.stdout.write(self.style.SUCCESS(
+            f"Seeded {options['files']} file(s) for {len(users)} user(s), {sum(usage.values())} bytes of blobs"
+        ))
+
+    def _flush(self, batch):
+        # Originals first so duplicates in the same batch can reference them
+        batch.sort(key=lambda record: record.is_duplicate)
+        with transaction.atomic():
+            File.objects.bulk_create(batch)
+            counters.count_file_types_bulk(batch)
+            analytics.record_bulk(batch)
+            changes.record_bulk(batch, changes.CREATED)
@@ -0,0 +1,389 @@
+"""
+In-process Prometheus metrics, served at /metrics.
+
+Each process keeps its own values. Under a multi-worker server, set
+MULTIPROCESS_DIR (gunicorn.conf.py does) so every worker writes a snapshot
+of its values there every SNAPSHOT_INTERVAL seconds. A scrape then merges
+all snapshots, whichever worker answers it: counters and histograms are
+summed over every process that ever wrote one, so they never go backwards
+when a worker is replaced, and gauges over the processes still alive.
+"""
+import json
+import logging
+import os
+import threading
+import time
+import uuid
+from bisect import bisect_left
+from contextlib import contextmanager
+
+from django.conf import settings
+
+logger = logging.getLogger(__name__)
+
+DEFAULTS = {
+    'ENABLED': True,
+    'SLOW_REQUEST_MS': 1000,
+    'MULTIPROCESS_DIR': None,
+    'SNAPSHOT_INTERVAL': 1.0,
+    'PER_USER_LABELS': False,
+}
+
+LATENCY_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+COUNT_BUCKETS = (0, 1, 2, 5, 10, 20, 50, 100, 200, 500)
+
+
+def get_setting(name):
+    """Read a metrics option from settings.METRICS, falling back to defaults."""
+    return getattr(settings, 'METRICS', {}).get(name, DEFAULTS[name])
+
+
+def enabled():
+    return get_setting('ENABLED')
+
+
+def _escape(value):
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+def _format_labels(labelnames, labels, extra=None):
+    pairs = list(zip(labelnames, labels))
+    if extra:
+        pairs.append(extra)
+    if not pairs:
+        return ''
+    return '{' + ','.join(f'{name}="{_escape(value)}"' for name, value in pairs) + '}'
+
+
+def _format_value(value):
+    if value == float('inf'):
+        return '+Inf'
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+class Metric:
+    type = None
+
+    def __init__(self, name, documentation, labelnames=(), collector_registry=None):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._lock = threading.Lock()
+        self._values = {}
+        (collector_registry or registry).register(self)
+
+    def values(self):
+        with self._lock:
+            return {labels: (list(value) if isinstance(value, list) else value) for labels, value in self._values.items()}
+
+    def combine(self, total, value):
+        """Merge one process's sample into the total from the others."""
+        return value if total is None else total + value
+
+    def render(self, values=None):
+        lines = [f'# HELP {self.name} {self.documentation}', f'# TYPE {self.name} {self.type}']
+        for labels, value in sorted((self.values() if values is None else values).items()):
+            lines.extend(self._render_sample(labels, value))
+        return lines
+
+    def _render_sample(self, labels, value):
+        return [f'{self.name}{_format_labels(self.labelnames, labels)} {_format_value(value)}']
+
+
+class Counter(Metric):
+    type = 'counter'
+
+    def inc(self, amount=1, labels=()):
+        with self._lock:
+            self._values[labels] = self._values.get(labels, 0) + amount
+
+    def set(self, value, labels=()):
+        """Set the total outright, for counts kept elsewhere (see register_sampler)."""
+        with self._lock:
+            self._values[labels] = value
+
+
+class Gauge(Metric):
+    type = 'gauge'
+
+    def set(self, value, labels=()):
+        with self._lock:
+            self._values[labels] = value
+
+
+class Histogram(Metric):
+    """Cumulative-bucket histogram; each sample is [bucket counts..., sum, count]."""
+    type = 'histogram'
+
+    def __init__(self, name, documentation, labelnames=(), buckets=LATENCY_BUCKETS, collector_registry=None):
+        self.buckets = tuple(buckets)
+        super().__init__(name, documentation, labelnames, collector_registry)
+
+    def observe(self, value, labels=()):
+        index = bisect_left(self.buckets, value)
+        with self._lock:
+            sample = self._values.get(labels)
+            if sample is None:
+                sample = self._values[labels] = [0] * (len(self.buckets) + 3)
+            # Only the first matching bucket is bumped; buckets are made cumulative on render
+            sample[index] += 1
+            sample[-2] += value
+            sample[-1] += 1
+
+    def combine(self, total, value):
+        return list(value) if total is None else [a + b for a, b in zip(total, value)]
+
+    def _render_sample(self, labels, sample):
+        lines = []
+        cumulative = 0
+        for bound, count in zip(self.buckets + (float('inf'),), sample):
+            cumulative += count
+            label_text = _format_labels(self.labelnames, labels, ('le', _format_value(bound)))
+            lines.append(f'{self.name}_bucket{label_text} {cumulative}')
+        label_text = _format_labels(self.labelnames, labels)
+        lines.append(f'{self.name}_sum{label_text} {_format_value(sample[-2])}')
+        lines.append(f'{self.name}_count{label_text} {sample[-1]}')
+        return lines
+
+
+def _alive(pid):
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        pass
+    return True
+
+
+class Registry:
+    def __init__(self):
+        self._metrics = []
+        self._collectors = []
+        self._samplers = []
+        self._writer = None
+        self._writer_lock = threading.Lock()
+        self._pid = None
+        self._snapshot_name = None
+
+    def register(self, metric):
+        self._metrics.append(metric)
+
+    def register_collector(self, collector):
+        """Register a callable returning extra exposition lines, evaluated at scrape time."""
+        self._collectors.append(collector)
+
+    def register_sampler(self, sampler):
+        """Register a callable that copies process-local state into metrics before they're read."""
+        self._samplers.append(sampler)
+
+    def _snapshot_path(self, directory):
+        # A fresh name per process, so a recycled pid never overwrites a dead worker's totals
+        if self._pid != os.getpid():
+            self._pid = os.getpid()
+            self._snapshot_name = f'{self._pid}-{uuid.uuid4().hex}.json'
+        return os.path.join(directory, self._snapshot_name)
+
+    def write_snapshot(self):
+        """Write this process's values to MULTIPROCESS_DIR, if set."""
+        directory = get_setting('MULTIPROCESS_DIR')
+        if not directory:
+            return
+        for sampler in self._samplers:
+            sampler()
+        os.makedirs(directory, exist_ok=True)
+        path = self._snapshot_path(directory)
+        snapshot = {
+            'pid': self._pid,
+            'metrics': {metric.name: [[list(labels), value] for labels, value in metric.values().items()]
+                        for metric in self._metrics},
+        }
+        tmp = f'{path}.tmp'
+        with open(tmp, 'w') as f:
+            json.dump(snapshot, f)
+        os.replace(tmp, path)
+
+    def ensure_writer(self):
+        """Start this process's snapshot writer, once per process."""
+        if not get_setting('MULTIPROCESS_DIR') or (self._writer is not None and self._writer.is_alive()):
+            return
+        with self._writer_lock:
+            if self._writer is None or not self._writer.is_alive():
+                self._writer = threading.Thread(target=self._run_writer, name='metrics-snapshot', daemon=True)
+                self._writer.start()
+
+    def _run_writer(self):
+        while True:
+            time.sleep(get_setting('SNAPSHOT_INTERVAL'))
+            try:
+                self.write_snapshot()
+            except Exception:
+                logger.exception('Writing the metrics snapshot failed')
+
+    def _merged_values(self, directory):
+        merged = {metric.name: {} for metric in self._metrics}
+        for entry in os.scandir(directory):
+            if not entry.name.endswith('.json'):
+                continue
+            try:
+                with open(entry.path) as f:
+                    snapshot = json.load(f)
+            except (OSError, ValueError):
+                continue
+            alive = _alive(snapshot['pid'])
+            for metric in self._metrics:
+                if metric.type == 'gauge' and not alive:
+                    continue
+                totals = merged[metric.name]
+                for labels, value in snapshot['metrics'].get(metric.name, []):
+                    labels = tuple(labels)
+                    totals[labels] = metric.combine(totals.get(labels), value)
+        return merged
+
+    def render(self):
+        directory = get_setting('MULTIPROCESS_DIR')
+        if directory:
+            self.write_snapshot()
+            merged = self._merged_values(directory)
+        else:
+            for sampler in self._samplers:
+                sampler()
+            merged = {metric.name: metric.values() for metric in self._metrics}
+        lines = []
+        for metric in self._metrics:
+            lines.extend(metric.render(merged[metric.name]))
+        for collector in self._collectors:
+            lines.extend(collector())
+        return '\n'.join(lines) + '\n'
+
+
+registry = Registry()
+
+REQUEST_LATENCY = Histogram(
+    'filevault_request_duration_seconds', 'HTTP request latency by view', ['view', 'method', 'status'])
+REQUEST_DB_QUERIES = Histogram(
+    'filevault_request_db_queries', 'Database queries executed per request', ['view'], buckets=COUNT_BUCKETS)
+SPAN_LATENCY = Histogram(
+    'filevault_span_duration_seconds', 'Time spent in instrumented sections of request handling', ['span'])
+UPLOADED_BYTES = Counter('filevault_uploaded_bytes_total', 'Bytes received in file uploads')
+UPLOADED_FILES = Counter('filevault_uploaded_files_total', 'Files uploaded', ['kind'])
+UPLOADS_REJECTED = Counter('filevault_uploads_rejected_total', 'Uploads stopped by an inspector while being received', ['reason'])
+DOWNLOADED_BYTES = Counter('filevault_downloaded_bytes_total', 'Bytes sent in file downloads', ['source'])
+CONTENT_CACHE_HITS = Counter('filevault_content_cache_hits_total', 'Content cache hits')
+CONTENT_CACHE_MISSES = Counter('filevault_content_cache_misses_total', 'Content cache misses')
+CONTENT_CACHE_EVICTIONS = Counter('filevault_content_cache_evictions_total', 'Content cache evictions')
+CONTENT_CACHE_ENTRIES = Gauge('filevault_content_cache_entries', 'Content cache entries')
+CONTENT_CACHE_BYTES = Gauge('filevault_content_cache_current_bytes', 'Content cache current bytes')
+SHAPING_WAIT = Counter('filevault_bandwidth_shaping_wait_seconds_total', 'Time transfers spent paced by bandwidth limits', ['direction'])
+
+
+# Per-thread state of the request being handled, for per-request span and query totals
+_local = threading.local()
+
+
+class RequestContext:
+    __slots__ = ('db_queries', 'db_time', 'spans')
+
+    def __init__(self):
+        self.db_queries = 0
+        self.db_time = 0.0
+        self.spans = {}
+
+
+def begin_request():
+    registry.ensure_writer()
+    _local.context = RequestContext()
+    return _local.context
+
+
+def end_request():
+    _local.context = None
+
+
+def current_request():
+    return getattr(_local, 'context', None)
+
+
+@contextmanager
+def span(name):
+    """Time a section of request handling into the span histogram."""
+    if not enabled():
+        yield
+        return
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        elapsed = time.perf_counter() - start
+        SPAN_LATENCY.observe(elapsed, (name,))
+        context = current_request()
+        if context is not None:
+            context.spans[name] = context.spans.get(name, 0.0) + elapsed
+
+
+def count_query(execute, sql, params, many, context):
+    """connection.execute_wrapper hook counting and timing every query."""
+    start = time.perf_counter()
+    try:
+        return execute(sql, params, many, context)
+    finally:
+        elapsed = time.perf_counter() - start
+        request_context = current_request()
+        if request_context is not None:
+            request_context.db_queries += 1
+            request_context.db_time += elapsed
+
+
+def _sample_content_cache():
+    from .cache import content_cache
+
+    stats = content_cache.stats()
+    CONTENT_CACHE_HITS.set(stats['hits'])
+    CONTENT_CACHE_MISSES.set(stats['misses'])
+    CONTENT_CACHE_EVICTIONS.set(stats['evictions'])
+    CONTENT_CACHE_ENTRIES.set(stats['entries'])
+    CONTENT_CACHE_BYTES.set(stats['current_bytes'])
+
+
+def _bandwidth_lines():
+    from . import bandwidth
+
+    # Shaping state is shared by every worker on the host, so any worker reports all of it
+    if not os.path.exists(bandwidth.state_path()):
+        return []
+    rows = bandwidth.shared_buckets().snapshot()
+    totals = {direction: [0, 0, 0.0] for direction in bandwidth.DIRECTIONS}
+    for _, direction, transfers, _, rate in rows:
+        totals[direction][0] += transfers > 0
+        totals[direction][1] += transfers
+        totals[direction][2] += rate
+    lines = []
+    for name, help_text, column in [
+        ('filevault_shaped_active_users', 'Users with shaped transfers in progress', 0),
+        ('filevault_shaped_active_transfers', 'Shaped transfers in progress', 1),
+        ('filevault_shaped_throughput_bytes_per_second', 'Current throughput of all shaped transfers', 2),
+    ]:
+        lines += [f'# HELP {name} {help_text}', f'# TYPE {name} gauge']
+        lines += [f'{name}{_format_labels(("direction",), (direction,))} {_format_value(round(values[column], 1))}'
+                  for direction, values in totals.items()]
+    if not get_setting('PER_USER_LABELS'):
+        return lines
+
+    # /metrics is unauthenticated, so user ids are only labelled when explicitly enabled
+    name = 'filevault_user_throughput_bytes_per_second'
+    lines += [f'# HELP {name} Current throughput of shaped transfers per user', f'# TYPE {name} gauge']
+    lines += [f'{name}{_format_labels(("user_id", "direction"), (user_id, direction))} {_format_value(round(rate, 1))}'
+              for user_id, direction, _, _, rate in rows]
+    name = 'filevault_user_bandwidth_share_bytes_per_second'
+    lines += [f'# HELP {name} Byte rate each user is currently allowed (0 for unlimited)', f'# TYPE {name} gauge']
+    lines += [f'{name}{_format_labels(("user_id", "direction"), (user_id, direction))} {_format_value(round(share, 1))}'
+              for user_id, direction, _, share, _ in rows]
+    name = 'filevault_user_active_transfers'
+    lines += [f'# HELP {name} Shaped transfers in progress per user', f'# TYPE {name} gauge']
+    lines += [f'{name}{_format_labels(("user_id", "direction"), (user_id, direction))} {transfers}'
+              for user_id, direction, transfers, _, _ in rows]
+    return lines
+
+
+registry.register_sampler(_sample_content_cache)
+registry.register_collector(_bandwidth_lines)
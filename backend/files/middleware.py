@@ -0,0 +1,46 @@
+import logging
+import time
+
+from django.db import connection
+
+from . import metrics
+
+logger = logging.getLogger('files.metrics')
+
+
+class RequestMetricsMiddleware:
+    """
+    Records per-view latency, per-request DB query counts and span totals,
+    and logs requests slower than METRICS['SLOW_REQUEST_MS'].
+    """
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        if not metrics.enabled():
+            return self.get_response(request)
+
+        context = metrics.begin_request()
+        start = time.perf_counter()
+        try:
+            with connection.execute_wrapper(metrics.count_query):
+                response = self.get_response(request)
+        finally:
+            metrics.end_request()
+        elapsed = time.perf_counter() - start
+
+        match = getattr(request, 'resolver_match', None)
+        view = match.view_name if match else 'unmatched'
+        metrics.REQUEST_LATENCY.observe(elapsed, (view, request.method, str(response.status_code)))
+        metrics.REQUEST_DB_QUERIES.observe(context.db_queries, (view,))
+        if context.db_queries:
+            metrics.SPAN_LATENCY.observe(context.db_time, ('db',))
+
+        if elapsed * 1000 >= metrics.get_setting('SLOW_REQUEST_MS'):
+            spans = ', '.join(f'{name}={seconds * 1000:.1f}ms' for name, seconds in sorted(context.spans.items()))
+            logger.warning(
+                'Slow request: %s %s -> %s in %.1fms (%d queries, db=%.1fms%s)',
+                request.method, request.path, response.status_code, elapsed * 1000,
+                context.db_queries, context.db_time * 1000, f', {spans}' if spans else '',
+            )
+        return response
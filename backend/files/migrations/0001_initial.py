@@ -0,0 +1,49 @@
+# Generated by Django 4.2.30 on 2026-10-19 11:17
+
+from django.conf import settings
+from django.db import migrations, models
+import django.db.models.deletion
+import files.models
+import uuid
+
+
+class Migration(migrations.Migration):
+
+    initial = True
+
+    dependencies = [
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='UserProfile',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('storage_limit_mb', models.IntegerField(default=10)),
+                ('api_calls_per_second', models.IntegerField(default=2)),
+                ('current_storage_used', models.BigIntegerField(default=0)),
+                ('file_types', models.JSONField(default=list)),
+                ('user', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, related_name='profile', to=settings.AUTH_USER_MODEL)),
+            ],
+        ),
+        migrations.CreateModel(
+            name='File',
+            fields=[
+                ('id', models.UUIDField(default=uuid.uuid4, editable=False, primary_key=True, serialize=False)),
+                ('file', models.FileField(upload_to=files.models.file_upload_path)),
+                ('original_filename', models.CharField(db_index=True, max_length=255)),
+                ('file_type', models.CharField(max_length=100)),
+                ('size', models.BigIntegerField()),
+                ('uploaded_at', models.DateTimeField(auto_now_add=True)),
+                ('file_hash', models.CharField(blank=True, max_length=64, null=True)),
+                ('is_duplicate', models.BooleanField(default=False)),
+                ('original_file_ref', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.CASCADE, related_name='duplicate_files', to='files.file')),
+                ('owner', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to=settings.AUTH_USER_MODEL)),
+            ],
+            options={
+                'ordering': ['-uploaded_at'],
+                'indexes': [models.Index(fields=['owner', 'original_filename'], name='files_file_owner_i_a32981_idx')],
+            },
+        ),
+    ]
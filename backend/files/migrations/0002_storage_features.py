@@ -0,0 +1,172 @@
+# Generated by Django 4.2.30 on 2026-10-19 11:18
+
+from django.conf import settings
+from django.db import migrations, models
+from django.db.models import Count, Q, Sum
+from django.db.models.functions import TruncDate
+import django.db.models.deletion
+
+
+def backfill_counters(apps, schema_editor):
+    """
+    Databases created before these features already hold files. Give them
+    the per-type counters and daily rollups that uploads would have kept.
+    """
+    File = apps.get_model('files', 'File')
+    UserFileType = apps.get_model('files', 'UserFileType')
+    DailyStorageRollup = apps.get_model('files', 'DailyStorageRollup')
+    DailyFileTypeRollup = apps.get_model('files', 'DailyFileTypeRollup')
+
+    type_counts = (
+        File.objects.order_by()
+        .values('owner_id', 'file_type')
+        .annotate(file_count=Count('id'), total_bytes=Sum('size'))
+    )
+    UserFileType.objects.bulk_create([
+        UserFileType(user_id=row['owner_id'], file_type=row['file_type'],
+                     file_count=row['file_count'], total_bytes=row['total_bytes'])
+        for row in type_counts
+    ], batch_size=1000)
+
+    rows = (
+        File.objects.order_by()
+        .annotate(day=TruncDate('uploaded_at'))
+        .values('day', 'file_type')
+        .annotate(files=Count('id'), logical_bytes=Sum('size'), physical_bytes=Sum('size', filter=Q(is_duplicate=False)))
+    )
+    by_day = {}
+    type_rollups = []
+    for row in rows:
+        totals = by_day.setdefault(row['day'], DailyStorageRollup(date=row['day']))
+        totals.files_added += row['files']
+        totals.bytes_added += row['logical_bytes']
+        totals.physical_bytes_added += row['physical_bytes'] or 0
+        type_rollups.append(DailyFileTypeRollup(
+            date=row['day'], file_type=row['file_type'], files_added=row['files'], bytes_added=row['logical_bytes'],
+        ))
+    DailyStorageRollup.objects.bulk_create(by_day.values(), batch_size=1000)
+    DailyFileTypeRollup.objects.bulk_create(type_rollups, batch_size=1000)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+        ('files', '0001_initial'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='DailyFileTypeRollup',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('date', models.DateField()),
+                ('file_type', models.CharField(max_length=100)),
+                ('files_added', models.BigIntegerField(default=0)),
+                ('files_removed', models.BigIntegerField(default=0)),
+                ('bytes_added', models.BigIntegerField(default=0)),
+                ('bytes_removed', models.BigIntegerField(default=0)),
+            ],
+            options={
+                'ordering': ['-date', 'file_type'],
+            },
+        ),
+        migrations.CreateModel(
+            name='DailyStorageRollup',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('date', models.DateField(unique=True)),
+                ('files_added', models.BigIntegerField(default=0)),
+                ('files_removed', models.BigIntegerField(default=0)),
+                ('bytes_added', models.BigIntegerField(default=0)),
+                ('bytes_removed', models.BigIntegerField(default=0)),
+                ('physical_bytes_added', models.BigIntegerField(default=0)),
+                ('physical_bytes_removed', models.BigIntegerField(default=0)),
+            ],
+            options={
+                'ordering': ['-date'],
+            },
+        ),
+        migrations.CreateModel(
+            name='JournalCheckpoint',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('journal_id', models.CharField(max_length=32, unique=True)),
+                ('applied_id', models.BigIntegerField(default=0)),
+                ('updated_at', models.DateTimeField(auto_now=True)),
+            ],
+        ),
+        migrations.RemoveField(
+            model_name='userprofile',
+            name='file_types',
+        ),
+        migrations.AddField(
+            model_name='file',
+            name='access_count',
+            field=models.PositiveIntegerField(default=0),
+        ),
+        migrations.AddField(
+            model_name='file',
+            name='last_accessed_at',
+            field=models.DateTimeField(blank=True, null=True),
+        ),
+        migrations.AddField(
+            model_name='file',
+            name='storage_tier',
+            field=models.CharField(choices=[('hot', 'Hot'), ('cold', 'Cold'), ('archive', 'Archive')], db_index=True, default='hot', max_length=10),
+        ),
+        migrations.AddField(
+            model_name='file',
+            name='version',
+            field=models.PositiveIntegerField(default=1),
+        ),
+        migrations.AlterField(
+            model_name='userprofile',
+            name='current_storage_used',
+            field=models.BigIntegerField(db_index=True, default=0),
+        ),
+        migrations.CreateModel(
+            name='UserFileType',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('file_type', models.CharField(max_length=100)),
+                ('file_count', models.BigIntegerField(default=0)),
+                ('total_bytes', models.BigIntegerField(default=0)),
+                ('user', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='file_type_counts', to=settings.AUTH_USER_MODEL)),
+            ],
+            options={
+                'ordering': ['file_type'],
+            },
+        ),
+        migrations.CreateModel(
+            name='FileVersion',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('number', models.PositiveIntegerField()),
+                ('original_filename', models.CharField(max_length=255)),
+                ('file_type', models.CharField(max_length=100)),
+                ('size', models.BigIntegerField()),
+                ('file_hash', models.CharField(blank=True, max_length=64, null=True)),
+                ('is_keyframe', models.BooleanField(default=False)),
+                ('stored_size', models.BigIntegerField()),
+                ('superseded_at', models.DateTimeField(auto_now_add=True)),
+                ('file', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='versions', to='files.file')),
+            ],
+            options={
+                'ordering': ['-number'],
+            },
+        ),
+        migrations.AddConstraint(
+            model_name='dailyfiletyperollup',
+            constraint=models.UniqueConstraint(fields=('date', 'file_type'), name='unique_daily_file_type'),
+        ),
+        migrations.AddConstraint(
+            model_name='userfiletype',
+            constraint=models.UniqueConstraint(fields=('user', 'file_type'), name='unique_user_file_type'),
+        ),
+        migrations.AddConstraint(
+            model_name='fileversion',
+            constraint=models.UniqueConstraint(fields=('file', 'number'), name='unique_file_version'),
+        ),
+        migrations.RunPython(backfill_counters, migrations.RunPython.noop),
+    ]
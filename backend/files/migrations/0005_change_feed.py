@@ -0,0 +1,35 @@
+# Generated by Django 4.2.30 on 2026-10-19 10:51
+
+from django.conf import settings
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+        ('files', '0004_folders'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='userprofile',
+            name='changes_horizon',
+            field=models.BigIntegerField(default=0),
+        ),
+        migrations.CreateModel(
+            name='FileChange',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('file_id', models.UUIDField()),
+                ('action', models.CharField(choices=[('created', 'created'), ('updated', 'updated'), ('moved', 'moved'), ('trashed', 'trashed'), ('restored', 'restored'), ('deleted', 'deleted')], max_length=10)),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+                ('owner', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='file_changes', to=settings.AUTH_USER_MODEL)),
+            ],
+            options={
+                'ordering': ['id'],
+                'indexes': [models.Index(fields=['owner', 'id'], name='files_filec_owner_i_b620f2_idx'), models.Index(fields=['file_id', 'id'], name='files_filec_file_id_6b3302_idx')],
+            },
+        ),
+    ]
@@ -0,0 +1,23 @@
+# Generated by Django 4.2.30 on 2026-10-19 10:58
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('files', '0005_change_feed'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='userprofile',
+            name='download_bytes_per_second',
+            field=models.BigIntegerField(default=0),
+        ),
+        migrations.AddField(
+            model_name='userprofile',
+            name='upload_bytes_per_second',
+            field=models.BigIntegerField(default=0),
+        ),
+    ]
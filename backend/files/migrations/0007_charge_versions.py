@@ -0,0 +1,33 @@
+from django.db import migrations
+from django.db.models import F, Sum
+
+
+def _charge_versions(apps, sign):
+    FileVersion = apps.get_model('files', 'FileVersion')
+    UserProfile = apps.get_model('files', 'UserProfile')
+
+    rows = FileVersion.objects.order_by().values('file__owner_id').annotate(stored=Sum('stored_size'))
+    for row in rows:
+        UserProfile.objects.filter(user_id=row['file__owner_id']).update(
+            current_storage_used=F('current_storage_used') + sign * row['stored']
+        )
+
+
+def charge_versions(apps, schema_editor):
+    """Versions stored before they counted towards the quota are charged to their owners now."""
+    _charge_versions(apps, 1)
+
+
+def release_versions(apps, schema_editor):
+    _charge_versions(apps, -1)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('files', '0006_bandwidth_limits'),
+    ]
+
+    operations = [
+        migrations.RunPython(charge_versions, release_versions),
+    ]
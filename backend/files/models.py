@@ -1,15 +1,18 @@
 import os
-import hashlib
-from django.db import models
-from django.db.models.signals import post_delete
+from django.db import models, transaction
+from django.db.models.signals import post_delete, post_save
 from django.dispatch import receiver
 from django.contrib.auth.models import User
 import uuid
 
+from . import analytics, changes, counters, folders, hashing, inspection, previews, tiering, versioning
+from .cache import content_cache
+
 
 def file_upload_path(instance, filename):
     """Generate file path for new file upload"""
-    ext = filename.split('.')[-1]
+    # The extension follows the stored (inspected) type, not the client's filename
+    ext = inspection.extension_for(instance.file_type)
     filename = f"{uuid.uuid4()}.{ext}"
     return os.path.join('uploads', filename)
 
@@ -18,13 +21,63 @@ class UserProfile(models.Model):
     user = models.OneToOneField(User, on_delete=models.CASCADE, related_name='profile')
     storage_limit_mb = models.IntegerField(default=10)  # Default 10 MB storage limit
     api_calls_per_second = models.IntegerField(default=2)  # Default 2 API calls per second
-    current_storage_used = models.BigIntegerField(default=0)  # Track current storage usage in bytes
-    file_types = models.JSONField(default=list)  # Store unique file types as metadata
+    # Byte-rate limits enforced while files stream in and out; 0 means unlimited (see files.bandwidth)
+    upload_bytes_per_second = models.BigIntegerField(default=0)
+    download_bytes_per_second = models.BigIntegerField(default=0)
+    current_storage_used = models.BigIntegerField(default=0, db_index=True)  # Track current storage usage in bytes; indexed for top-user reports
+    changes_horizon = models.BigIntegerField(default=0)  # Change feed cursors below this were compacted away
 
     def __str__(self):
         return f"{self.user.username}'s Profile"
 
 
+class UserFileType(models.Model):
+    """
+    Per-user count and bytes of files of one MIME type. Rows are only ever
+    changed with atomic increments, so uploads don't rewrite the profile.
+    """
+    user = models.ForeignKey(User, on_delete=models.CASCADE, related_name='file_type_counts')
+    file_type = models.CharField(max_length=100)
+    file_count = models.BigIntegerField(default=0)
+    total_bytes = models.BigIntegerField(default=0)
+
+    class Meta:
+        ordering = ['file_type']
+        constraints = [
+            models.UniqueConstraint(fields=['user', 'file_type'], name='unique_user_file_type'),
+        ]
+
+    def __str__(self):
+        return f"{self.user.username}: {self.file_type} ({self.file_count})"
+
+
+class Folder(models.Model):
+    """
+    A folder in a user's file tree. path holds the ids from the top level
+    down to this folder (see files.folders). file_count and total_bytes
+    cover the whole subtree and are maintained incrementally.
+    """
+    owner = models.ForeignKey(User, on_delete=models.CASCADE, related_name='folders')
+    parent = models.ForeignKey('self', on_delete=models.CASCADE, null=True, blank=True, related_name='children')
+    name = models.CharField(max_length=255)
+    path = models.CharField(max_length=1024, db_index=True)
+    depth = models.PositiveIntegerField(default=0)
+    file_count = models.BigIntegerField(default=0)
+    total_bytes = models.BigIntegerField(default=0)
+    created_at = models.DateTimeField(auto_now_add=True)
+
+    class Meta:
+        ordering = ['name']
+        constraints = [
+            # Also the index children are listed from, in name order
+            models.UniqueConstraint(fields=['owner', 'parent', 'name'], name='unique_folder_name'),
+            models.UniqueConstraint(fields=['owner', 'name'], condition=models.Q(parent__isnull=True), name='unique_top_level_folder_name'),
+        ]
+
+    def __str__(self):
+        return self.name
+
+
 class File(models.Model):
     id = models.UUIDField(primary_key=True, default=uuid.uuid4, editable=False)
     file = models.FileField(upload_to=file_upload_path)
@@ -36,13 +89,26 @@ class File(models.Model):
     owner = models.ForeignKey(User, on_delete=models.CASCADE, db_index=True)  # Index for user filtering
     # Add fields to support duplicate file references
     is_duplicate = models.BooleanField(default=False)
-    original_file_ref = models.ForeignKey('self', on_delete=models.CASCADE, null=True, blank=True, related_name='duplicate_files')
+    # RESTRICT rather than CASCADE: the trash reaper hands a blob to a duplicate before purging its original
+    original_file_ref = models.ForeignKey('self', on_delete=models.RESTRICT, null=True, blank=True, related_name='duplicate_files')
+    # Access statistics and tier placement used by the tiering policy
+    storage_tier = models.CharField(max_length=10, choices=tiering.TIER_CHOICES, default=tiering.TIER_HOT, db_index=True)
+    last_accessed_at = models.DateTimeField(null=True, blank=True)
+    access_count = models.PositiveIntegerField(default=0)
+    # Number of the current content; older ones are kept as FileVersion rows
+    version = models.PositiveIntegerField(default=1)
+    # Soft delete: trashed files are hidden, and purged by the trash reaper once purge_after has passed
+    deleted_at = models.DateTimeField(null=True, blank=True)
+    purge_after = models.DateTimeField(null=True, blank=True, db_index=True)
+    # None for the top level. Trashed files in a deleted folder fall back to the top level
+    folder = models.ForeignKey(Folder, on_delete=models.SET_NULL, null=True, blank=True, related_name='files')
 
     class Meta:
         ordering = ['-uploaded_at']
         indexes = [
             # Composite index for user + filename searches
             models.Index(fields=['owner', 'original_filename']),  # For user + filename searches
+            models.Index(fields=['owner', 'folder', 'original_filename']),  # For folder listings
         ]
 
     def calculate_file_hash(self):
@@ -50,13 +116,16 @@ class File(models.Model):
         if not self.file:
             return None
 
-        sha256_hash = hashlib.sha256()
-        # Open the file and read it in chunks to handle large files efficiently
+        try:
+            path = self.file.path
+        except NotImplementedError:
+            path = None
+
+        # Local files are hashed via mmap; other storages fall back to chunked reads
+        if path and os.path.isfile(path):
+            return hashing.sha256_path(path)
         with self.file.open('rb') as f:
-            # Read the file in chunks to avoid memory issues with large files
-            for chunk in iter(lambda: f.read(4096), b""):
-                sha256_hash.update(chunk)
-        return sha256_hash.hexdigest()
+            return hashing.sha256_fileobj(f)
 
     def save(self, *args, **kwargs):
         # Calculate hash if it doesn't exist
@@ -68,9 +137,140 @@ class File(models.Model):
         return self.original_filename
 
 
+class FileVersion(models.Model):
+    """
+    A superseded content of a File. Stored either in full (a keyframe) or as
+    a delta against the next newer version, so rebuilding one walks up the
+    chain until a keyframe or the file's current content.
+    """
+    file = models.ForeignKey(File, on_delete=models.CASCADE, related_name='versions')
+    number = models.PositiveIntegerField()
+    original_filename = models.CharField(max_length=255)
+    file_type = models.CharField(max_length=100)
+    size = models.BigIntegerField()  # Size of the rebuilt content
+    file_hash = models.CharField(max_length=64, null=True, blank=True)
+    is_keyframe = models.BooleanField(default=False)
+    stored_size = models.BigIntegerField()  # Bytes actually on disk
+    superseded_at = models.DateTimeField(auto_now_add=True)
+
+    class Meta:
+        ordering = ['-number']
+        constraints = [
+            models.UniqueConstraint(fields=['file', 'number'], name='unique_file_version'),
+        ]
+
+    def __str__(self):
+        return f"{self.original_filename} (v{self.number})"
+
+
+class FileChange(models.Model):
+    """
+    One event in a user's change feed (see files.changes). The id is the
+    cursor clients sync from. file_id isn't a foreign key, since the
+    'deleted' event outlives the file.
+    """
+    owner = models.ForeignKey(User, on_delete=models.CASCADE, related_name='file_changes')
+    file_id = models.UUIDField()
+    action = models.CharField(max_length=10, choices=changes.ACTION_CHOICES)
+    created_at = models.DateTimeField(auto_now_add=True)
+
+    class Meta:
+        ordering = ['id']
+        indexes = [
+            models.Index(fields=['owner', 'id']),  # Reading a feed from a cursor
+            models.Index(fields=['file_id', 'id']),  # Finding superseded events when compacting
+        ]
+
+    def __str__(self):
+        return f"{self.action} {self.file_id}"
+
+
+class DailyStorageRollup(models.Model):
+    """
+    Fleet-wide upload and deletion totals for one day, maintained
+    incrementally so analytics never scan the File table. Physical bytes
+    exclude duplicates; the gap to logical bytes is the dedup saving.
+    """
+    date = models.DateField(unique=True)
+    files_added = models.BigIntegerField(default=0)
+    files_removed = models.BigIntegerField(default=0)
+    bytes_added = models.BigIntegerField(default=0)
+    bytes_removed = models.BigIntegerField(default=0)
+    physical_bytes_added = models.BigIntegerField(default=0)
+    physical_bytes_removed = models.BigIntegerField(default=0)
+
+    class Meta:
+        ordering = ['-date']
+
+    def __str__(self):
+        return f"Storage rollup {self.date}"
+
+
+class DailyFileTypeRollup(models.Model):
+    """Uploads and deletions per MIME type for one day."""
+    date = models.DateField()
+    file_type = models.CharField(max_length=100)
+    files_added = models.BigIntegerField(default=0)
+    files_removed = models.BigIntegerField(default=0)
+    bytes_added = models.BigIntegerField(default=0)
+    bytes_removed = models.BigIntegerField(default=0)
+
+    class Meta:
+        ordering = ['-date', 'file_type']
+        constraints = [
+            models.UniqueConstraint(fields=['date', 'file_type'], name='unique_daily_file_type'),
+        ]
+
+    def __str__(self):
+        return f"{self.file_type} rollup {self.date}"
+
+
+class JournalCheckpoint(models.Model):
+    """
+    Last write-behind journal entry applied to this database, per journal
+    file. It is written in the same transaction as the deltas, so a replay
+    after a crash skips what already landed.
+    """
+    journal_id = models.CharField(max_length=32, unique=True)
+    applied_id = models.BigIntegerField(default=0)
+    updated_at = models.DateTimeField(auto_now=True)
+
+    def __str__(self):
+        return f"Journal {self.journal_id} @ {self.applied_id}"
+
+
+# Keep the per-user file type counters, folder totals, change feed and daily analytics rollups in step with uploads and deletions
+@receiver(post_save, sender=File)
+def count_file_upload(sender, instance, created, **kwargs):
+    if created:
+        counters.count_file_type(instance.owner_id, instance.file_type, 1, instance.size)
+        folders.adjust_totals(instance.folder_id, 1, instance.size)
+        changes.record(instance.owner_id, instance.pk, changes.CREATED)
+        analytics.record_added(instance.file_type, 1, instance.size, 0 if instance.is_duplicate else instance.size)
+
+
+@receiver(post_delete, sender=File)
+def count_file_deletion(sender, instance, **kwargs):
+    counters.count_file_type(instance.owner_id, instance.file_type, -1, -instance.size)
+    folders.adjust_totals(instance.folder_id, -1, -instance.size)
+    analytics.record_removed(instance.file_type, 1, instance.size, 0 if instance.is_duplicate else instance.size)
+
+
+def _remove_blob(instance, shared):
+    tiering.delete_blob(instance)
+    content_cache.evict(instance.file_hash)
+    if not shared:
+        previews.purge(instance.file_hash)
+
+
 # Signal to delete the file from filesystem when the model instance is deleted
 @receiver(post_delete, sender=File)
 def delete_file_from_storage(sender, instance, **kwargs):
+    # Files are only removed once the deletion commits, so a rolled back purge keeps its content.
+    # Older versions belong to this record alone
+    file_id = instance.pk  # Cleared by delete() before the callback runs
+    transaction.on_commit(lambda: versioning.delete_versions(file_id))
+
     # Only delete the physical file if no other records reference it
     if instance.file:
         # If this is a duplicate file record
@@ -83,9 +283,10 @@ def delete_file_from_storage(sender, instance, **kwargs):
             # Check if there are any duplicate records that reference this original file
             duplicate_count = File.objects.filter(original_file_ref=instance).count()
             if duplicate_count == 0:
+                # Derived artifacts are keyed by hash and may be shared with another user's copy
+                shared = File.objects.filter(file_hash=instance.file_hash, is_duplicate=False).exclude(pk=instance.pk).exists()
                 # No duplicates reference this original file, safe to delete the physical file
-                if os.path.isfile(instance.file.path):
-                    os.remove(instance.file.path)
+                transaction.on_commit(lambda: _remove_blob(instance, shared))
 
 
 # Signal to create user profile when a user is created
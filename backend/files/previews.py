@@ -0,0 +1,230 @@
+import fcntl
+import json
+import logging
+import os
+import shutil
+import threading
+from concurrent.futures import Future, ThreadPoolExecutor
+
+from django.conf import settings
+
+from . import tiering
+
+logger = logging.getLogger(__name__)
+
+DEFAULTS = {
+    'ROOT': None,  # Defaults to MEDIA_ROOT/derived
+    'THUMBNAIL_SIZES': [64, 256, 1024],
+    'TEXT_LINES': 50,
+    'TEXT_MAX_BYTES': 64 * 1024,
+    'EAGER': True,
+    'WORKERS': 2,
+    'CACHE_MAX_AGE': 60,
+}
+
+KIND_THUMBNAIL = 'thumbnail'
+KIND_TEXT = 'text'
+KIND_METADATA = 'metadata'
+KINDS = [KIND_THUMBNAIL, KIND_TEXT, KIND_METADATA]
+
+
+class PreviewUnavailable(Exception):
+    pass
+
+
+def get_setting(name):
+    """Read a preview option from settings.PREVIEWS, falling back to defaults."""
+    return getattr(settings, 'PREVIEWS', {}).get(name, DEFAULTS[name])
+
+
+def artifact_dir(file_hash):
+    root = get_setting('ROOT') or os.path.join(settings.MEDIA_ROOT, 'derived')
+    return os.path.join(root, file_hash[:2], file_hash)
+
+
+def artifact_name(kind, size=None):
+    if kind == KIND_THUMBNAIL:
+        return f'thumb-{size}.jpg'
+    if kind == KIND_TEXT:
+        return 'text.txt'
+    return 'metadata.json'
+
+
+def content_type_for(kind):
+    return {
+        KIND_THUMBNAIL: 'image/jpeg',
+        KIND_TEXT: 'text/plain; charset=utf-8',
+        KIND_METADATA: 'application/json',
+    }[kind]
+
+
+def default_kind(file_type):
+    if file_type.startswith('image/'):
+        return KIND_THUMBNAIL
+    if file_type.startswith('text/'):
+        return KIND_TEXT
+    return KIND_METADATA
+
+
+def _load_pillow():
+    # Pillow is optional; without it image thumbnails are simply unavailable
+    try:
+        from PIL import Image
+    except ImportError:
+        return None
+    return Image
+
+
+def _write_atomically(path, write):
+    tmp = f'{path}.{os.getpid()}.{threading.get_ident()}.partial'
+    try:
+        with open(tmp, 'wb') as f:
+            write(f)
+        os.replace(tmp, path)
+    finally:
+        if os.path.exists(tmp):
+            os.remove(tmp)
+
+
+def _generate_thumbnail(blob, size, path):
+    Image = _load_pillow()
+    if Image is None or not blob.file_type.startswith('image/'):
+        raise PreviewUnavailable('No thumbnail available for this file')
+
+    with tiering.open_blob(blob) as f:
+        try:
+            image = Image.open(f)
+            # draft() lets JPEG decode at a reduced scale instead of full resolution
+            image.draft('RGB', (size, size))
+            image.thumbnail((size, size))
+            image = image.convert('RGB')
+        except (OSError, ValueError, Image.DecompressionBombError) as exc:
+            raise PreviewUnavailable(f'Could not decode image: {exc}')
+    _write_atomically(path, lambda out: image.save(out, 'JPEG', quality=85, optimize=True))
+
+
+def _generate_text(blob, path):
+    if not blob.file_type.startswith('text/') and blob.file_type not in ('application/json', 'application/xml'):
+        raise PreviewUnavailable('No text preview available for this file')
+
+    lines = []
+    remaining = get_setting('TEXT_MAX_BYTES')
+    with tiering.open_blob(blob) as f:
+        for _ in range(get_setting('TEXT_LINES')):
+            line = f.readline(remaining)
+            if not line:
+                break
+            lines.append(line)
+            remaining -= len(line)
+            if remaining <= 0:
+                break
+    text = b''.join(lines).decode('utf-8', errors='replace')
+    _write_atomically(path, lambda out: out.write(text.encode('utf-8')))
+
+
+def _generate_metadata(blob, path):
+    metadata = {
+        'file_hash': blob.file_hash,
+        'size': blob.size,
+        'file_type': blob.file_type,
+    }
+    Image = _load_pillow()
+    if Image is not None and blob.file_type.startswith('image/'):
+        with tiering.open_blob(blob) as f:
+            try:
+                # Only the header is parsed here, the pixels aren't decoded
+                image = Image.open(f)
+                metadata['image'] = {'width': image.width, 'height': image.height, 'format': image.format}
+            except (OSError, ValueError, Image.DecompressionBombError):
+                pass
+    _write_atomically(path, lambda out: out.write(json.dumps(metadata).encode('utf-8')))
+
+
+def _generate(blob, kind, size, path):
+    if kind == KIND_THUMBNAIL:
+        _generate_thumbnail(blob, size, path)
+    elif kind == KIND_TEXT:
+        _generate_text(blob, path)
+    else:
+        _generate_metadata(blob, path)
+
+
+# Generations in progress in this process, so concurrent requests share one
+_inflight = {}
+_inflight_lock = threading.Lock()
+
+
+def get_artifact(blob, kind, size=None):
+    """
+    Path of a derived artifact for a blob-owning File, generating it on first use.
+
+    Concurrent requests for the same artifact wait on a single generation:
+    threads in this process share a Future, and other worker processes
+    serialize on a lock file and find the finished artifact.
+    """
+    if kind == KIND_THUMBNAIL and size not in get_setting('THUMBNAIL_SIZES'):
+        raise PreviewUnavailable(f"Thumbnail size must be one of {get_setting('THUMBNAIL_SIZES')}")
+
+    directory = artifact_dir(blob.file_hash)
+    name = artifact_name(kind, size)
+    path = os.path.join(directory, name)
+    if os.path.exists(path):
+        return path
+
+    key = (blob.file_hash, name)
+    with _inflight_lock:
+        future = _inflight.get(key)
+        owner = future is None
+        if owner:
+            future = _inflight[key] = Future()
+    if not owner:
+        return future.result()
+
+    try:
+        os.makedirs(directory, exist_ok=True)
+        with open(os.path.join(directory, f'.{name}.lock'), 'w') as lock_file:
+            fcntl.flock(lock_file, fcntl.LOCK_EX)
+            if not os.path.exists(path):
+                _generate(blob, kind, size, path)
+        future.set_result(path)
+    except BaseException as exc:
+        future.set_exception(exc)
+        raise
+    finally:
+        with _inflight_lock:
+            _inflight.pop(key, None)
+    return path
+
+
+def purge(file_hash):
+    """Remove every artifact derived from a hash."""
+    if file_hash:
+        shutil.rmtree(artifact_dir(file_hash), ignore_errors=True)
+
+
+_executor = None
+_executor_lock = threading.Lock()
+
+
+def _generate_all(blob):
+    kind = default_kind(blob.file_type)
+    sizes = get_setting('THUMBNAIL_SIZES') if kind == KIND_THUMBNAIL else [None]
+    try:
+        for size in sizes:
+            get_artifact(blob, kind, size)
+        get_artifact(blob, KIND_METADATA)
+    except PreviewUnavailable:
+        pass
+    except Exception:
+        logger.exception('Preview generation failed for %s', blob.file_hash)
+
+
+def schedule(blob):
+    """Generate the default artifacts for a new blob in the background, off the request path."""
+    global _executor
+    if not get_setting('EAGER') or default_kind(blob.file_type) == KIND_METADATA:
+        return
+    with _executor_lock:
+        if _executor is None:
+            _executor = ThreadPoolExecutor(max_workers=get_setting('WORKERS'), thread_name_prefix='previews')
+    _executor.submit(_generate_all, blob)
@@ -1,5 +1,5 @@
 from rest_framework import serializers
-from .models import File
+from .models import File, FileVersion, Folder
 
 class FileSerializer(serializers.ModelSerializer):
     user_id = serializers.SerializerMethodField()
@@ -9,8 +9,10 @@ class FileSerializer(serializers.ModelSerializer):
 
     class Meta:
         model = File
-        fields = ['id', 'file', 'original_filename', 'file_type', 'size', 'uploaded_at', 'file_hash', 'user_id', 'reference_count', 'is_reference', 'original_file']
-        read_only_fields = ['id', 'uploaded_at', 'file_hash']
+        fields = ['id', 'file', 'original_filename', 'file_type', 'size', 'uploaded_at', 'file_hash', 'user_id', 'reference_count', 'is_reference', 'original_file', 'version', 'deleted_at', 'purge_after', 'folder']
+        # Content, and the type and size derived from it, only change through new uploads or versions, which
+        # keep the per-type counters, folder totals, quota and rollups in step; updates may rename a file
+        read_only_fields = ['id', 'file', 'file_type', 'size', 'uploaded_at', 'file_hash', 'version', 'deleted_at', 'purge_after', 'folder']
 
     def get_user_id(self, obj):
         return obj.owner.id
@@ -40,4 +42,18 @@ class FileSerializer(serializers.ModelSerializer):
             # Use the original file's path directly
             data['file'] = instance.original_file_ref.file.url if instance.original_file_ref.file else None
 
-        return data
\ No newline at end of file
+        return data
+
+
+class FileVersionSerializer(serializers.ModelSerializer):
+    class Meta:
+        model = FileVersion
+        fields = ['number', 'original_filename', 'file_type', 'size', 'file_hash', 'is_keyframe', 'stored_size', 'superseded_at']
+        read_only_fields = fields
+
+
+class FolderSerializer(serializers.ModelSerializer):
+    class Meta:
+        model = Folder
+        fields = ['id', 'name', 'parent', 'path', 'depth', 'file_count', 'total_bytes', 'created_at']
+        read_only_fields = fields
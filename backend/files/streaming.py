@@ -0,0 +1,120 @@
+import mmap
+import os
+import re
+
+from django.http import FileResponse, HttpResponse
+
+# Block size used when the server can't sendfile and the response is iterated
+STREAM_BLOCK_SIZE = 1024 * 1024
+
+RANGE_RE = re.compile(r'^bytes=(\d*)-(\d*)$')
+
+
+class RangeNotSatisfiable(Exception):
+    pass
+
+
+def parse_range(header, size):
+    """
+    Parse a single-range `Range: bytes=a-b` header into an inclusive (start, end).
+
+    Returns None when the header is absent or not something we serve partially
+    (multiple ranges, other units), in which case the whole file is sent.
+    """
+    if not header:
+        return None
+    match = RANGE_RE.match(header.strip())
+    if not match:
+        return None
+
+    first, last = match.groups()
+    if not first and not last:
+        return None
+    if not first:
+        # Suffix range: the last N bytes
+        length = int(last)
+        if length == 0 or size == 0:
+            raise RangeNotSatisfiable()
+        return max(size - length, 0), size - 1
+
+    start = int(first)
+    end = int(last) if last else size - 1
+    if start >= size or end < start:
+        raise RangeNotSatisfiable()
+    return start, min(end, size - 1)
+
+
+class MmapRangeFile:
+    """
+    File-like view of [start, end] of a local file.
+
+    Under WSGI servers with sendfile support (gunicorn), wsgi.file_wrapper uses
+    fileno() plus the Content-Length to sendfile the range straight from the
+    page cache. Otherwise read() hands out memoryview slices of an mmap, so the
+    bytes are never copied through a userspace read buffer.
+    """
+    def __init__(self, path, start, end):
+        self._file = open(path, 'rb')
+        self._mmap = mmap.mmap(self._file.fileno(), 0, access=mmap.ACCESS_READ)
+        self._view = memoryview(self._mmap)
+        self._pos = start
+        self._end = end + 1
+        # Position the descriptor at the start of the range for sendfile
+        os.lseek(self._file.fileno(), start, os.SEEK_SET)
+
+    def fileno(self):
+        return self._file.fileno()
+
+    def read(self, size=-1):
+        if size is None or size < 0:
+            size = self._end - self._pos
+        stop = min(self._pos + size, self._end)
+        chunk = self._view[self._pos:stop]
+        self._pos = stop
+        return chunk
+
+    def close(self):
+        self._view.release()
+        try:
+            self._mmap.close()
+        except BufferError:
+            # A consumer still holds a slice; the mapping is freed once it's dropped
+            pass
+        self._file.close()
+
+
+def file_response(path, filename, content_type, range_header=None):
+    """
+    Build a download response for a local blob, honouring single Range requests.
+    """
+    size = os.path.getsize(path)
+    try:
+        byte_range = parse_range(range_header, size)
+    except RangeNotSatisfiable:
+        response = HttpResponse(status=416)
+        response['Content-Range'] = f'bytes */{size}'
+        return response
+
+    if byte_range is None:
+        # A real file object lets wsgi.file_wrapper use os.sendfile
+        response = FileResponse(
+            open(path, 'rb'),
+            as_attachment=True,
+            filename=filename,
+            content_type=content_type,
+        )
+    else:
+        start, end = byte_range
+        response = FileResponse(
+            MmapRangeFile(path, start, end),
+            status=206,
+            as_attachment=True,
+            filename=filename,
+            content_type=content_type,
+        )
+        response['Content-Length'] = str(end - start + 1)
+        response['Content-Range'] = f'bytes {start}-{end}/{size}'
+
+    response.block_size = STREAM_BLOCK_SIZE
+    response['Accept-Ranges'] = 'bytes'
+    return response
@@ -1,5 +1,6 @@
 from rest_framework.throttling import UserRateThrottle
 from .models import UserProfile
+from . import metrics
 
 
 class ConfigurableUserRateThrottle(UserRateThrottle):
@@ -29,4 +30,5 @@ class ConfigurableUserRateThrottle(UserRateThrottle):
                 pass
 
         # Call the parent method to perform the actual throttling check
-        return super().allow_request(request, view)
\ No newline at end of file
+        with metrics.span('throttle'):
+            return super().allow_request(request, view)
\ No newline at end of file
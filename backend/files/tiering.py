@@ -0,0 +1,307 @@
+import gzip
+import logging
+import os
+import shutil
+import tempfile
+import threading
+import time
+from collections import defaultdict
+from datetime import timedelta
+
+from django.conf import settings
+from django.core.files.storage import default_storage
+from django.db import transaction
+from django.db.models import F, Q
+from django.utils import timezone
+
+logger = logging.getLogger(__name__)
+
+# Storage tiers a physical blob can live in
+TIER_HOT = 'hot'          # MEDIA_ROOT, the fast volume
+TIER_COLD = 'cold'        # Plain copy on the slower/cheaper volume
+TIER_ARCHIVE = 'archive'  # Gzip-compressed copy on the slower/cheaper volume
+
+TIER_CHOICES = [
+    (TIER_HOT, 'Hot'),
+    (TIER_COLD, 'Cold'),
+    (TIER_ARCHIVE, 'Archive'),
+]
+
+DEFAULTS = {
+    'COLD_ROOT': os.path.join(settings.BASE_DIR, 'cold_storage'),
+    'COLD_TIER': TIER_ARCHIVE,
+    'COLD_AFTER_DAYS': 90,
+    'MAX_ACCESS_COUNT': 0,
+    'ACCESS_FLUSH_INTERVAL': 5.0,
+    'ACCESS_FLUSH_BATCH_SIZE': 500,
+}
+
+
+def get_setting(name):
+    """Read a tiering option from settings.STORAGE_TIERING, falling back to defaults."""
+    return getattr(settings, 'STORAGE_TIERING', {}).get(name, DEFAULTS[name])
+
+
+def blob_record(file_record):
+    """Return the record that owns the physical blob (the original for duplicates)."""
+    if file_record.is_duplicate and file_record.original_file_ref_id:
+        return file_record.original_file_ref
+    return file_record
+
+
+def rehome(file_record):
+    """
+    Hand file_record's blob to its oldest duplicate, preferring ones not in
+    the trash, which becomes the new original; the other duplicates are
+    repointed to it. Returns the heir.
+    """
+    from .models import File
+
+    duplicates = File.objects.filter(original_file_ref=file_record)
+    heir = duplicates.order_by(F('deleted_at').asc(nulls_first=True), 'uploaded_at').first()
+    File.objects.filter(pk=heir.pk).update(
+        file=file_record.file.name,
+        storage_tier=file_record.storage_tier,
+        is_duplicate=False,
+        original_file_ref=None,
+    )
+    duplicates.update(original_file_ref=heir)
+    return heir
+
+
+def cold_path(name, tier):
+    """Absolute path of a blob in the cold or archive tier."""
+    path = os.path.join(get_setting('COLD_ROOT'), name)
+    if tier == TIER_ARCHIVE:
+        path += '.gz'
+    return path
+
+
+def blob_path(file_record):
+    """Absolute path of the blob for the tier it currently lives in."""
+    if file_record.storage_tier == TIER_HOT:
+        return file_record.file.path
+    return cold_path(file_record.file.name, file_record.storage_tier)
+
+
+def open_blob(file_record):
+    """Open the blob for reading from whichever tier holds it, without promoting it."""
+    if file_record.storage_tier == TIER_ARCHIVE:
+        return gzip.open(blob_path(file_record), 'rb')
+    return open(blob_path(file_record), 'rb')
+
+
+def delete_blob(file_record):
+    """Remove the physical blob from whichever tier holds it."""
+    path = blob_path(file_record)
+    if os.path.isfile(path):
+        os.remove(path)
+
+
+# Moves of the same blob by threads of this process take turns; other processes may still race
+# one, which is harmless since each writes its own temporary file and renames it into place
+_move_locks = [threading.Lock() for _ in range(64)]
+
+
+def _move_blob(src, dst, compress=False, decompress=False):
+    """Move a blob between volumes, (de)compressing on the way, then drop the source."""
+    os.makedirs(os.path.dirname(dst), exist_ok=True)
+    with _move_locks[hash(dst) % len(_move_locks)]:
+        fd, tmp = tempfile.mkstemp(dir=os.path.dirname(dst), prefix=f'{os.path.basename(dst)}.', suffix='.partial')
+        try:
+            with os.fdopen(fd, 'wb') as fout:
+                if compress:
+                    with open(src, 'rb') as fin, gzip.GzipFile(fileobj=fout, mode='wb', compresslevel=6) as gz:
+                        shutil.copyfileobj(fin, gz, 1024 * 1024)
+                elif decompress:
+                    with gzip.open(src, 'rb') as fin:
+                        shutil.copyfileobj(fin, fout, 1024 * 1024)
+                else:
+                    with open(src, 'rb') as fin:
+                        shutil.copyfileobj(fin, fout, 1024 * 1024)
+            os.chmod(tmp, 0o644)
+            # Rename into place so a crash never leaves a truncated blob at dst
+            os.replace(tmp, dst)
+        except FileNotFoundError:
+            # Another mover got there first
+            if not os.path.isfile(src) and os.path.isfile(dst):
+                return
+            raise
+        finally:
+            if os.path.exists(tmp):
+                os.remove(tmp)
+        try:
+            os.remove(src)
+        except FileNotFoundError:
+            pass
+
+
+def demote(file_record, tier=None):
+    """Migrate a hot blob to the cold or archive tier."""
+    tier = tier or get_setting('COLD_TIER')
+    if file_record.storage_tier != TIER_HOT or not file_record.file:
+        return False
+
+    src = file_record.file.path
+    if not os.path.isfile(src):
+        return False
+    _move_blob(src, cold_path(file_record.file.name, tier), compress=(tier == TIER_ARCHIVE))
+
+    file_record.storage_tier = tier
+    type(file_record).objects.filter(pk=file_record.pk).update(storage_tier=tier)
+    return True
+
+
+def promote(file_record):
+    """Bring a cold or archived blob back onto the hot tier."""
+    if file_record.storage_tier == TIER_HOT or not file_record.file:
+        return False
+
+    src = cold_path(file_record.file.name, file_record.storage_tier)
+    dst = default_storage.path(file_record.file.name)
+    if os.path.isfile(src):
+        _move_blob(src, dst, decompress=(file_record.storage_tier == TIER_ARCHIVE))
+    elif not os.path.isfile(dst):
+        # The blob is in neither tier; leave the record pointing where it was
+        logger.warning('Cannot promote %s: no blob at %s', file_record.pk, src)
+        return False
+
+    file_record.storage_tier = TIER_HOT
+    type(file_record).objects.filter(pk=file_record.pk).update(storage_tier=TIER_HOT)
+    return True
+
+
+def cold_candidates(now=None):
+    """Queryset of blob-owning records that the policy wants moved off the hot tier."""
+    from .models import File
+
+    now = now or timezone.now()
+    cutoff = now - timedelta(days=get_setting('COLD_AFTER_DAYS'))
+    # A file is cold when it hasn't been read since the cutoff; never-read files
+    # are judged by their upload time instead
+    queryset = File.objects.filter(
+        storage_tier=TIER_HOT,
+        is_duplicate=False,
+    ).filter(
+        Q(last_accessed_at__lt=cutoff) | Q(last_accessed_at__isnull=True, uploaded_at__lt=cutoff)
+    ).exclude(file='')
+
+    max_hits = get_setting('MAX_ACCESS_COUNT')
+    if max_hits:
+        queryset = queryset.filter(access_count__lte=max_hits)
+    return queryset
+
+
+def apply_policy(limit=None, dry_run=False):
+    """Demote every cold candidate, returning (files moved, bytes moved)."""
+    moved_files = 0
+    moved_bytes = 0
+    candidates = cold_candidates().order_by('uploaded_at')
+    if limit:
+        candidates = candidates[:limit]
+
+    for file_record in candidates.iterator():
+        if dry_run or demote(file_record):
+            moved_files += 1
+            moved_bytes += file_record.size
+    return moved_files, moved_bytes
+
+
+def hot_tier_capacity():
+    """Capacity of the volume backing MEDIA_ROOT, in bytes."""
+    root = settings.MEDIA_ROOT
+    os.makedirs(root, exist_ok=True)
+    usage = shutil.disk_usage(root)
+    return {
+        'total': usage.total,
+        'used': usage.used,
+        'free': usage.free,
+    }
+
+
+class AccessRecorder:
+    """
+    Buffers download hits in memory and writes them out in batches.
+
+    Hits are grouped by count so a flush issues one UPDATE per distinct hit
+    count instead of one UPDATE per download. A background thread flushes
+    every ACCESS_FLUSH_INTERVAL seconds, so hits aren't stranded in a worker
+    that goes idle; gunicorn.conf.py flushes the rest when a worker exits.
+    """
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._hits = defaultdict(int)
+        self._last_flush = time.monotonic()
+        self._flusher = None
+        self._stopping = None
+        self._flusher_lock = threading.Lock()
+
+    def record(self, file_record):
+        """Count a read of file_record (and of the blob it points to)."""
+        with self._lock:
+            self._hits[file_record.pk] += 1
+            if file_record.is_duplicate and file_record.original_file_ref_id:
+                self._hits[file_record.original_file_ref_id] += 1
+            due = (
+                len(self._hits) >= get_setting('ACCESS_FLUSH_BATCH_SIZE')
+                or time.monotonic() - self._last_flush >= get_setting('ACCESS_FLUSH_INTERVAL')
+            )
+        if due:
+            self.flush()
+        self._ensure_flusher()
+
+    def _ensure_flusher(self):
+        # Threads don't survive a fork, so each worker starts its own on its first hit
+        if self._flusher is not None and self._flusher.is_alive():
+            return
+        with self._flusher_lock:
+            if self._flusher is None or not self._flusher.is_alive():
+                self._stopping = threading.Event()
+                self._flusher = threading.Thread(target=self._run, args=(self._stopping,), name='access-flusher', daemon=True)
+                self._flusher.start()
+
+    def stop(self):
+        """Stop the background flusher; buffered hits wait for the next flush. Tests call this in tearDown."""
+        with self._flusher_lock:
+            flusher, stopping = self._flusher, self._stopping
+            self._flusher = self._stopping = None
+        if flusher is not None:
+            stopping.set()
+            flusher.join()
+
+    def _run(self, stopping):
+        from django.db import connection
+
+        while not stopping.wait(get_setting('ACCESS_FLUSH_INTERVAL')):
+            try:
+                self.flush()
+            except Exception:
+                logger.exception('Access statistics flush failed')
+            finally:
+                connection.close()
+
+    def flush(self):
+        """Write buffered hits to the database."""
+        from .models import File
+
+        with self._lock:
+            hits, self._hits = self._hits, defaultdict(int)
+            self._last_flush = time.monotonic()
+        if not hits:
+            return 0
+
+        by_count = defaultdict(list)
+        for file_id, count in hits.items():
+            by_count[count].append(file_id)
+
+        now = timezone.now()
+        with transaction.atomic():
+            for count, file_ids in by_count.items():
+                File.objects.filter(pk__in=file_ids).update(
+                    access_count=F('access_count') + count,
+                    last_accessed_at=now,
+                )
+        return len(hits)
+
+
+access_recorder = AccessRecorder()
@@ -0,0 +1,124 @@
+"""
+Soft delete.
+
+Deleting a file moves it to the trash with one UPDATE of its own row, no
+matter how many records reference it. A trashed file is hidden from the
+API but can be restored. It keeps its blob and its storage charge until
+the reaper purges it, RETENTION_DAYS later or once the trash is emptied.
+
+References need no cascade. A duplicate keeps pointing at a trashed
+original, whose blob stays in place. When the reaper purges an original
+that still has duplicates, one of them inherits the blob first (see
+tiering.rehome), and the purged record is deleted as a plain reference.
+"""
+import logging
+from datetime import timedelta
+
+from django.conf import settings
+from django.db import transaction
+from django.utils import timezone
+
+from . import changes, counters, tiering, versioning
+
+logger = logging.getLogger(__name__)
+
+DEFAULTS = {
+    'RETENTION_DAYS': 30,
+    'REAP_BATCH_SIZE': 500,
+}
+
+
+def get_setting(name):
+    """Read a trash option from settings.TRASH, falling back to defaults."""
+    return getattr(settings, 'TRASH', {}).get(name, DEFAULTS[name])
+
+
+def move_to_trash(file_record, permanent=False):
+    """
+    Trash a file. A permanent delete is due for purging right away rather
+    than after the retention period. Returns False if it was already trashed.
+    """
+    from .models import File
+
+    now = timezone.now()
+    purge_after = now if permanent else now + timedelta(days=get_setting('RETENTION_DAYS'))
+    with transaction.atomic():
+        trashed = bool(File.objects.filter(pk=file_record.pk, deleted_at__isnull=True).update(
+            deleted_at=now, purge_after=purge_after
+        ))
+        if trashed:
+            changes.record(file_record.owner_id, file_record.pk, changes.TRASHED)
+    return trashed
+
+
+def restore(file_record):
+    """Take a file out of the trash. Returns False if it wasn't in it."""
+    from .models import File
+
+    with transaction.atomic():
+        restored = bool(File.objects.filter(pk=file_record.pk, deleted_at__isnull=False).update(
+            deleted_at=None, purge_after=None
+        ))
+        if restored:
+            changes.record(file_record.owner_id, file_record.pk, changes.RESTORED)
+    return restored
+
+
+def empty(user_id):
+    """Make everything in a user's trash due for purging. Returns the number of files."""
+    from .models import File
+
+    return File.objects.filter(owner_id=user_id, deleted_at__isnull=False).update(purge_after=timezone.now())
+
+
+def _purge(file_record):
+    """
+    Delete a trashed record for good. Returns the bytes freed: its stored
+    versions, plus the blob unless it lives on elsewhere.
+    """
+    from .models import File
+
+    if not file_record.is_duplicate and file_record.duplicate_files.exists():
+        heir = tiering.rehome(file_record)
+        # Now just a reference to its heir, so deleting it frees only its versions
+        File.objects.filter(pk=file_record.pk).update(file='', is_duplicate=True, original_file_ref=heir)
+        file_record.refresh_from_db()
+    freed = (0 if file_record.is_duplicate else file_record.size) + versioning.stored_bytes(file_record)
+    changes.record(file_record.owner_id, file_record.pk, changes.DELETED)
+    file_record.delete()
+    return freed
+
+
+def reap(batch_size=None, now=None):
+    """
+    Purge up to batch_size files whose purge_after has passed, one
+    transaction each. Returns (files purged, bytes freed).
+    """
+    from .models import File
+
+    batch_size = batch_size or get_setting('REAP_BATCH_SIZE')
+    now = now or timezone.now()
+    # References go first, so an original due in the same batch no longer has any to rehome
+    due = list(
+        File.objects.filter(purge_after__lte=now)
+        .order_by('-is_duplicate', 'purge_after')
+        .values_list('pk', flat=True)[:batch_size]
+    )
+    purged = freed = 0
+    for pk in due:
+        try:
+            with transaction.atomic():
+                # Skips files restored since the batch was picked
+                file_record = File.objects.select_for_update().filter(pk=pk, purge_after__lte=now).first()
+                if file_record is None:
+                    continue
+                released = _purge(file_record)
+                # Trashed files stay charged until they're purged; duplicates were never charged.
+                # Released in the same transaction, so a failed purge keeps its charge
+                counters.charge_storage(file_record.owner_id, -released)
+        except Exception:
+            logger.exception('Could not purge file %s; it stays in the trash', pk)
+            continue
+        purged += 1
+        freed += released
+    return purged, freed
@@ -1,12 +1,22 @@
 from django.urls import path, include
 from rest_framework.routers import DefaultRouter
-from .views import FileViewSet, api_root, storage_stats
+from .views import (
+    FileViewSet, FolderViewSet, api_root, storage_stats, cache_stats,
+    analytics_summary, analytics_top_users, analytics_file_types, analytics_growth,
+)
 
 router = DefaultRouter()
 router.register(r'files', FileViewSet, basename='File')
+router.register(r'folders', FolderViewSet, basename='Folder')
 
 urlpatterns = [
     path('', include(router.urls)),
     path('info/', api_root, name='api-root'),  # Public endpoint for API info
     path('storage_stats/', storage_stats, name='storage-stats'),  # Storage statistics endpoint
+    path('cache_stats/', cache_stats, name='cache-stats'),  # Content cache counters (admin only)
+    # Fleet-wide analytics from the daily rollup tables (admin only)
+    path('analytics/summary/', analytics_summary, name='analytics-summary'),
+    path('analytics/top_users/', analytics_top_users, name='analytics-top-users'),
+    path('analytics/file_types/', analytics_file_types, name='analytics-file-types'),
+    path('analytics/growth/', analytics_growth, name='analytics-growth'),
 ] 
\ No newline at end of file
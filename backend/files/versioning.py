@@ -0,0 +1,253 @@
+import os
+import shutil
+import tempfile
+
+from django.conf import settings
+from django.db.models import Sum
+
+from . import analytics, changes, counters, delta, folders, previews, tiering
+from .cache import content_cache
+
+DEFAULTS = {
+    'ROOT': None,  # Defaults to MEDIA_ROOT/versions
+    'MAX_CHAIN': 8,
+    'MAX_DELTA_BYTES': 64 * 1024 * 1024,
+    'BLOCK_SIZE': delta.DEFAULT_BLOCK_SIZE,
+    'SPOOL_BYTES': 8 * 1024 * 1024,
+}
+
+STREAM_CHUNK_SIZE = 1024 * 1024
+
+
+def get_setting(name):
+    """Read a versioning option from settings.VERSIONING, falling back to defaults."""
+    return getattr(settings, 'VERSIONING', {}).get(name, DEFAULTS[name])
+
+
+def version_dir(file_id):
+    root = get_setting('ROOT') or os.path.join(settings.MEDIA_ROOT, 'versions')
+    return os.path.join(root, str(file_id))
+
+
+def version_path(version):
+    suffix = 'full' if version.is_keyframe else 'delta'
+    return os.path.join(version_dir(version.file_id), f'{version.number}.{suffix}')
+
+
+def _has_duplicates(file_record):
+    from .models import File
+    return not file_record.is_duplicate and File.objects.filter(original_file_ref=file_record).exists()
+
+
+def storage_charge(file_record, new_size, has_duplicates=None):
+    """
+    Bytes added to the owner's usage by replacing file_record's content with
+    new_size bytes. The old content stays charged when it is still someone
+    else's blob (duplicates of it, or the original of a duplicate).
+    """
+    if has_duplicates is None:
+        has_duplicates = _has_duplicates(file_record)
+    if file_record.is_duplicate or has_duplicates:
+        return new_size
+    return new_size - file_record.size
+
+
+def storage_reservation(file_record, new_size):
+    """
+    Upper bound of add_version()'s charge, known before anything is written:
+    the new content, plus the old content kept in full as a keyframe.
+    """
+    return storage_charge(file_record, new_size) + file_record.size
+
+
+def _needs_keyframe(file_record):
+    """Whether one more delta would push the oldest version past MAX_CHAIN hops."""
+    max_chain = get_setting('MAX_CHAIN')
+    newest = file_record.versions.order_by('-number').values_list('is_keyframe', flat=True)[:max_chain]
+    run = 0
+    for is_keyframe in newest:
+        if is_keyframe:
+            break
+        run += 1
+    return run >= max_chain
+
+
+def _forget_blob(blob):
+    """Drop the cache entry and derived artifacts of a blob that is going away."""
+    from .models import File
+
+    content_cache.evict(blob.file_hash)
+    if not File.objects.filter(file_hash=blob.file_hash, is_duplicate=False).exclude(pk=blob.pk).exists():
+        previews.purge(blob.file_hash)
+
+
+def _write_keyframe(blob, path, move):
+    tmp = f'{path}.partial'
+    if move and blob.storage_tier == tiering.TIER_HOT:
+        # The old blob is ours alone, so it becomes the keyframe without a copy
+        os.replace(blob.file.path, path)
+        return
+    with tiering.open_blob(blob) as fin, open(tmp, 'wb') as fout:
+        shutil.copyfileobj(fin, fout, STREAM_CHUNK_SIZE)
+    os.replace(tmp, path)
+    if move:
+        tiering.delete_blob(blob)
+
+
+def add_version(file_record, upload, file_hash):
+    """
+    Make upload the current content of file_record and keep the previous
+    content as a FileVersion, stored as a reverse delta against the upload
+    or, when the chain is long or the delta doesn't pay off, in full.
+
+    Returns the change in the owner's charged storage: the new content's
+    and the stored version's bytes. The caller holds a transaction.
+    """
+    from .models import FileVersion
+
+    old_blob = tiering.blob_record(file_record)
+    has_duplicates = _has_duplicates(file_record)
+    exclusive = not file_record.is_duplicate and not has_duplicates
+    charge = storage_charge(file_record, upload.size, has_duplicates)
+
+    version = FileVersion(
+        file=file_record,
+        number=file_record.version,
+        original_filename=file_record.original_filename,
+        file_type=file_record.file_type,
+        size=file_record.size,
+        file_hash=file_record.file_hash,
+    )
+    os.makedirs(version_dir(file_record.pk), exist_ok=True)
+
+    max_delta_bytes = get_setting('MAX_DELTA_BYTES')
+    version.is_keyframe = (
+        _needs_keyframe(file_record)
+        or file_record.size > max_delta_bytes
+        or upload.size > max_delta_bytes
+    )
+    if not version.is_keyframe:
+        with tiering.open_blob(old_blob) as f:
+            target = f.read()
+        upload.seek(0)
+        base = upload.read()
+        upload.seek(0)
+        try:
+            data = delta.encode(target, base, block_size=get_setting('BLOCK_SIZE'))
+        except delta.DeltaNotWorthwhile:
+            version.is_keyframe = True
+        else:
+            path = version_path(version)
+            with open(f'{path}.partial', 'wb') as f:
+                f.write(data)
+            os.replace(f'{path}.partial', path)
+            version.stored_size = len(data)
+            if exclusive:
+                tiering.delete_blob(old_blob)
+                _forget_blob(old_blob)
+
+    if version.is_keyframe:
+        path = version_path(version)
+        _write_keyframe(old_blob, path, move=exclusive)
+        version.stored_size = os.path.getsize(path)
+        if exclusive:
+            _forget_blob(old_blob)
+
+    if has_duplicates:
+        tiering.rehome(file_record)
+    version.save()
+    # The row is updated in place, so counters see the old content go and the new arrive
+    counters.count_file_type(file_record.owner_id, file_record.file_type, -1, -file_record.size)
+    counters.count_file_type(file_record.owner_id, upload.content_type, 1, upload.size)
+    folders.adjust_totals(file_record.folder_id, 0, upload.size - file_record.size)
+    analytics.record_removed(file_record.file_type, 1, file_record.size, file_record.size if exclusive else 0)
+    analytics.record_added(upload.content_type, 1, upload.size, upload.size)
+
+    # The type is set first, since the stored file's extension follows it
+    file_record.file_type = upload.content_type
+    file_record.file.save(upload.name, upload, save=False)
+    file_record.original_filename = upload.name
+    file_record.size = upload.size
+    file_record.file_hash = file_hash
+    file_record.is_duplicate = False
+    file_record.original_file_ref = None
+    file_record.storage_tier = tiering.TIER_HOT
+    file_record.version = version.number + 1
+    file_record.save()
+    changes.record(file_record.owner_id, file_record.pk, changes.UPDATED)
+    # Kept versions take up disk, so they count towards the quota at their stored size
+    return charge + version.stored_size
+
+
+def _chain(file_record, number):
+    """Versions needed to rebuild `number`, oldest first, ending at a keyframe or the newest version."""
+    chain = []
+    for version in file_record.versions.filter(number__gte=number).order_by('number'):
+        if not chain and version.number != number:
+            break
+        chain.append(version)
+        if version.is_keyframe:
+            break
+    if not chain:
+        raise file_record.versions.model.DoesNotExist()
+    return chain
+
+
+def _read_delta(version):
+    with open(version_path(version), 'rb') as f:
+        return f.read()
+
+
+def _stream(base, version):
+    try:
+        yield from delta.patch_stream(_read_delta(version), base, STREAM_CHUNK_SIZE)
+    finally:
+        base.close()
+
+
+def open_version(file_record, number):
+    """
+    Rebuild an older version of file_record.
+
+    Returns (version, path, chunks): a keyframe is served straight from
+    `path`; otherwise `chunks` yields the content. Intermediate versions
+    along the chain are spooled to temporary files, since each delta seeks
+    around in its base.
+    """
+    chain = _chain(file_record, number)
+    target = chain[0]
+    if target.is_keyframe:
+        return target, version_path(target), None
+
+    if chain[-1].is_keyframe:
+        base = open(version_path(chain[-1]), 'rb')
+        deltas = chain[:-1]
+    else:
+        blob = tiering.blob_record(file_record)
+        # gzip can't seek backwards cheaply, so archived heads are brought back first
+        tiering.promote(blob)
+        base = open(blob.file.path, 'rb')
+        deltas = chain
+
+    try:
+        for version in reversed(deltas[1:]):
+            spool = tempfile.SpooledTemporaryFile(max_size=get_setting('SPOOL_BYTES'))
+            for chunk in delta.patch_stream(_read_delta(version), base, STREAM_CHUNK_SIZE):
+                spool.write(chunk)
+            spool.seek(0)
+            base.close()
+            base = spool
+    except BaseException:
+        base.close()
+        raise
+    return target, None, _stream(base, target)
+
+
+def stored_bytes(file_record):
+    """Bytes charged for the stored versions of a file."""
+    return file_record.versions.aggregate(total=Sum('stored_size'))['total'] or 0
+
+
+def delete_versions(file_id):
+    """Remove every stored version of a file."""
+    shutil.rmtree(version_dir(file_id), ignore_errors=True)
@@ -1,17 +1,19 @@
 from django.shortcuts import render
 from rest_framework import viewsets, status, views
 from rest_framework.response import Response
-from rest_framework.permissions import IsAuthenticated, AllowAny
+from rest_framework.permissions import IsAuthenticated, IsAdminUser, AllowAny
 from rest_framework.decorators import api_view, permission_classes, action
-from .models import File, UserProfile
-from .serializers import FileSerializer
+from .models import File, FileVersion, Folder, UserFileType, UserProfile
+from .serializers import FileSerializer, FileVersionSerializer, FolderSerializer
+from . import analytics, bandwidth, changes, counters, folders, inspection, metrics, previews, streaming, tiering, trash, versioning
+from .cache import content_cache
 from io import BytesIO
-from django.core.files.uploadedfile import SimpleUploadedFile
-import hashlib
 
 # Create your views here.
 
-from django.http import JsonResponse
+from django.db import transaction
+from django.db.models import Count, F, Q, Sum
+from django.http import FileResponse, Http404, HttpResponse, JsonResponse, StreamingHttpResponse
 from django.shortcuts import render
 from django.views.decorators.csrf import csrf_protect
 from django.utils.decorators import method_decorator
@@ -26,9 +28,33 @@ def api_root(request):
         'message': 'Welcome to the File Vault API',
         'files': 'GET/POST /api/files/ (requires authentication)',
         'storage_stats': 'GET /api/files/storage_stats/ (requires authentication)',
+        'folders': 'GET/POST /api/folders/ (requires authentication)',
+        'changes': 'GET /api/files/changes/?cursor= (requires authentication)',
     }
     return Response(content)
 
+
+def _safe_int_conversion(value):
+    """Safely convert a string value to integer, returning None if conversion fails."""
+    try:
+        return int(value)
+    except ValueError:
+        return None
+
+
+def _resolve_folder(request, value):
+    """
+    Look up one of the user's folders by id. Empty values and 'root' mean the
+    top level. Returns (folder or None, None), or (None, error_response).
+    """
+    if value in (None, '', 'root'):
+        return None, None
+    try:
+        return Folder.objects.get(owner=request.user, pk=int(value)), None
+    except (TypeError, ValueError, Folder.DoesNotExist):
+        return None, Response({'error': 'Folder not found'}, status=status.HTTP_404_NOT_FOUND)
+
+
 @api_view(['GET'])
 def storage_stats(request):
     # Get storage statistics for the authenticated user
@@ -44,22 +70,16 @@ def storage_stats(request):
     # Get all files for the current user
     user_files = File.objects.filter(owner=request.user)
 
-    # Calculate original storage (sum of all file sizes)
-    original_storage_used = sum(file.size for file in user_files)
-
-    # Use the stored current_storage_used value which represents logical storage usage
-    # (sum of all files regardless of duplication)
-    total_storage_used = profile.current_storage_used
-
-    # Since current_storage_used represents logical usage (sum of all files),
-    # there are no storage savings to calculate in this model
-    # The actual storage used after deduplication would need to be calculated separately
-    actual_storage_after_deduplication = 0
-    unique_hashes = {}
-    for file in user_files:
-        if file.file_hash and file.file_hash not in unique_hashes:
-            unique_hashes[file.file_hash] = file.size
-    actual_storage_after_deduplication = sum(unique_hashes.values())
+    # Logical usage counts every record; physical usage only the records that own a blob,
+    # since duplicates point at their original's. Both come from one aggregate query.
+    usage = user_files.aggregate(
+        original=Sum('size'),
+        physical=Sum('size', filter=Q(is_duplicate=False)),
+        trashed=Count('id', filter=Q(deleted_at__isnull=False)),
+        trash=Sum('size', filter=Q(deleted_at__isnull=False)),
+    )
+    original_storage_used = usage['original'] or 0
+    actual_storage_after_deduplication = usage['physical'] or 0
 
     # Calculate storage savings
     storage_savings = original_storage_used - actual_storage_after_deduplication
@@ -72,14 +92,109 @@ def storage_stats(request):
     # Get user's storage limit in bytes
     storage_limit_bytes = profile.storage_limit_mb * 1024 * 1024
 
-    return Response({
+    # Break physical usage down by storage tier (only blob-owning records hold bytes)
+    tier_usage = dict(
+        user_files.filter(is_duplicate=False)
+        .order_by()
+        .values_list('storage_tier')
+        .annotate(total=Sum('size'))
+    )
+
+    # Older versions are stored mostly as deltas, and charged at their stored size
+    version_usage = FileVersion.objects.filter(file__owner=request.user).aggregate(
+        count=Count('id'), stored=Sum('stored_size'), logical=Sum('size')
+    )
+    version_storage_used = version_usage['stored'] or 0
+
+    response_data = {
         'user_id': request.user.id,
         'total_storage_used': actual_storage_after_deduplication,  # Actual storage used after deduplication
         'original_storage_used': original_storage_used,  # Logical storage without deduplication
         'storage_savings': storage_savings,
         'savings_percentage': round(savings_percentage, 2),
-    })
+        'hot_storage_used': tier_usage.get(tiering.TIER_HOT, 0),
+        'cold_storage_used': tier_usage.get(tiering.TIER_COLD, 0) + tier_usage.get(tiering.TIER_ARCHIVE, 0),
+        'hot_tier_capacity': tiering.hot_tier_capacity(),  # Capacity of the fast volume in bytes
+        'version_count': version_usage['count'],
+        'version_storage_used': version_storage_used,  # Bytes on disk for older versions
+        'version_delta_savings': (version_usage['logical'] or 0) - version_storage_used,
+        'trash_count': usage['trashed'],
+        'trash_storage_used': usage['trash'] or 0,  # Still charged until the trash reaper purges it
+    }
+    # Subtree totals of one folder (`?folder=<id>`) are kept on its row, so they cost a single lookup
+    if 'folder' in request.query_params:
+        folder, error = _resolve_folder(request, request.query_params['folder'])
+        if error:
+            return error
+        if folder is not None:
+            response_data['folder'] = {
+                'id': folder.id,
+                'path': folder.path,
+                'file_count': folder.file_count,
+                'storage_used': folder.total_bytes,  # Logical bytes, trashed files included
+            }
+    return Response(response_data)
+
 
+@api_view(['GET'])
+@permission_classes([IsAdminUser])
+def cache_stats(request):
+    """
+    Hit/miss/eviction counters of this worker's in-process content cache.
+    """
+    return Response(content_cache.stats())
+
+@api_view(['GET'])
+@permission_classes([IsAdminUser])
+def analytics_summary(request):
+    """
+    Fleet-wide file count, logical and physical bytes and dedup savings.
+    """
+    return Response(analytics.summary())
+
+
+@api_view(['GET'])
+@permission_classes([IsAdminUser])
+def analytics_top_users(request):
+    """
+    Users with the most stored bytes (`?limit=10`).
+    """
+    try:
+        limit = min(int(request.query_params.get('limit', analytics.get_setting('TOP_USERS'))), 1000)
+    except ValueError:
+        return Response({'error': 'limit must be an integer'}, status=status.HTTP_400_BAD_REQUEST)
+    return Response({'users': analytics.top_users(limit)})
+
+
+@api_view(['GET'])
+@permission_classes([IsAdminUser])
+def analytics_file_types(request):
+    """
+    File count and bytes per MIME type across all users.
+    """
+    return Response({'file_types': analytics.file_type_distribution()})
+
+
+@api_view(['GET'])
+@permission_classes([IsAdminUser])
+def analytics_growth(request):
+    """
+    Uploads, deletions and net growth per day (`?days=30`).
+    """
+    try:
+        days = min(int(request.query_params.get('days', analytics.get_setting('GROWTH_DAYS'))), 3660)
+    except ValueError:
+        return Response({'error': 'days must be an integer'}, status=status.HTTP_400_BAD_REQUEST)
+    return Response({'days': analytics.growth(days)})
+
+def prometheus_metrics(request):
+    """
+    Request latency histograms, DB query counts, span timings and throughput
+    counters of this worker, in the Prometheus text exposition format.
+    """
+    if not metrics.enabled():
+        raise Http404()
+    return HttpResponse(metrics.registry.render(), content_type='text/plain; version=0.0.4; charset=utf-8')
 
 
 class FileViewSet(viewsets.ModelViewSet):
@@ -89,37 +204,281 @@ class FileViewSet(viewsets.ModelViewSet):
     @action(detail=False, methods=['get'], url_path='file_types')
     def file_types(self, request):
         """
-        Get list of unique file types (MIME types) for the authenticated user.
+        Get list of unique file types (MIME types) for the authenticated user,
+        with a per-type breakdown of file count and bytes.
         """
         if not request.user.is_authenticated:
             return Response({'detail': 'Authentication required'}, status=status.HTTP_401_UNAUTHORIZED)
 
-        # Get user's profile (create if doesn't exist)
-        profile, created = UserProfile.objects.get_or_create(
-            user=request.user,
-            defaults={'storage_limit_mb': 10, 'api_calls_per_second': 2, 'current_storage_used': 0, 'file_types': []}
+        # Served from the per-user counter table; types whose files were all deleted sit at zero
+        breakdown = list(
+            UserFileType.objects.filter(user=request.user, file_count__gt=0)
+            .order_by('file_type')
+            .values('file_type', 'file_count', 'total_bytes')
+        )
+        return Response({
+            'file_types': [row['file_type'] for row in breakdown],
+            'breakdown': breakdown,
+        })
+
+    @action(detail=False, methods=['get', 'delete'])
+    def trash(self, request):
+        """
+        List the files in the trash, or with DELETE, empty it. Emptied files
+        are purged by the trash reaper on its next run.
+        """
+        if request.method == 'DELETE':
+            return Response({'emptied': trash.empty(request.user.id)})
+        return self.list(request)
+
+    @action(detail=False, methods=['get'])
+    def changes(self, request):
+        """
+        Changes to the user's files since `?cursor=`, oldest first, with the
+        cursor to send next. Without a cursor only the current one is
+        returned: take it, then the full listing. `?wait=<seconds>` holds
+        the request until something changes.
+        """
+        if 'cursor' not in request.query_params:
+            return Response({'changes': [], 'cursor': changes.latest_cursor(request.user.id), 'has_more': False})
+        cursor = _safe_int_conversion(request.query_params['cursor'])
+        wait = _safe_int_conversion(request.query_params.get('wait', '0'))
+        if cursor is None or wait is None:
+            return Response({'error': 'cursor and wait must be integers'}, status=status.HTTP_400_BAD_REQUEST)
+
+        limit = changes.get_setting('PAGE_SIZE')
+        try:
+            events = changes.since(request.user.id, cursor, limit, wait)
+        except changes.CursorExpired:
+            return Response(
+                {'error': 'Cursor expired; resync from a full listing', 'cursor': changes.latest_cursor(request.user.id)},
+                status=status.HTTP_410_GONE
+            )
+
+        # Events carry the file's current state; purged files have none
+        records = File.objects.filter(pk__in={event.file_id for event in events})
+        with metrics.span('serialize'):
+            current = {row['id']: row for row in FileSerializer(records, many=True).data}
+        return Response({
+            'changes': [
+                {
+                    'cursor': event.id,
+                    'file_id': str(event.file_id),
+                    'action': event.action,
+                    'at': event.created_at,
+                    'file': current.get(str(event.file_id)),
+                }
+                for event in events
+            ],
+            'cursor': events[-1].id if events else cursor,
+            'has_more': len(events) == limit,
+        })
+
+    @action(detail=True, methods=['post'])
+    def move(self, request, pk=None):
+        """Move a file into another folder (`{"folder": <id>}`, null for the top level)."""
+        file_record = self.get_object()
+        folder, error = _resolve_folder(request, request.data.get('folder'))
+        if error:
+            return error
+        folders.move_file(file_record, folder)
+        return Response(FileSerializer(file_record).data)
+
+    @action(detail=True, methods=['post'])
+    def restore(self, request, pk=None):
+        """Take a file out of the trash."""
+        file_record = self.get_object()
+        trash.restore(file_record)
+        file_record.refresh_from_db()
+        return Response(FileSerializer(file_record).data)
+
+    @action(detail=True, methods=['get'])
+    def download(self, request, pk=None):
+        """
+        Download the file content. Cold blobs are promoted back to the hot tier on access.
+        """
+        file_record = self.get_object()
+        blob = tiering.blob_record(file_record)
+        if not blob.file:
+            return Response({'error': 'File content not available'}, status=status.HTTP_404_NOT_FOUND)
+
+        # Access statistics are buffered and written in batches
+        tiering.access_recorder.record(file_record)
+
+        # Small hot files are served from the in-process content cache; keyed by
+        # hash, so every duplicate record shares its original's entry
+        range_header = request.META.get('HTTP_RANGE')
+        if not range_header and content_cache.admits(blob.size):
+            content = content_cache.get(blob.file_hash)
+            if content is None:
+                tiering.promote(blob)
+                if blob.storage_tier != tiering.TIER_HOT:
+                    return Response({'error': 'File content not available'}, status=status.HTTP_404_NOT_FOUND)
+                with blob.file.open('rb') as f:
+                    content = f.read()
+                content_cache.put(blob.file_hash, content)
+            metrics.DOWNLOADED_BYTES.inc(len(content), labels=('cache',))
+            return bandwidth.shape_response(FileResponse(
+                BytesIO(content),
+                as_attachment=True,
+                filename=file_record.original_filename,
+                content_type=file_record.file_type,
+            ), request.user)
+
+        # Everything else is streamed from disk with sendfile or mmap slices
+        tiering.promote(blob)
+        if blob.storage_tier != tiering.TIER_HOT:
+            return Response({'error': 'File content not available'}, status=status.HTTP_404_NOT_FOUND)
+        response = streaming.file_response(
+            blob.file.path,
+            filename=file_record.original_filename,
+            content_type=file_record.file_type,
+            range_header=range_header,
         )
+        metrics.DOWNLOADED_BYTES.inc(int(response.get('Content-Length', 0)), labels=('disk',))
+        # Users under a byte-rate limit are paced; everyone else keeps sendfile
+        return bandwidth.shape_response(response, request.user)
 
-        # If file_types is empty, recalculate it
-        if not profile.file_types:
-            unique_file_types = File.objects.filter(owner=request.user).values_list('file_type', flat=True).distinct()
-            profile.file_types = list(unique_file_types)
-            profile.save(update_fields=['file_types'])
+    @action(detail=True, methods=['get'])
+    def preview(self, request, pk=None):
+        """
+        Thumbnail (`?kind=thumbnail&size=256`), first lines of text (`?kind=text`)
+        or basic metadata (`?kind=metadata`), generated lazily and shared by
+        every record with the same content.
+        """
+        file_record = self.get_object()
+        blob = tiering.blob_record(file_record)
+        if not blob.file:
+            return Response({'error': 'File content not available'}, status=status.HTTP_404_NOT_FOUND)
+
+        kind = request.query_params.get('kind') or previews.default_kind(file_record.file_type)
+        if kind not in previews.KINDS:
+            return Response({'error': f'kind must be one of {previews.KINDS}'}, status=status.HTTP_400_BAD_REQUEST)
+        size = _safe_int_conversion(request.query_params.get('size', '256')) if kind == previews.KIND_THUMBNAIL else None
+
+        # Artifacts never change for a given hash, but this URL follows the file to its newer
+        # versions; clients keep it briefly and then revalidate with the hash-based ETag
+        etag = f'"{blob.file_hash}-{previews.artifact_name(kind, size)}"'
+        cache_control = f"private, max-age={previews.get_setting('CACHE_MAX_AGE')}"
+        if request.META.get('HTTP_IF_NONE_MATCH') == etag:
+            response = HttpResponse(status=304)
+        else:
+            try:
+                path = previews.get_artifact(blob, kind, size)
+            except previews.PreviewUnavailable as exc:
+                return Response({'error': str(exc)}, status=status.HTTP_404_NOT_FOUND)
+            response = FileResponse(open(path, 'rb'), content_type=previews.content_type_for(kind))
+        response['ETag'] = etag
+        response['Cache-Control'] = cache_control
+        return response
+
+    @action(detail=True, methods=['get', 'post'])
+    def versions(self, request, pk=None):
+        """
+        GET lists the older versions of a file. POST uploads new content for
+        it; the current content is kept as the newest older version.
+        """
+        if request.method == 'POST':
+            return self._upload_version(request)
 
+        file_record = self.get_object()
         return Response({
-            'file_types': profile.file_types
+            'current_version': file_record.version,
+            'versions': FileVersionSerializer(file_record.versions.all(), many=True).data,
         })
 
+    @action(detail=True, methods=['get'], url_path=r'versions/(?P<number>[0-9]+)', url_name='version-download')
+    def version_download(self, request, pk=None, number=None):
+        """
+        Download an older version, rebuilt by streaming its delta chain.
+        """
+        file_record = self.get_object()
+        number = int(number)
+        if number == file_record.version:
+            return self.download(request, pk=pk)
+
+        try:
+            version, path, chunks = versioning.open_version(file_record, number)
+        except FileVersion.DoesNotExist:
+            return Response({'error': 'Version not found'}, status=status.HTTP_404_NOT_FOUND)
+
+        if path:
+            response = streaming.file_response(
+                path,
+                filename=version.original_filename,
+                content_type=version.file_type,
+                range_header=request.META.get('HTTP_RANGE'),
+            )
+        else:
+            response = StreamingHttpResponse(chunks, content_type=version.file_type)
+            response['Content-Length'] = str(version.size)
+            response['Content-Disposition'] = f'attachment; filename="{version.original_filename}"'
+        metrics.DOWNLOADED_BYTES.inc(int(response.get('Content-Length', 0)), labels=('version',))
+        return bandwidth.shape_response(response, request.user)
+
+    def _upload_version(self, request):
+        file_obj, report, error = self._receive_upload(request)
+        if error:
+            return error
+
+        file_record = self.get_object()
+        with transaction.atomic():
+            # Serializes concurrent uploads of new versions of the same file
+            file_record = File.objects.select_for_update().get(pk=file_record.pk)
+            profile = UserProfile.objects.get(user=request.user)
+
+            # The new content and the old one kept in full are reserved up front; whatever a
+            # delta saves is released once the version is stored
+            storage_limit_bytes = profile.storage_limit_mb * 1024 * 1024
+            reserved = versioning.storage_reservation(file_record, file_obj.size)
+            storage_used = counters.reserve_storage(request.user.id, reserved, storage_limit_bytes)
+            if storage_used is None:
+                return Response(
+                    {'error': 'Storage Quota Exceeded'},
+                    status=status.HTTP_413_REQUEST_ENTITY_TOO_LARGE
+                )
+
+            try:
+                with metrics.span('disk_write'):
+                    charge = versioning.add_version(file_record, file_obj, report['sha256'])
+            except Exception:
+                counters.release_storage(request.user.id, reserved)
+                raise
+            counters.charge_storage(request.user.id, charge - reserved)
+            storage_used += charge - reserved
+            transaction.on_commit(lambda: previews.schedule(file_record))
+
+        metrics.UPLOADED_FILES.inc(labels=('version',))
+        metrics.UPLOADED_BYTES.inc(file_obj.size)
+
+        with metrics.span('serialize'):
+            response_data = FileSerializer(file_record).data
+        response_data['remaining_storage_bytes'] = storage_limit_bytes - storage_used
+        response_data['storage_usage_percentage'] = round((storage_used / storage_limit_bytes) * 100, 2) if storage_limit_bytes > 0 else 0
+        return Response(response_data, status=status.HTTP_201_CREATED)
+
+    def list(self, request, *args, **kwargs):
+        queryset = self.filter_queryset(self.get_queryset())
+
+        page = self.paginate_queryset(queryset)
+        with metrics.span('serialize'):
+            serializer = self.get_serializer(page if page is not None else queryset, many=True)
+            data = serializer.data
+        if page is not None:
+            return self.get_paginated_response(data)
+        return Response(data)
+
     def get_queryset(self):
-        # Start with the user's files
+        # Start with the user's files; trashed ones only show up in the trash and can only be restored
         queryset = File.objects.filter(owner=self.request.user) if self.request.user.is_authenticated else File.objects.none()
+        queryset = queryset.filter(deleted_at__isnull=self.action not in ('trash', 'restore'))
 
         # Define filter mappings: parameter name -> (field lookup, transform function)
         filters = {
             'search': ('original_filename__icontains', None),
             'file_type': ('file_type__icontains', None),
-            'min_size': ('size__gte', self._safe_int_conversion),
-            'max_size': ('size__lte', self._safe_int_conversion),
+            'min_size': ('size__gte', _safe_int_conversion),
+            'max_size': ('size__lte', _safe_int_conversion),
             'start_date': ('uploaded_at__gte', self._parse_iso_datetime),
             'end_date': ('uploaded_at__lte', self._parse_iso_datetime),
         }
@@ -135,56 +494,76 @@ class FileViewSet(viewsets.ModelViewSet):
                 else:
                     queryset = queryset.filter(**{field_lookup: param_value})
 
-        return queryset
+        # Files directly in one folder (`?folder=<id>`, or `?folder=root` for the top level)
+        folder = self.request.query_params.get('folder')
+        if folder == 'root':
+            queryset = queryset.filter(folder__isnull=True)
+        elif folder is not None:
+            folder_id = _safe_int_conversion(folder)
+            # A malformed id matches nothing, rather than the files at the top level
+            queryset = queryset.filter(folder_id=folder_id) if folder_id is not None else queryset.none()
 
-    def _safe_int_conversion(self, value):
-        """Safely convert a string value to integer, returning None if conversion fails."""
-        try:
-            return int(value)
-        except ValueError:
-            return None
+        return queryset
 
     def _parse_iso_datetime(self, value):
         """Parse ISO 8601 datetime string, returning None if parsing fails."""
         from django.utils.dateparse import parse_datetime
         return parse_datetime(value)
 
-    def create(self, request, *args, **kwargs):
-        file_obj = request.FILES.get('file')
+    def _receive_upload(self, request, limit_bytes=None):
+        """
+        Parse the uploaded 'file' through the upload inspectors, which hash,
+        sniff and check it as it's received.
+
+        Returns (file_obj, report, None), or (None, None, error_response)
+        when the upload is missing or was rejected part-way.
+        """
+        handler = inspection.InspectingUploadHandler(request, limit_bytes)
+        request.upload_handlers.insert(0, handler)
+        # Ahead of the inspectors, so the body is read no faster than the user's byte rate
+        request.upload_handlers.insert(0, bandwidth.ShapingUploadHandler(request, request.user))
+        with metrics.span('inspect'):
+            file_obj = request.FILES.get('file')
+        if handler.rejection:
+            metrics.UPLOADS_REJECTED.inc(labels=(handler.rejection.reason,))
+            return None, None, Response({'error': handler.rejection.message}, status=handler.rejection.status)
         if not file_obj:
-            return Response({'error': 'No file provided'}, status=status.HTTP_400_BAD_REQUEST)
+            return None, None, Response({'error': 'No file provided'}, status=status.HTTP_400_BAD_REQUEST)
+        return file_obj, handler.apply('file', file_obj), None
 
+    def create(self, request, *args, **kwargs):
         # Get user's profile (create if doesn't exist)
         profile, created = UserProfile.objects.get_or_create(
             user=request.user,
             defaults={'storage_limit_mb': 10, 'api_calls_per_second': 2, 'current_storage_used': 0}
         )
 
-        # Check if the new file would exceed storage quota
+        # Uploads that outgrow the remaining quota are stopped while they're received; this
+        # early check is advisory, the reservation below is what enforces the limit under concurrency
         storage_limit_bytes = profile.storage_limit_mb * 1024 * 1024
-        if profile.current_storage_used + file_obj.size > storage_limit_bytes:
-            return Response(
-                {'error': 'Storage Quota Exceeded'},
-                status=status.HTTP_429_TOO_MANY_REQUESTS
-            )
-
-        # Calculate hash of the incoming file to check for duplicates
-        sha256_hash = hashlib.sha256()
-
-        # Read the file in chunks to calculate hash and store content temporarily
-        file_content = BytesIO()
-        for chunk in file_obj.chunks():
-            sha256_hash.update(chunk)
-            file_content.write(chunk)
-
-        file_hash = sha256_hash.hexdigest()
-
-        # Check if a file with the same hash already exists for this user
-        existing_file = File.objects.filter(owner=request.user, file_hash=file_hash).first()
+        storage_used = counters.storage_used(request.user.id)
+        file_obj, report, error = self._receive_upload(request, storage_limit_bytes - storage_used)
+        if error:
+            return error
+
+        # The content hash was computed while the upload was received
+        file_hash = report['sha256']
+        folder, error = _resolve_folder(request, request.data.get('folder'))
+        if error:
+            return error
+
+        # Check if a file with the same hash already exists for this user; references point at
+        # the record owning the blob, preferably one not in the trash
+        existing_file = (
+            File.objects.filter(owner=request.user, file_hash=file_hash, is_duplicate=False)
+            .order_by(F('deleted_at').asc(nulls_first=True))
+            .first()
+        )
 
         if existing_file:
             # Create a new record that points to the same physical file
             # Don't charge storage since it's a duplicate
+            metrics.UPLOADED_FILES.inc(labels=('duplicate',))
             new_file_record = File.objects.create(
                 original_filename=file_obj.name,
                 file_type=file_obj.content_type,
@@ -192,17 +571,20 @@ class FileViewSet(viewsets.ModelViewSet):
                 file_hash=file_hash,
                 owner=request.user,
                 is_duplicate=True,
+                folder=folder,
                 original_file_ref=existing_file  # Point to the original file
                 # Note: We don't set the file field for duplicates, it will be handled by the original
             )
 
             # For duplicates, we don't increase storage usage since it's already counted
-            remaining_storage = storage_limit_bytes - profile.current_storage_used
+            remaining_storage = storage_limit_bytes - storage_used
+            with metrics.span('serialize'):
+                file_data = FileSerializer(new_file_record).data
             response_data = {
                 'warning': f'We\'ve processed this upload. A file with the same content already exists as "{existing_file.original_filename}", but this new record is created separately.',
-                'file': FileSerializer(new_file_record).data,
+                'file': file_data,
                 'remaining_storage_bytes': remaining_storage,
-                'storage_usage_percentage': round((profile.current_storage_used / storage_limit_bytes) * 100, 2) if storage_limit_bytes > 0 else 0
+                'storage_usage_percentage': round((storage_used / storage_limit_bytes) * 100, 2) if storage_limit_bytes > 0 else 0
             }
 
             # Calculate headers for the new record
@@ -212,72 +594,123 @@ class FileViewSet(viewsets.ModelViewSet):
 
             return Response(response_data, status=status.HTTP_200_OK)
 
-        # Reset the file pointer to the beginning for saving
-        file_content.seek(0)
-
-        # Create a new file-like object with the content we stored
-        new_file_obj = SimpleUploadedFile(
-            name=file_obj.name,
-            content=file_content.getvalue(),
-            content_type=file_obj.content_type
-        )
-
-        # Create the file record directly instead of using serializer
-        file_record = File.objects.create(
-            file=new_file_obj,
-            original_filename=file_obj.name,
-            file_type=file_obj.content_type,
-            size=file_obj.size,
-            file_hash=file_hash,
-            owner=request.user
-        )
-
-        # Update the user's storage usage (add the new file's size)
+        # Charge the new file's size before writing it, atomically with the quota check
         # This represents the logical storage usage (sum of all files regardless of duplication)
-        profile.current_storage_used += file_obj.size
-
-        # Update the file types list if this file type is new
-        if file_obj.content_type not in profile.file_types:
-            profile.file_types.append(file_obj.content_type)
+        storage_used = counters.reserve_storage(request.user.id, file_obj.size, storage_limit_bytes)
+        if storage_used is None:
+            return Response(
+                {'error': 'Storage Quota Exceeded'},
+                status=status.HTTP_429_TOO_MANY_REQUESTS
+            )
 
-        profile.save(update_fields=['current_storage_used', 'file_types'])
+        # Create the file record directly instead of using serializer
+        # The upload is already rewound, so it's saved as-is without another copy
+        try:
+            with metrics.span('disk_write'):
+                file_record = File.objects.create(
+                    file=file_obj,
+                    original_filename=file_obj.name,
+                    file_type=file_obj.content_type,
+                    size=file_obj.size,
+                    file_hash=file_hash,
+                    owner=request.user,
+                    folder=folder,
+                )
+        except Exception:
+            counters.release_storage(request.user.id, file_obj.size)
+            raise
+        metrics.UPLOADED_FILES.inc(labels=('original',))
+        metrics.UPLOADED_BYTES.inc(file_obj.size)
+
+        # Thumbnails and text previews are generated in the background once committed
+        transaction.on_commit(lambda: previews.schedule(file_record))
 
         # Calculate remaining storage after successful upload
-        remaining_storage = storage_limit_bytes - profile.current_storage_used
+        remaining_storage = storage_limit_bytes - storage_used
 
         # Serialize the created record
         serializer = FileSerializer(file_record)
 
         # Add storage info to the response
-        response_data = serializer.data
+        with metrics.span('serialize'):
+            response_data = serializer.data
         response_data['remaining_storage_bytes'] = remaining_storage
-        response_data['storage_usage_percentage'] = round((profile.current_storage_used / storage_limit_bytes) * 100, 2) if storage_limit_bytes > 0 else 0
+        response_data['storage_usage_percentage'] = round((storage_used / storage_limit_bytes) * 100, 2) if storage_limit_bytes > 0 else 0
 
         headers = self.get_success_headers(serializer.data)
         return Response(response_data, status=status.HTTP_201_CREATED, headers=headers)
 
+    def perform_update(self, serializer):
+        with transaction.atomic():
+            file_record = serializer.save()
+            changes.record(file_record.owner_id, file_record.pk, changes.UPDATED)
+
     def perform_destroy(self, instance):
-        # Update storage usage when a file is deleted
-        profile = instance.owner.profile
+        # Only flags the record, however many duplicates reference it; the trash reaper
+        # purges it later, releasing its storage and updating the counters
+        trash.move_to_trash(instance, permanent=self.request.query_params.get('permanent') == 'true')
 
-        # Subtract the file's size from the user's storage usage
-        # This represents the logical storage usage (sum of all files regardless of duplication)
-        profile.current_storage_used -= instance.size
-        if profile.current_storage_used < 0:
-            profile.current_storage_used = 0  # Prevent negative storage usage
 
-        # Remove the file type from the list if no other files of this type exist
-        file_type_to_remove = instance.file_type
-        # Check if there are other files with the same type for this user
-        other_files_with_type = File.objects.filter(
-            owner=instance.owner,
-            file_type=file_type_to_remove
-        ).exclude(id=instance.id).exists()
+class FolderViewSet(viewsets.ModelViewSet):
+    """
+    Folders of the authenticated user. Listing returns the top-level folders,
+    or the subfolders of `?parent=<id>`. PATCH renames (`name`) and/or moves
+    (`parent`, null for the top level) a folder along with its subtree.
+    """
+    serializer_class = FolderSerializer
+    permission_classes = [IsAuthenticated]
 
-        if not other_files_with_type and file_type_to_remove in profile.file_types:
-            profile.file_types = [ft for ft in profile.file_types if ft != file_type_to_remove]
+    def get_queryset(self):
+        queryset = Folder.objects.filter(owner=self.request.user) if self.request.user.is_authenticated else Folder.objects.none()
+        if self.action == 'list':
+            parent = self.request.query_params.get('parent')
+            if parent in (None, '', 'root'):
+                queryset = queryset.filter(parent__isnull=True)
+            else:
+                parent_id = _safe_int_conversion(parent)
+                queryset = queryset.filter(parent_id=parent_id) if parent_id is not None else queryset.none()
+        return queryset
+
+    def create(self, request, *args, **kwargs):
+        parent, error = _resolve_folder(request, request.data.get('parent'))
+        if error:
+            return error
+        try:
+            folder = folders.create_folder(request.user, request.data.get('name', ''), parent)
+        except folders.FolderError as exc:
+            return Response({'error': str(exc)}, status=status.HTTP_400_BAD_REQUEST)
+        return Response(FolderSerializer(folder).data, status=status.HTTP_201_CREATED)
+
+    def update(self, request, *args, **kwargs):
+        folder = self.get_object()
+        parent = folder.parent
+        if 'parent' in request.data:
+            parent, error = _resolve_folder(request, request.data.get('parent'))
+            if error:
+                return error
+        try:
+            folder = folders.move_folder(folder, parent, request.data.get('name'))
+        except folders.FolderError as exc:
+            return Response({'error': str(exc)}, status=status.HTTP_400_BAD_REQUEST)
+        return Response(FolderSerializer(folder).data)
 
-        profile.save(update_fields=['current_storage_used', 'file_types'])
+    def destroy(self, request, *args, **kwargs):
+        try:
+            folders.delete_folder(self.get_object())
+        except folders.FolderError as exc:
+            return Response({'error': str(exc)}, status=status.HTTP_409_CONFLICT)
+        return Response(status=status.HTTP_204_NO_CONTENT)
 
-        # Call the parent method to actually delete the instance
-        super().perform_destroy(instance)
+    @action(detail=True, methods=['get'])
+    def children(self, request, pk=None):
+        """
+        Subfolders and files directly in a folder, both by name. Each is a
+        range scan of an (owner, parent, name) index.
+        """
+        folder = self.get_object()
+        files = File.objects.filter(owner=request.user, folder=folder, deleted_at__isnull=True).order_by('original_filename')
+        return Response({
+            'folder': FolderSerializer(folder).data,
+            'folders': FolderSerializer(folder.children.all(), many=True).data,
+            'files': FileSerializer(files, many=True).data,
+        })
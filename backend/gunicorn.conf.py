@@ -0,0 +1,64 @@
+"""
+Gunicorn settings for the API workers.
+
+The app is loaded once in the master (preload_app) and the workers are
+forked from it, so Django's setup, the URLconf and the views are shared
+copy-on-write instead of being rebuilt in every worker. Migrations are not
+run here; see start.sh and the `migrate` service in docker-compose.yml.
+
+Each worker keeps its own metrics, so they are merged through snapshot
+files in METRICS_MULTIPROCESS_DIR (a fresh temporary directory unless set);
+any worker answering /metrics reports the totals of all of them.
+
+Workers are threaded (gthread). Shaped transfers (files/bandwidth.py) and
+change feed long-polls sleep for as long as they last, so each holds one
+of a worker's GUNICORN_THREADS threads rather than the whole worker. The
+worker's main loop keeps answering the master's heartbeat meanwhile, so
+GUNICORN_TIMEOUT only restarts workers that are actually stuck, not slow
+requests. CHANGE_FEED_MAX_WAIT_SECONDS must still stay below it.
+
+Usage:
+    gunicorn -c gunicorn.conf.py
+"""
+import os
+import shutil
+import tempfile
+
+os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'core.settings_api')
+if not os.environ.get('METRICS_MULTIPROCESS_DIR'):
+    os.environ['METRICS_MULTIPROCESS_DIR'] = tempfile.mkdtemp(prefix='filevault-metrics-')
+
+wsgi_app = 'core.wsgi:application'
+bind = os.environ.get('GUNICORN_BIND', '0.0.0.0:8000')
+workers = int(os.environ.get('GUNICORN_WORKERS', (os.cpu_count() or 1) * 2 + 1))
+preload_app = os.environ.get('GUNICORN_PRELOAD', 'True') == 'True'
+worker_class = 'gthread'
+threads = int(os.environ.get('GUNICORN_THREADS', 8))
+timeout = int(os.environ.get('GUNICORN_TIMEOUT', 30))
+
+
+def post_fork(server, worker):
+    # Connections, sockets and threads must not be shared with the master
+    from django.db import connections
+    connections.close_all()
+
+
+def on_starting(server):
+    # Totals left over from a previous run would be added to this one's
+    directory = os.environ['METRICS_MULTIPROCESS_DIR']
+    shutil.rmtree(directory, ignore_errors=True)
+    os.makedirs(directory, exist_ok=True)
+
+    # Bandwidth buckets hold monotonic clock stamps, which mean nothing after a restart
+    import django
+    django.setup()
+    from files import bandwidth
+    bandwidth.reset_state()
+
+
+def worker_exit(server, worker):
+    # Download hits still buffered in this worker would otherwise be lost
+    from files import metrics, tiering
+    tiering.access_recorder.flush()
+    # Keep what this worker counted since its last snapshot
+    metrics.registry.write_snapshot()
@@ -4,11 +4,13 @@
 mkdir -p /app/data
 chmod -R 777 /app/data
 
-# Run migrations
-echo "Running migrations..."
-python manage.py makemigrations
-python manage.py migrate
+# Migrations are applied once per deploy by the `migrate` service, not on
+# every worker container start; set RUN_MIGRATIONS=True to apply them here
+if [ "$RUN_MIGRATIONS" = "True" ]; then
+  echo "Running migrations..."
+  python manage.py migrate --noinput
+fi
 
 # Start server
 echo "Starting server..."
-gunicorn --bind 0.0.0.0:8000 core.wsgi:application 
\ No newline at end of file
+exec gunicorn -c gunicorn.conf.py
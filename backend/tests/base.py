@@ -0,0 +1,55 @@
+from django.test import TestCase, override_settings
+from django.contrib.auth.models import User
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.urls import reverse
+from rest_framework.test import APIClient
+from files.models import UserProfile
+from files import tiering
+import shutil
+import tempfile
+
+
+class FileVaultTestCase(TestCase):
+    """
+    Uploads go to a throwaway MEDIA_ROOT, through an API client acting as
+    self.user, whose request rate limit is lifted so tests don't have to
+    sleep between calls.
+    """
+    username = 'testuser'
+    # Merged into the MEDIA_ROOT override; background preview generation is off unless a test needs it
+    settings_overrides = {'PREVIEWS': {'EAGER': False}}
+
+    def get_settings_overrides(self):
+        """The settings_overrides; override to build settings that live under self.media_root."""
+        return self.settings_overrides
+
+    def setUp(self):
+        self.media_root = tempfile.mkdtemp()
+        self.settings_override = override_settings(MEDIA_ROOT=self.media_root, **self.get_settings_overrides())
+        self.settings_override.enable()
+        self.client = APIClient()
+        self.user = User.objects.create_user(username=self.username, password='testpass')
+        UserProfile.objects.filter(user=self.user).update(api_calls_per_second=1000)
+
+    def tearDown(self):
+        # The access flusher thread would otherwise outlive the test and write to its database
+        tiering.access_recorder.stop()
+        self.settings_override.disable()
+        shutil.rmtree(self.media_root, ignore_errors=True)
+
+    def _upload_response(self, name, content, content_type='text/plain', folder=None, user=None):
+        """Upload a file and return the response."""
+        data = {'file': SimpleUploadedFile(name, content, content_type=content_type)}
+        if folder is not None:
+            data['folder'] = folder
+        return self.client.post(
+            reverse('File-list'),
+            data,
+            format='multipart',
+            HTTP_USERID=str((user or self.user).id)
+        )
+
+    def _upload(self, name, content, content_type='text/plain', folder=None, user=None):
+        """Upload a file and return its id, or the original's id when it's a duplicate."""
+        response = self._upload_response(name, content, content_type, folder, user)
+        return response.data['id'] if 'id' in response.data else response.data['file']['id']
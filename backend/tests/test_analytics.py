@@ -0,0 +1,73 @@
+from django.contrib.auth.models import User
+from django.core.management import call_command
+from django.urls import reverse
+from files.models import DailyFileTypeRollup, DailyStorageRollup, File, UserProfile
+from files import analytics, trash
+from .base import FileVaultTestCase
+import io
+import json
+
+# Uploads are typed by their content, so images need a real signature
+PNG_HEADER = b'\x89PNG\r\n\x1a\n'
+
+
+class AnalyticsTests(FileVaultTestCase):
+    username = 'alice'
+
+    def setUp(self):
+        super().setUp()
+        self.alice = self.user
+        self.bob = User.objects.create_user(username='bob', password='testpass')
+        self.admin = User.objects.create_user(username='admin', password='testpass', is_staff=True)
+        UserProfile.objects.update(api_calls_per_second=1000)
+
+    def _get(self, name, user=None, **params):
+        return self.client.get(reverse(name), params, HTTP_USERID=str((user or self.admin).id))
+
+    def test_rollups_follow_uploads_and_deletes(self):
+        self._upload('a.txt', b'a' * 100, 'text/plain', user=self.alice)
+        self._upload('a-copy.txt', b'a' * 100, 'text/plain', user=self.alice)
+        self._upload('b.png', PNG_HEADER + b'b' * (300 - len(PNG_HEADER)), 'image/png', user=self.bob)
+        doomed = self._upload('c.txt', b'c' * 50, 'text/plain', user=self.bob)
+        self.client.delete(reverse('File-detail', kwargs={'pk': doomed}) + '?permanent=true', HTTP_USERID=str(self.bob.id))
+        trash.reap()
+
+        summary = self._get('analytics-summary').data
+        self.assertEqual(summary['files'], 3)
+        self.assertEqual(summary['logical_bytes'], 500)
+        self.assertEqual(summary['physical_bytes'], 400)
+        self.assertEqual(summary['dedup_savings'], 100)
+
+        types = {row['file_type']: row for row in self._get('analytics-file-types').data['file_types']}
+        self.assertEqual(types['text/plain']['files'], 2)
+        self.assertEqual(types['image/png']['bytes'], 300)
+
+        users = self._get('analytics-top-users', limit=1).data['users']
+        self.assertEqual([row['username'] for row in users], ['bob'])
+
+        growth = self._get('analytics-growth', days=7).data['days']
+        self.assertEqual(len(growth), 1)
+        self.assertEqual((growth[0]['files_added'], growth[0]['files_removed']), (4, 1))
+
+    def test_answers_without_touching_the_file_table(self):
+        self._upload('a.txt', b'a' * 100, 'text/plain', user=self.alice)
+        with self.assertNumQueries(1):
+            analytics.file_type_distribution()
+        with self.assertNumQueries(2):
+            analytics.summary()
+
+    def test_endpoints_are_admin_only(self):
+        self.assertEqual(self._get('analytics-summary', user=self.alice).status_code, 403)
+
+    def test_report_rebuilds_from_files(self):
+        self._upload('a.txt', b'a' * 100, 'text/plain', user=self.alice)
+        self._upload('a-copy.txt', b'a' * 100, 'text/plain', user=self.alice)
+        DailyStorageRollup.objects.all().delete()
+        DailyFileTypeRollup.objects.all().delete()
+
+        out = io.StringIO()
+        call_command('analytics_report', '--rebuild', '--json', stdout=out, stderr=io.StringIO())
+        report = json.loads(out.getvalue())
+        self.assertEqual(report['summary']['files'], File.objects.count())
+        self.assertEqual(report['summary']['dedup_savings'], 100)
+        self.assertEqual(report['file_types'], [{'file_type': 'text/plain', 'files': 2, 'bytes': 200}])
@@ -1,15 +1,20 @@
-from django.test import TestCase, Client
+from django.test import TestCase, Client, override_settings
 from django.contrib.auth.models import User
 from django.core.files.uploadedfile import SimpleUploadedFile
 from django.urls import reverse
 from rest_framework.test import APIClient
 from files.models import File, UserProfile
+import shutil
 import tempfile
 import os
 
 
 class FileVaultAPITests(TestCase):
     def setUp(self):
+        # Uploads go to a throwaway MEDIA_ROOT rather than the real one
+        self.media_root = tempfile.mkdtemp()
+        self.settings_override = override_settings(MEDIA_ROOT=self.media_root)
+        self.settings_override.enable()
         self.client = APIClient()
         self.user = User.objects.create_user(
             username='testuser',
@@ -21,9 +26,13 @@ class FileVaultAPITests(TestCase):
         # Create UserProfile if it doesn't exist
         self.user_profile, created = UserProfile.objects.get_or_create(
             user=self.user,
-            defaults={'storage_limit_mb': 10, 'api_calls_per_second': 2, 'current_storage_used': 0, 'file_types': []}
+            defaults={'storage_limit_mb': 10, 'api_calls_per_second': 2, 'current_storage_used': 0}
         )
 
+    def tearDown(self):
+        self.settings_override.disable()
+        shutil.rmtree(self.media_root, ignore_errors=True)
+
     def test_file_upload_and_list(self):
         """Test uploading a file and listing files"""
         # Wait a bit to avoid rate limiting
@@ -0,0 +1,91 @@
+from django.test import override_settings
+from django.contrib.auth.models import User
+from django.urls import reverse
+from files.models import UserProfile
+from files import bandwidth
+from .base import FileVaultTestCase
+import os
+import time
+
+
+class BandwidthShapingTests(FileVaultTestCase):
+    username = 'shaped'
+
+    def get_settings_overrides(self):
+        return {
+            **self.settings_overrides,
+            'BANDWIDTH': {'PATH': os.path.join(self.media_root, 'bandwidth.state'), 'BURST_SECONDS': 0.1},
+        }
+
+    def _download(self, file_id):
+        start = time.monotonic()
+        response = self.client.get(reverse('File-download', kwargs={'pk': file_id}), HTTP_USERID=str(self.user.id))
+        content = b''.join(response.streaming_content)
+        elapsed = time.monotonic() - start
+        response.close()
+        return response, content, elapsed
+
+    def test_fair_shares(self):
+        self.assertEqual(bandwidth.fair_shares([0, 500, 0], 3000), [1250, 500, 1250])
+        self.assertEqual(bandwidth.fair_shares([5000, 0], 3000), [1500, 1500])
+        self.assertEqual(bandwidth.fair_shares([], 3000), [])
+
+    def test_stamps_from_before_a_reboot_count_as_idle(self):
+        """The monotonic clock restarts with the host, leaving stamps in the state file ahead of it"""
+        buckets = bandwidth.shared_buckets()
+        key = buckets.begin(self.user.id, bandwidth.DOWNLOAD, 1000)
+        index = buckets._find(key, time.monotonic(), claim=False)
+        slot = buckets._read(index)
+        slot[4] = -1000
+        slot[5] = slot[7] = time.monotonic() + 10 * 24 * 3600
+        buckets._write(index, slot)
+        self.assertEqual(buckets.consume(key, bandwidth.DOWNLOAD, 100), 0)
+
+        bandwidth.reset_state()
+        self.assertFalse(os.path.exists(bandwidth.state_path()))
+
+    def test_transfers_are_paced_to_the_user_limits(self):
+        content = os.urandom(1024 * 1024)
+        file_id = self._upload('big.bin', content, 'application/octet-stream')
+
+        _, _, elapsed = self._download(file_id)
+        self.assertLess(elapsed, 0.5)
+        self.assertFalse(os.path.exists(os.path.join(self.media_root, 'bandwidth.state')))
+
+        UserProfile.objects.filter(user=self.user).update(upload_bytes_per_second=1000 * 1000, download_bytes_per_second=1000 * 1000)
+        _, downloaded, elapsed = self._download(file_id)
+        self.assertEqual(downloaded, content)
+        self.assertGreater(elapsed, 0.8)
+
+        start = time.monotonic()
+        self.assertEqual(self._upload_response('big.bin', os.urandom(1024 * 1024), 'application/octet-stream').status_code, 201)
+        self.assertGreater(time.monotonic() - start, 0.8)
+
+        # /metrics is public, so user ids only appear when per-user labels are enabled
+        metrics = self.client.get('/metrics').content.decode()
+        self.assertIn('filevault_shaped_throughput_bytes_per_second{direction="download"}', metrics)
+        self.assertIn('filevault_shaped_active_transfers{direction="upload"} 0', metrics)
+        self.assertNotIn('user_id=', metrics)
+        with override_settings(METRICS={'PER_USER_LABELS': True}):
+            metrics = self.client.get('/metrics').content.decode()
+        self.assertIn(f'filevault_user_throughput_bytes_per_second{{user_id="{self.user.id}",direction="download"}}', metrics)
+        self.assertIn(f'filevault_user_active_transfers{{user_id="{self.user.id}",direction="upload"}} 0', metrics)
+
+    def test_global_cap_is_shared_between_users(self):
+        other = User.objects.create_user(username='capped', password='testpass')
+        UserProfile.objects.filter(user=other).update(download_bytes_per_second=100)
+        with override_settings(BANDWIDTH={
+            'PATH': os.path.join(self.media_root, 'bandwidth.state'), 'GLOBAL_DOWNLOAD_BYTES_PER_SECOND': 1000,
+        }):
+            def shares():
+                return {row[0]: row[3] for row in bandwidth.shared_buckets().snapshot() if row[2]}
+
+            capped = bandwidth.shaper_for(User.objects.get(pk=other.pk), bandwidth.DOWNLOAD)
+            unlimited = bandwidth.shaper_for(self.user, bandwidth.DOWNLOAD)
+            self.assertIsNotNone(unlimited)
+            self.assertEqual(shares(), {other.id: 100, self.user.id: 900})
+
+            capped.close()
+            self.assertEqual(shares(), {self.user.id: 1000})
+            unlimited.close()
+            self.assertEqual(shares(), {})
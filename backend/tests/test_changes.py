@@ -0,0 +1,113 @@
+from datetime import timedelta
+from django.test import override_settings
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.core.management import call_command
+from django.urls import reverse
+from django.utils import timezone
+from files.models import File, FileChange, Folder
+from files import changes, folders, trash
+from .base import FileVaultTestCase
+import os
+import time
+
+
+class ChangeFeedTests(FileVaultTestCase):
+    username = 'syncuser'
+
+    def _changes(self, cursor=None, **params):
+        if cursor is not None:
+            params['cursor'] = cursor
+        return self.client.get(reverse('File-changes'), params, HTTP_USERID=str(self.user.id))
+
+    def test_feed_returns_only_events_after_the_cursor(self):
+        self._upload('old.txt', b'before the cursor')
+        cursor = self._changes().data['cursor']
+
+        file_id = self._upload('notes.txt', b'first draft')
+        folders.move_file(File.objects.get(pk=file_id), folders.create_folder(self.user, 'docs'))
+        self.client.post(
+            reverse('File-versions', kwargs={'pk': file_id}),
+            {'file': SimpleUploadedFile('notes.txt', b'second draft', content_type='text/plain')},
+            format='multipart',
+            HTTP_USERID=str(self.user.id)
+        )
+        self.client.delete(reverse('File-detail', kwargs={'pk': file_id}), HTTP_USERID=str(self.user.id))
+        self.client.post(reverse('File-restore', kwargs={'pk': file_id}), HTTP_USERID=str(self.user.id))
+
+        response = self._changes(cursor)
+        self.assertEqual(
+            [event['action'] for event in response.data['changes']],
+            ['created', 'moved', 'updated', 'trashed', 'restored']
+        )
+        self.assertEqual({event['file_id'] for event in response.data['changes']}, {file_id})
+        self.assertEqual(response.data['changes'][-1]['file']['size'], len(b'second draft'))
+        cursor = response.data['cursor']
+        self.assertEqual(self._changes(cursor).data['changes'], [])
+
+        self.client.delete(reverse('File-detail', kwargs={'pk': file_id}) + '?permanent=true', HTTP_USERID=str(self.user.id))
+        trash.reap()
+        events = self._changes(cursor).data['changes']
+        self.assertEqual([(event['action'], event['file']) for event in events], [('trashed', None), ('deleted', None)])
+
+    def test_renames_and_folder_moves_are_in_the_feed(self):
+        docs = folders.create_folder(self.user, 'docs')
+        inner = folders.create_folder(self.user, 'inner', docs)
+        nested = self._upload('nested.txt', b'nested', folder=inner.pk)
+        top = self._upload('top.txt', b'top', folder=docs.pk)
+        outside = self._upload('outside.txt', b'outside')
+        cursor = self._changes().data['cursor']
+
+        response = self.client.patch(
+            reverse('File-detail', kwargs={'pk': outside}), {'original_filename': 'renamed.txt'},
+            format='json', HTTP_USERID=str(self.user.id)
+        )
+        self.assertEqual(response.status_code, 200, response.data)
+        events = self._changes(cursor).data['changes']
+        self.assertEqual([(event['file_id'], event['action']) for event in events], [(outside, 'updated')])
+        self.assertEqual(events[0]['file']['original_filename'], 'renamed.txt')
+        cursor = self._changes(cursor).data['cursor']
+
+        # Renaming or moving a folder relocates every file beneath it
+        folders.move_folder(docs, name='documents')
+        archive = folders.create_folder(self.user, 'archive')
+        inner = folders.move_folder(Folder.objects.get(pk=inner.pk), archive)
+        folders.move_folder(inner, archive)  # Already there, so nothing is recorded
+        events = self._changes(cursor).data['changes']
+        self.assertEqual(
+            sorted((event['file_id'], event['action']) for event in events),
+            sorted([(nested, 'moved'), (top, 'moved'), (nested, 'moved')])
+        )
+
+    def test_long_poll_waits_for_a_change(self):
+        cursor = self._changes().data['cursor']
+        with override_settings(CHANGE_FEED={'POLL_INTERVAL_SECONDS': 0.05}):
+            start = time.monotonic()
+            response = self._changes(cursor, wait=1)
+        self.assertGreaterEqual(time.monotonic() - start, 1)
+        self.assertEqual(response.data, {'changes': [], 'cursor': cursor, 'has_more': False})
+
+        self._upload('late.txt', b'arrived')
+        start = time.monotonic()
+        response = self._changes(cursor, wait=30)
+        self.assertLess(time.monotonic() - start, 1)
+        self.assertEqual([event['action'] for event in response.data['changes']], ['created'])
+
+    def test_compaction_keeps_the_latest_event_per_file(self):
+        kept = self._upload('kept.txt', b'kept')
+        gone = self._upload('gone.txt', b'gone')
+        self.client.delete(reverse('File-detail', kwargs={'pk': kept}), HTTP_USERID=str(self.user.id))
+        self.client.post(reverse('File-restore', kwargs={'pk': kept}), HTTP_USERID=str(self.user.id))
+        self.client.delete(reverse('File-detail', kwargs={'pk': gone}) + '?permanent=true', HTTP_USERID=str(self.user.id))
+        trash.reap()
+        self.assertEqual(FileChange.objects.count(), 6)
+
+        self.assertEqual(changes.compact(batch_size=2), 4)
+        events = self._changes(0).data['changes']
+        self.assertEqual([(event['file_id'], event['action']) for event in events], [(kept, 'restored'), (gone, 'deleted')])
+
+        # Expiring the tombstone invalidates cursors that haven't seen it
+        tombstone = FileChange.objects.get(action=changes.DELETED)
+        FileChange.objects.filter(pk=tombstone.pk).update(created_at=timezone.now() - timedelta(days=31))
+        call_command('compact_changes', stdout=open(os.devnull, 'w'))
+        self.assertEqual(self._changes(tombstone.pk - 1).status_code, 410)
+        self.assertEqual(self._changes(tombstone.pk).data['changes'], [])
@@ -0,0 +1,45 @@
+from django.urls import reverse
+from files.models import File
+from files.cache import ContentCache, content_cache
+from files import trash
+from .base import FileVaultTestCase
+
+
+class ContentCacheTests(FileVaultTestCase):
+    username = 'cacheuser'
+
+    def test_lru_eviction_and_admission(self):
+        """Entries are evicted least-recently-used first and large files are never admitted"""
+        cache = ContentCache(max_bytes=10, max_entry_bytes=4)
+        self.assertTrue(cache.put('a', b'aaaa'))
+        self.assertTrue(cache.put('b', b'bbbb'))
+        self.assertEqual(cache.get('a'), b'aaaa')  # 'a' is now most recently used
+        self.assertTrue(cache.put('c', b'cccc'))  # Over budget, evicts 'b'
+
+        self.assertIsNone(cache.get('b'))
+        self.assertFalse(cache.put('d', b'ddddd'))  # Larger than max_entry_bytes
+
+        stats = cache.stats()
+        self.assertEqual(stats['entries'], 2)
+        self.assertEqual(stats['current_bytes'], 8)
+        self.assertEqual(stats['hits'], 1)
+        self.assertEqual(stats['misses'], 1)
+        self.assertEqual(stats['evictions'], 1)
+
+    def test_download_populates_and_delete_evicts(self):
+        """Downloads fill the cache and deleting the last reference evicts the entry"""
+        content_cache.clear()
+        file_record = File.objects.get(pk=self._upload('icon.txt', b'cached icon bytes'))
+
+        for _ in range(2):
+            response = self.client.get(
+                reverse('File-download', kwargs={'pk': file_record.pk}),
+                HTTP_USERID=str(self.user.id)
+            )
+            self.assertEqual(b''.join(response.streaming_content), b'cached icon bytes')
+        self.assertEqual(content_cache.get(file_record.file_hash), b'cached icon bytes')
+
+        self.client.delete(reverse('File-detail', kwargs={'pk': file_record.pk}) + '?permanent=true', HTTP_USERID=str(self.user.id))
+        with self.captureOnCommitCallbacks(execute=True):
+            trash.reap()
+        self.assertIsNone(content_cache.get(file_record.file_hash))
@@ -0,0 +1,53 @@
+from django.urls import reverse
+from files.models import File, UserFileType, UserProfile
+from files import trash
+from .base import FileVaultTestCase
+
+# Uploads are typed by their content, so images need a real signature
+PNG_HEADER = b'\x89PNG\r\n\x1a\n'
+
+
+class FileTypeCounterTests(FileVaultTestCase):
+    def _file_types(self):
+        return self.client.get(reverse('File-file-types'), HTTP_USERID=str(self.user.id)).data
+
+    def test_counters_follow_uploads_and_deletes(self):
+        first = self._upload('a.txt', b'a' * 10, 'text/plain')
+        self._upload('b.txt', b'b' * 20, 'text/plain')
+        image = self._upload('c.png', PNG_HEADER + b'c' * (30 - len(PNG_HEADER)), 'image/png')
+
+        data = self._file_types()
+        self.assertEqual(data['file_types'], ['image/png', 'text/plain'])
+        self.assertEqual(data['breakdown'][1], {'file_type': 'text/plain', 'file_count': 2, 'total_bytes': 30})
+
+        self.client.delete(reverse('File-detail', kwargs={'pk': first}), HTTP_USERID=str(self.user.id))
+        self.client.delete(reverse('File-detail', kwargs={'pk': image}), HTTP_USERID=str(self.user.id))
+        # Counters and usage follow the purge, not the move to the trash
+        self.assertEqual(self._file_types()['file_types'], ['image/png', 'text/plain'])
+        self.client.delete(reverse('File-trash'), HTTP_USERID=str(self.user.id))
+        trash.reap()
+
+        data = self._file_types()
+        self.assertEqual(data['file_types'], ['text/plain'])
+        counter = UserFileType.objects.get(user=self.user, file_type='text/plain')
+        self.assertEqual((counter.file_count, counter.total_bytes), (1, 20))
+        self.assertEqual(UserProfile.objects.get(user=self.user).current_storage_used, 20)
+
+    def test_listing_types_is_a_single_query(self):
+        self._upload('a.txt', b'a', 'text/plain')
+        with self.assertNumQueries(3):  # Authentication, the throttle's profile lookup, then the counter table
+            self._file_types()
+
+    def test_updates_cannot_rewrite_type_or_size(self):
+        """A PATCH renames the file but leaves the fields the counters are keyed on alone"""
+        file_id = self._upload('a.txt', b'a' * 10, 'text/plain')
+        response = self.client.patch(
+            reverse('File-detail', kwargs={'pk': file_id}),
+            {'original_filename': 'renamed.txt', 'file_type': 'image/png', 'size': 10 ** 9},
+            format='json',
+            HTTP_USERID=str(self.user.id)
+        )
+        self.assertEqual(response.status_code, 200)
+        file_record = File.objects.get(pk=file_id)
+        self.assertEqual((file_record.original_filename, file_record.file_type, file_record.size), ('renamed.txt', 'text/plain', 10))
+        self.assertEqual(self._file_types()['file_types'], ['text/plain'])
@@ -0,0 +1,118 @@
+from django.test.utils import CaptureQueriesContext
+from django.db import connection
+from django.urls import reverse
+from files.models import File, Folder
+from files import folders, trash
+from .base import FileVaultTestCase
+
+
+class FolderTests(FileVaultTestCase):
+    username = 'folderuser'
+
+    def _folder(self, name, parent=None):
+        response = self.client.post(
+            reverse('Folder-list'), {'name': name, 'parent': parent}, format='json', HTTP_USERID=str(self.user.id)
+        )
+        self.assertEqual(response.status_code, 201, response.data)
+        return response.data['id']
+
+    def _patch(self, folder_id, data):
+        return self.client.patch(
+            reverse('Folder-detail', kwargs={'pk': folder_id}), data, format='json', HTTP_USERID=str(self.user.id)
+        )
+
+    def _totals(self, folder_id):
+        folder = Folder.objects.get(pk=folder_id)
+        return folder.file_count, folder.total_bytes
+
+    def test_subtree_totals_follow_uploads_and_purges(self):
+        docs = self._folder('docs')
+        reports = self._folder('reports', docs)
+        self._upload('readme.txt', b'12345', folder=docs)
+        report = self._upload('q1.txt', b'1234567890', folder=reports)
+        self._upload('copy.txt', b'1234567890', folder=reports)
+        self._upload('top.txt', b'top level')
+
+        self.assertEqual(self._totals(docs), (3, 25))
+        self.assertEqual(self._totals(reports), (2, 20))
+        stats = self.client.get(reverse('storage-stats') + f'?folder={docs}', HTTP_USERID=str(self.user.id)).data
+        self.assertEqual(stats['folder']['file_count'], 3)
+        self.assertEqual(stats['folder']['storage_used'], 25)
+
+        children = self.client.get(reverse('Folder-children', kwargs={'pk': docs}), HTTP_USERID=str(self.user.id)).data
+        self.assertEqual([row['name'] for row in children['folders']], ['reports'])
+        self.assertEqual([row['original_filename'] for row in children['files']], ['readme.txt'])
+        top = self.client.get(reverse('File-list') + '?folder=root', HTTP_USERID=str(self.user.id)).data
+        self.assertEqual([row['original_filename'] for row in top], ['top.txt'])
+        # A malformed id doesn't fall back to the top level
+        self.assertEqual(self.client.get(reverse('File-list') + '?folder=abc', HTTP_USERID=str(self.user.id)).data, [])
+        self.assertEqual(self.client.get(reverse('Folder-list') + '?parent=abc', HTTP_USERID=str(self.user.id)).data, [])
+
+        # Trashed files stay counted until they're purged, like the storage charge
+        self.client.delete(reverse('File-detail', kwargs={'pk': report}) + '?permanent=true', HTTP_USERID=str(self.user.id))
+        self.assertEqual(self._totals(docs), (3, 25))
+        trash.reap()
+        self.assertEqual(self._totals(docs), (2, 15))
+        self.assertEqual(self._totals(reports), (1, 10))
+
+    def test_move_is_a_bounded_set_of_updates(self):
+        small = self._folder('small')
+        self._upload('shallow.txt', b'shallow', folder=self._folder('leaf', small))
+        large = self._folder('large')
+        parent = large
+        for depth in range(5):
+            parent = self._folder(f'level-{depth}', parent)
+            for index in range(5):
+                self._folder(f'sibling-{index}', parent)
+        self._upload('deep.txt', b'deep content', folder=parent)
+        target = self._folder('archive')
+
+        def move_queries(folder_id):
+            with CaptureQueriesContext(connection) as queries:
+                response = self._patch(folder_id, {'parent': target})
+            self.assertEqual(response.status_code, 200, response.data)
+            return len(queries)
+
+        self.assertEqual(move_queries(small), move_queries(large))
+        moved = Folder.objects.get(pk=parent)
+        self.assertTrue(moved.path.startswith(f'/{target}/{large}/'))
+        self.assertEqual(moved.depth, 6)
+        self.assertEqual(self._totals(target), (2, len(b'deep content') + len(b'shallow')))
+        self.assertEqual(self._totals(large), (1, len(b'deep content')))
+
+        response = self._patch(target, {'parent': parent})
+        self.assertEqual(response.status_code, 400)
+
+    def test_rename_and_name_conflicts(self):
+        docs = self._folder('docs')
+        self._folder('photos')
+        child = self._folder('child', docs)
+        self._upload('a.txt', b'a', folder=child)
+
+        self.assertEqual(self._patch(docs, {'name': 'photos'}).status_code, 400)
+        response = self._patch(docs, {'name': 'documents'})
+        self.assertEqual(response.data['name'], 'documents')
+        # Paths are made of ids, so renaming leaves the subtree alone
+        self.assertEqual(Folder.objects.get(pk=child).path, f'/{docs}/{child}/')
+
+        response = self.client.delete(reverse('Folder-detail', kwargs={'pk': docs}), HTTP_USERID=str(self.user.id))
+        self.assertEqual(response.status_code, 409)
+
+    def test_moving_files_and_deleting_folders(self):
+        docs = self._folder('docs')
+        inbox = self._folder('inbox', docs)
+        file_id = self._upload('note.txt', b'note', folder=inbox)
+
+        response = self.client.post(
+            reverse('File-move', kwargs={'pk': file_id}), {'folder': None}, format='json', HTTP_USERID=str(self.user.id)
+        )
+        self.assertIsNone(response.data['folder'])
+        self.assertEqual(self._totals(docs), (0, 0))
+
+        folders.move_file(File.objects.get(pk=file_id), Folder.objects.get(pk=inbox))
+        self.client.delete(reverse('File-detail', kwargs={'pk': file_id}), HTTP_USERID=str(self.user.id))
+        response = self.client.delete(reverse('Folder-detail', kwargs={'pk': inbox}), HTTP_USERID=str(self.user.id))
+        self.assertEqual(response.status_code, 204)
+        # The trashed file falls back to the top level and out of the ancestors' totals
+        self.assertEqual(self._totals(docs), (0, 0))
+        self.assertIsNone(File.objects.get(pk=file_id).folder_id)
@@ -0,0 +1,46 @@
+from django.test import SimpleTestCase
+from files import hashing
+import hashlib
+import io
+import os
+import shutil
+import tempfile
+
+
+class HashingServiceTests(SimpleTestCase):
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.tmpdir, ignore_errors=True)
+
+    def _write(self, name, content):
+        path = os.path.join(self.tmpdir, name)
+        with open(path, 'wb') as f:
+            f.write(content)
+        return path
+
+    def test_hash_many_matches_sha256(self):
+        """Concurrent hashing gives the same digests as hashlib, including empty and missing files"""
+        contents = {f'file{i}.bin': os.urandom(1000 * i) for i in range(5)}
+        paths = {self._write(name, content): content for name, content in contents.items()}
+        missing = os.path.join(self.tmpdir, 'missing.bin')
+
+        digests = hashing.hash_many(list(paths) + [missing], workers=4)
+        for path, content in paths.items():
+            self.assertEqual(digests[path], hashlib.sha256(content).hexdigest())
+        self.assertIsNone(digests[missing])
+
+        self.assertEqual(hashing.sha256_fileobj(io.BytesIO(b'abc')), hashlib.sha256(b'abc').hexdigest())
+
+    def test_find_duplicates(self):
+        """Only files with identical content are grouped, even when size and head/tail match"""
+        a = self._write('a.bin', b'x' * 200000)
+        b = self._write('b.bin', b'x' * 200000)
+        # Same size and same head/tail samples, different middle
+        c = self._write('c.bin', b'x' * 100000 + b'y' + b'x' * 99999)
+        self._write('d.bin', b'unique')
+
+        groups = hashing.find_duplicates([a, b, c, os.path.join(self.tmpdir, 'd.bin')])
+        self.assertEqual(len(groups), 1)
+        self.assertEqual(sorted(groups[hashlib.sha256(b'x' * 200000).hexdigest()]), sorted([a, b]))
@@ -0,0 +1,59 @@
+from django.core.management import call_command
+from files.models import File, FileChange, UserFileType, UserProfile
+from io import StringIO
+from .base import FileVaultTestCase
+import os
+import shutil
+import tempfile
+
+
+class ImportTreeCommandTests(FileVaultTestCase):
+    username = 'importer'
+
+    def setUp(self):
+        super().setUp()
+        self.source = tempfile.mkdtemp()
+        self.journal = os.path.join(self.media_root, 'import.journal')
+
+        os.makedirs(os.path.join(self.source, 'docs', 'old'))
+        for relpath, content in [
+            ('readme.txt', b'hello'),
+            ('docs/report.txt', b'quarterly numbers'),
+            ('docs/old/report-copy.txt', b'quarterly numbers'),
+        ]:
+            with open(os.path.join(self.source, relpath), 'wb') as f:
+                f.write(content)
+
+    def tearDown(self):
+        shutil.rmtree(self.source, ignore_errors=True)
+        super().tearDown()
+
+    def _run(self):
+        out = StringIO()
+        call_command('import_tree', self.source, user=self.user.pk, workers=2, journal=self.journal, stdout=out)
+        return out.getvalue()
+
+    def test_import_dedups_and_resumes(self):
+        """Files are imported with upload dedup semantics, and a rerun imports nothing new"""
+        output = self._run()
+        self.assertIn('files/s', output)
+
+        files = File.objects.filter(owner=self.user)
+        self.assertEqual(files.count(), 3)
+        self.assertEqual(files.filter(is_duplicate=True).count(), 1)
+        duplicate = files.get(is_duplicate=True)
+        self.assertFalse(duplicate.original_file_ref.is_duplicate)
+        self.assertTrue(os.path.isfile(duplicate.original_file_ref.file.path))
+        self.assertEqual(set(files.values_list('original_filename', flat=True)),
+                         {'readme.txt', 'docs/report.txt', 'docs/old/report-copy.txt'})
+
+        # Only unique content is charged, once per batch
+        profile = UserProfile.objects.get(user=self.user)
+        self.assertEqual(profile.current_storage_used, len(b'hello') + len(b'quarterly numbers'))
+        self.assertEqual(
+            UserFileType.objects.get(user=self.user, file_type='text/plain').file_count, 3
+        )
+        self.assertEqual(FileChange.objects.filter(owner=self.user, action='created').count(), 3)
+
+        self._run()
+        self.assertEqual(File.objects.filter(owner=self.user).count(), 3)
@@ -0,0 +1,70 @@
+from django.test import override_settings
+from django.core.files.uploadhandler import StopUpload
+from files.models import File, UserProfile
+from files import inspection
+from .base import FileVaultTestCase
+import hashlib
+import os
+
+PNG_HEADER = b'\x89PNG\r\n\x1a\n'
+
+
+class UploadInspectionTests(FileVaultTestCase):
+    username = 'inspected'
+
+    def test_type_and_extension_come_from_the_content(self):
+        response = self._upload_response('notes.txt', PNG_HEADER + b'\x00' * 100, 'text/plain')
+        self.assertEqual(response.status_code, 201)
+        record = File.objects.get(pk=response.data['id'])
+        self.assertEqual(record.file_type, 'image/png')
+        self.assertTrue(record.file.name.endswith('.png'))
+        self.assertEqual(record.file_hash, hashlib.sha256(PNG_HEADER + b'\x00' * 100).hexdigest())
+
+        response = self._upload_response('photo.png', b'just some text', 'image/png')
+        self.assertEqual(File.objects.get(pk=response.data['id']).file_type, 'text/plain')
+
+    def test_claims_the_content_cannot_contradict_are_kept(self):
+        docx = 'application/vnd.openxmlformats-officedocument.wordprocessingml.document'
+        cases = [
+            (b'PK\x03\x04' + b'\x00' * 50, docx, docx),
+            (b'a,b\n1,2\n', 'text/csv', 'text/csv'),
+            (b'\x00\x01\x02custom', 'application/x-custom', 'application/x-custom'),
+            (b'\x00\x01\x02jpeg?', 'image/jpeg', 'application/octet-stream'),
+            ('caf\xe9,na\xefve\n'.encode('latin-1'), 'text/csv', 'text/csv'),
+            ('\u3053\u3093\u306b\u3061\u306f\n'.encode('shift_jis'), 'text/plain', 'text/plain'),
+            (b'\x00\xe9\xff\x01', 'text/plain', 'application/octet-stream'),
+        ]
+        for content, claimed, expected in cases:
+            with self.subTest(claimed=claimed):
+                response = self._upload_response('file', content, claimed)
+                self.assertEqual(File.objects.get(pk=response.data['id']).file_type, expected)
+
+    def test_upload_over_quota_is_stopped_while_received(self):
+        UserProfile.objects.filter(user=self.user).update(storage_limit_mb=1, current_storage_used=1024 * 1024 - 1000)
+        response = self._upload_response('big.bin', b'x' * (4 * 1024 * 1024), 'application/octet-stream')
+        self.assertEqual(response.status_code, 429)
+        self.assertFalse(File.objects.exists())
+
+        handler = inspection.InspectingUploadHandler(limit_bytes=100)
+        handler.new_file('file', 'big.bin', 'application/octet-stream', None)
+        handler.receive_data_chunk(b'x' * 60, 0)
+        with self.assertRaises(StopUpload):
+            handler.receive_data_chunk(b'x' * 60, 60)
+        self.assertEqual(handler.rejection.reason, 'quota')
+
+    def test_signature_split_across_chunks_is_rejected(self):
+        with override_settings(UPLOAD_INSPECTION={'INSPECTORS': ['files.inspection.SignatureScanner']}):
+            handler = inspection.InspectingUploadHandler()
+            handler.new_file('file', 'eicar.com', 'application/octet-stream', None)
+            handler.receive_data_chunk(b'x' * 1000 + inspection.EICAR[:30], 0)
+            with self.assertRaises(StopUpload):
+                handler.receive_data_chunk(inspection.EICAR[30:] + b'y' * 1000, 1030)
+            self.assertEqual(handler.rejection.reason, 'signature')
+
+            response = self._upload_response('eicar.com', inspection.EICAR, 'application/octet-stream')
+            self.assertEqual(response.status_code, 422)
+            self.assertIn('Eicar-Test-Signature', response.data['error'])
+            self.assertEqual(self._upload_response('clean.txt', b'clean', 'text/plain').status_code, 201)
+        self.assertEqual(os.listdir(os.path.join(self.media_root, 'uploads')), [
+            File.objects.get().file.name.split('/')[-1]
+        ])
@@ -0,0 +1,69 @@
+from django.test import override_settings
+from django.urls import reverse
+from files import metrics
+from .base import FileVaultTestCase
+import json
+import os
+import subprocess
+
+
+class MetricsTests(FileVaultTestCase):
+    username = 'metricsuser'
+
+    def test_histogram_rendering(self):
+        """Histograms render cumulative buckets with sum and count"""
+        histogram = metrics.Histogram('test_latency_seconds', 'Test histogram', ['op'], buckets=(0.1, 1.0),
+                                      collector_registry=metrics.Registry())
+        histogram.observe(0.05, ('read',))
+        histogram.observe(0.5, ('read',))
+        histogram.observe(5, ('read',))
+        lines = histogram.render()
+        self.assertIn('test_latency_seconds_bucket{op="read",le="0.1"} 1', lines)
+        self.assertIn('test_latency_seconds_bucket{op="read",le="1.0"} 2', lines)
+        self.assertIn('test_latency_seconds_bucket{op="read",le="+Inf"} 3', lines)
+        self.assertIn('test_latency_seconds_count{op="read"} 3', lines)
+
+    def test_metrics_endpoint(self):
+        """Requests and spans show up at /metrics in Prometheus text format"""
+        self._upload('metrics.txt', b'instrumented')
+        self.client.get(reverse('File-list'), HTTP_USERID=str(self.user.id))
+
+        response = self.client.get('/metrics')
+        self.assertEqual(response.status_code, 200)
+        self.assertTrue(response['Content-Type'].startswith('text/plain; version=0.0.4'))
+        body = response.content.decode()
+        self.assertIn('filevault_request_duration_seconds_count{view="File-list",method="GET",status="200"}', body)
+        self.assertIn('filevault_request_db_queries_count{view="File-list"}', body)
+        for span in ('inspect', 'disk_write', 'serialize', 'throttle', 'db'):
+            self.assertIn(f'filevault_span_duration_seconds_count{{span="{span}"}}', body)
+        self.assertIn('filevault_content_cache_hits_total', body)
+
+    def test_scrapes_merge_every_worker(self):
+        """With MULTIPROCESS_DIR, counters add up across processes and dead processes' gauges drop out"""
+        directory = os.path.join(self.media_root, 'metrics')
+        exited = subprocess.Popen(['true'])
+        exited.wait()
+        os.makedirs(directory)
+        with open(os.path.join(directory, f'{exited.pid}-other.json'), 'w') as f:
+            json.dump({'pid': exited.pid, 'metrics': {
+                'filevault_uploaded_bytes_total': [[[], 1000]],
+                'filevault_content_cache_entries': [[[], 7]],
+            }}, f)
+
+        with override_settings(METRICS={'ENABLED': True, 'MULTIPROCESS_DIR': directory}):
+            own = metrics.UPLOADED_BYTES.values().get((), 0)
+            body = self.client.get('/metrics').content.decode()
+            self.assertEqual(len(os.listdir(directory)), 2)
+        self.assertIn(f'filevault_uploaded_bytes_total {own + 1000}', body)
+        self.assertNotIn('filevault_content_cache_entries 7', body)
+
+    @override_settings(METRICS={'ENABLED': True, 'SLOW_REQUEST_MS': 0})
+    def test_slow_request_log(self):
+        """Requests over the threshold are logged with their query count"""
+        with self.assertLogs('files.metrics', level='WARNING') as logs:
+            self.client.get(reverse('File-list'), HTTP_USERID=str(self.user.id))
+        self.assertIn('Slow request: GET /api/files/', logs.output[0])
+
+    @override_settings(METRICS={'ENABLED': False})
+    def test_disabled(self):
+        self.assertEqual(self.client.get('/metrics').status_code, 404)
@@ -0,0 +1,121 @@
+from django.test import override_settings
+from django.urls import reverse
+from files.models import File
+from files import previews
+from unittest import mock
+from .base import FileVaultTestCase
+import json
+import threading
+import time
+
+
+class PreviewTests(FileVaultTestCase):
+    settings_overrides = {}
+
+    def test_text_preview_is_shared_by_duplicates_and_cacheable(self):
+        """Duplicates share one artifact, served with a short max-age and ETag revalidation"""
+        content = b''.join(f'line {i}\n'.encode() for i in range(100))
+        original_id = self._upload('log.txt', content, 'text/plain')
+        duplicate_id = self._upload('log-copy.txt', content, 'text/plain')
+
+        url = reverse('File-preview', kwargs={'pk': duplicate_id})
+        response = self.client.get(url, HTTP_USERID=str(self.user.id))
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response['Cache-Control'], 'private, max-age=60')
+        lines = b''.join(response.streaming_content).decode().splitlines()
+        self.assertEqual(len(lines), 50)
+        self.assertEqual(lines[0], 'line 0')
+        response.close()
+
+        original = File.objects.get(pk=original_id)
+        response = self.client.get(
+            reverse('File-preview', kwargs={'pk': original_id}),
+            HTTP_USERID=str(self.user.id),
+            HTTP_IF_NONE_MATCH=response['ETag'],
+        )
+        self.assertEqual(response.status_code, 304)
+
+        response = self.client.get(url, {'kind': 'metadata'}, HTTP_USERID=str(self.user.id))
+        metadata = json.loads(b''.join(response.streaming_content))
+        self.assertEqual(metadata['file_hash'], original.file_hash)
+        response.close()
+
+    def test_thumbnail_unavailable_for_text(self):
+        file_id = self._upload('notes.txt', b'hello', 'text/plain')
+        response = self.client.get(
+            reverse('File-preview', kwargs={'pk': file_id}),
+            {'kind': 'thumbnail', 'size': 256},
+            HTTP_USERID=str(self.user.id)
+        )
+        self.assertEqual(response.status_code, 404)
+
+    def test_concurrent_requests_generate_once(self):
+        """Concurrent first requests for an artifact share a single generation"""
+        file_record = File.objects.get(pk=self._upload('shared.txt', b'shared content\n', 'text/plain'))
+        calls = []
+        real_generate = previews._generate
+
+        def slow_generate(*args):
+            calls.append(args)
+            time.sleep(0.2)
+            real_generate(*args)
+
+        results = []
+        with mock.patch.object(previews, '_generate', side_effect=slow_generate):
+            threads = [
+                threading.Thread(target=lambda: results.append(previews.get_artifact(file_record, previews.KIND_TEXT)))
+                for _ in range(5)
+            ]
+            for thread in threads:
+                thread.start()
+            for thread in threads:
+                thread.join()
+
+        self.assertEqual(len(calls), 1)
+        self.assertEqual(len(set(results)), 1)
+
+    def test_image_thumbnail(self):
+        """Image thumbnails fit the requested bounding box (skipped without Pillow)"""
+        Image = previews._load_pillow()
+        if Image is None:
+            self.skipTest('Pillow is not installed')
+        from io import BytesIO
+        buffer = BytesIO()
+        Image.new('RGB', (800, 400), 'red').save(buffer, 'PNG')
+        file_id = self._upload('photo.png', buffer.getvalue(), 'image/png')
+
+        response = self.client.get(
+            reverse('File-preview', kwargs={'pk': file_id}),
+            {'size': 64},
+            HTTP_USERID=str(self.user.id)
+        )
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response['Content-Type'], 'image/jpeg')
+        thumbnail = Image.open(BytesIO(b''.join(response.streaming_content)))
+        self.assertEqual(thumbnail.size, (64, 32))
+        response.close()
+
+    def test_oversized_image_has_no_thumbnail(self):
+        """Images over Pillow's pixel limit get a 404 rather than a server error"""
+        Image = previews._load_pillow()
+        if Image is None:
+            self.skipTest('Pillow is not installed')
+        from io import BytesIO
+        buffer = BytesIO()
+        Image.new('RGB', (200, 200), 'blue').save(buffer, 'PNG')
+        with override_settings(PREVIEWS={'EAGER': False}):
+            file_id = self._upload('bomb.png', buffer.getvalue(), 'image/png')
+
+        with mock.patch.object(Image, 'MAX_IMAGE_PIXELS', 1000):
+            response = self.client.get(
+                reverse('File-preview', kwargs={'pk': file_id}),
+                {'size': 64},
+                HTTP_USERID=str(self.user.id)
+            )
+            self.assertEqual(response.status_code, 404)
+            response = self.client.get(
+                reverse('File-preview', kwargs={'pk': file_id}), {'kind': 'metadata'}, HTTP_USERID=str(self.user.id)
+            )
+        metadata = json.loads(b''.join(response.streaming_content))
+        self.assertNotIn('image', metadata)
+        response.close()
@@ -0,0 +1,37 @@
+from django.test import TestCase, override_settings
+from django.core.management import call_command
+from files.models import File, FileChange, UserProfile
+from io import StringIO
+import json
+import os
+import shutil
+import tempfile
+
+
+class SeedBenchmarkCommandTests(TestCase):
+    def setUp(self):
+        self.media_root = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.media_root, ignore_errors=True)
+
+    def test_seed_respects_dup_ratio(self):
+        """Seeded data respects the duplicate ratio and keeps profile counters in sync"""
+        manifest = os.path.join(self.media_root, 'manifest.json')
+        with override_settings(MEDIA_ROOT=self.media_root):
+            call_command('seed_benchmark', users=2, files=100, dup_ratio=0.5, size_mix='small',
+                         manifest=manifest, stdout=StringIO())
+
+        files = File.objects.all()
+        self.assertEqual(files.count(), 100)
+        duplicates = files.filter(is_duplicate=True).count()
+        self.assertTrue(30 <= duplicates <= 70, duplicates)
+        self.assertEqual(FileChange.objects.filter(action='created').count(), 100)
+
+        for profile in UserProfile.objects.filter(user__username__startswith='bench-42-'):
+            originals = files.filter(owner=profile.user, is_duplicate=False)
+            self.assertEqual(profile.current_storage_used, sum(originals.values_list('size', flat=True)))
+            self.assertTrue(all(os.path.isfile(os.path.join(self.media_root, f.file.name)) for f in originals))
+
+        with open(manifest) as f:
+            self.assertEqual(len(json.load(f)['users']), 2)
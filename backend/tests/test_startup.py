@@ -0,0 +1,39 @@
+from django.conf import settings
+from django.core.management import call_command
+from django.test import TestCase
+import json
+import os
+import subprocess
+import sys
+
+
+class StartupTests(TestCase):
+    def test_migrations_are_up_to_date(self):
+        # Containers no longer run makemigrations on start, so model changes must ship a migration
+        try:
+            call_command('makemigrations', '--check', '--dry-run', verbosity=0)
+        except SystemExit:
+            self.fail('Models have changes that are not reflected in a migration')
+
+    def test_api_profile_defers_views_until_the_wsgi_entry_point(self):
+        code = (
+            "import json, sys, django; django.setup(); "
+            "before = sorted(name for name in ('files.views', 'files.serializers', 'rest_framework.viewsets') if name in sys.modules); "
+            "import core.wsgi; from django.urls import resolve; from django.conf import settings; "
+            "print(json.dumps({'before': before, 'after': 'files.views' in sys.modules, "
+            "'apps': settings.INSTALLED_APPS, 'info': resolve('/api/info/').url_name, "
+            "'media': resolve(settings.MEDIA_URL + 'uploads/a.txt').func.__name__}))"
+        )
+        result = subprocess.run(
+            [sys.executable, '-c', code], cwd=settings.BASE_DIR, check=True, capture_output=True, text=True,
+            env=dict(os.environ, DJANGO_SETTINGS_MODULE='core.settings_api', DJANGO_DEBUG='True'),
+        )
+        report = json.loads(result.stdout.strip().splitlines()[-1])
+
+        self.assertEqual(report['before'], [])
+        self.assertTrue(report['after'])
+        self.assertNotIn('django.contrib.admin', report['apps'])
+        self.assertNotIn('django.contrib.sessions', report['apps'])
+        self.assertEqual(report['info'], 'api-root')
+        # FileSerializer links to the media files, so the API profile serves them too
+        self.assertEqual(report['media'], 'serve')
@@ -0,0 +1,45 @@
+from django.test import SimpleTestCase
+from django.urls import reverse
+from files.models import File
+from files.streaming import parse_range, RangeNotSatisfiable
+from .base import FileVaultTestCase
+import hashlib
+
+
+class ParseRangeTests(SimpleTestCase):
+    def test_parse_range(self):
+        """Single byte ranges are parsed, anything else falls back to a full response"""
+        self.assertEqual(parse_range('bytes=0-9', 100), (0, 9))
+        self.assertEqual(parse_range('bytes=90-', 100), (90, 99))
+        self.assertEqual(parse_range('bytes=-10', 100), (90, 99))
+        self.assertEqual(parse_range('bytes=95-200', 100), (95, 99))
+        self.assertIsNone(parse_range(None, 100))
+        self.assertIsNone(parse_range('bytes=0-1,5-6', 100))
+        with self.assertRaises(RangeNotSatisfiable):
+            parse_range('bytes=100-', 100)
+
+
+class RangeDownloadTests(FileVaultTestCase):
+    username = 'rangeuser'
+
+    def setUp(self):
+        super().setUp()
+        self.content = bytes(range(256)) * 4
+        self.file_record = File.objects.get(pk=self._upload('blob.bin', self.content, 'application/octet-stream'))
+
+    def test_hash_matches_content(self):
+        """The mmap-based hash matches a plain SHA-256 of the content"""
+        self.assertEqual(self.file_record.calculate_file_hash(), hashlib.sha256(self.content).hexdigest())
+
+    def test_range_request(self):
+        """Range requests return 206 with just the requested bytes"""
+        url = reverse('File-download', kwargs={'pk': self.file_record.pk})
+        response = self.client.get(url, HTTP_USERID=str(self.user.id), HTTP_RANGE='bytes=10-19')
+        self.assertEqual(response.status_code, 206)
+        self.assertEqual(response['Content-Range'], f'bytes 10-19/{len(self.content)}')
+        self.assertEqual(response['Content-Length'], '10')
+        self.assertEqual(b''.join(response.streaming_content), self.content[10:20])
+        response.close()
+
+        response = self.client.get(url, HTTP_USERID=str(self.user.id), HTTP_RANGE='bytes=5000-')
+        self.assertEqual(response.status_code, 416)
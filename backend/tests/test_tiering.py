@@ -0,0 +1,108 @@
+from django.urls import reverse
+from files.models import File
+from files import tiering
+from files.cache import content_cache
+from .base import FileVaultTestCase
+import os
+from concurrent.futures import ThreadPoolExecutor
+
+
+class StorageTieringTests(FileVaultTestCase):
+    username = 'tieruser'
+
+    def get_settings_overrides(self):
+        return {
+            **self.settings_overrides,
+            'STORAGE_TIERING': {
+                'COLD_ROOT': os.path.join(self.media_root, 'cold'), 'COLD_TIER': 'archive', 'COLD_AFTER_DAYS': 0,
+            },
+        }
+
+    def setUp(self):
+        super().setUp()
+        content_cache.clear()
+
+    def test_demote_and_promote_on_download(self):
+        """Cold blobs are archived by the policy and promoted back when downloaded"""
+        file_record = File.objects.get(pk=self._upload('cold.txt', b'rarely read content'))
+        hot_path = file_record.file.path
+
+        moved_files, moved_bytes = tiering.apply_policy()
+        self.assertEqual(moved_files, 1)
+        self.assertEqual(moved_bytes, file_record.size)
+        file_record.refresh_from_db()
+        self.assertEqual(file_record.storage_tier, tiering.TIER_ARCHIVE)
+        self.assertFalse(os.path.exists(hot_path))
+
+        response = self.client.get(
+            reverse('File-download', kwargs={'pk': file_record.pk}),
+            HTTP_USERID=str(self.user.id)
+        )
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(b''.join(response.streaming_content), b'rarely read content')
+        response.close()
+
+        file_record.refresh_from_db()
+        self.assertEqual(file_record.storage_tier, tiering.TIER_HOT)
+        self.assertTrue(os.path.exists(hot_path))
+
+    def test_promote_keeps_the_tier_when_the_cold_blob_is_missing(self):
+        """A record is only marked hot once its blob is back on the hot tier"""
+        file_record = File.objects.get(pk=self._upload('lost.txt', b'gone missing'))
+        tiering.demote(file_record)
+        os.remove(tiering.blob_path(file_record))
+
+        with self.assertLogs('files.tiering', 'WARNING'):
+            self.assertFalse(tiering.promote(file_record))
+            response = self.client.get(
+                reverse('File-download', kwargs={'pk': file_record.pk}),
+                HTTP_USERID=str(self.user.id)
+            )
+        self.assertEqual(response.status_code, 404)
+        file_record.refresh_from_db()
+        self.assertEqual(file_record.storage_tier, tiering.TIER_ARCHIVE)
+
+    def test_concurrent_moves_of_one_blob(self):
+        """Movers racing on the same blob all succeed, and the last one finds it already moved"""
+        file_record = File.objects.get(pk=self._upload('raced.txt', b'read by many at once'))
+        tiering.demote(file_record)
+        src = tiering.blob_path(file_record)
+        dst = file_record.file.path
+
+        def move():
+            tiering._move_blob(src, dst, decompress=True)
+
+        with ThreadPoolExecutor(max_workers=4) as executor:
+            for future in [executor.submit(move) for _ in range(4)]:
+                future.result()
+        with open(dst, 'rb') as f:
+            self.assertEqual(f.read(), b'read by many at once')
+        self.assertFalse(os.path.exists(src))
+        self.assertEqual([name for name in os.listdir(os.path.dirname(dst)) if name.endswith('.partial')], [])
+
+    def test_access_statistics_are_batched(self):
+        """Hits are buffered in memory and written on flush"""
+        file_record = File.objects.get(pk=self._upload('hot.txt', b'popular content'))
+
+        recorder = tiering.AccessRecorder()
+        for _ in range(3):
+            recorder.record(file_record)
+        file_record.refresh_from_db()
+        self.assertEqual(file_record.access_count, 0)
+
+        self.assertEqual(recorder.flush(), 1)
+        file_record.refresh_from_db()
+        self.assertEqual(file_record.access_count, 3)
+        self.assertIsNotNone(file_record.last_accessed_at)
+        recorder.stop()
+
+    def test_storage_stats_reports_tiers(self):
+        """storage_stats includes per-tier usage and hot tier capacity"""
+        file_record = File.objects.get(pk=self._upload('stats.txt', b'some bytes'))
+        tiering.demote(file_record)
+
+        response = self.client.get('/api/storage_stats/', HTTP_USERID=str(self.user.id))
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.data['hot_storage_used'], 0)
+        self.assertEqual(response.data['cold_storage_used'], file_record.size)
+        self.assertIn('free', response.data['hot_tier_capacity'])
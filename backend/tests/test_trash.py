@@ -0,0 +1,108 @@
+from datetime import timedelta
+from django.test.utils import CaptureQueriesContext
+from django.core.management import call_command
+from django.db import connection
+from django.urls import reverse
+from django.utils import timezone
+from files.models import File, UserProfile
+from files import trash
+from unittest import mock
+from .base import FileVaultTestCase
+import os
+
+
+class TrashTests(FileVaultTestCase):
+    def _add_references(self, original_id, count):
+        original = File.objects.get(pk=original_id)
+        File.objects.bulk_create([
+            File(original_filename=f'copy-{index}.txt', file_type=original.file_type, size=original.size,
+                 file_hash=original.file_hash, owner=self.user, is_duplicate=True, original_file_ref=original)
+            for index in range(count)
+        ])
+
+    def _delete(self, file_id):
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.delete(reverse('File-detail', kwargs={'pk': file_id}), HTTP_USERID=str(self.user.id))
+        self.assertEqual(response.status_code, 204)
+        return len(queries)
+
+    def _usage(self):
+        return UserProfile.objects.get(user=self.user).current_storage_used
+
+    def test_delete_cost_does_not_depend_on_references(self):
+        few = self._upload('few.txt', b'few references')
+        many = self._upload('many.txt', b'many references')
+        self._add_references(few, 1)
+        self._add_references(many, 500)
+
+        self.assertEqual(self._delete(few), self._delete(many))
+        self.assertEqual(File.objects.filter(original_file_ref=many).count(), 500)
+
+    def test_trashed_files_are_hidden_until_restored(self):
+        file_id = self._upload('notes.txt', b'restorable')
+        self._delete(file_id)
+
+        listed = self.client.get(reverse('File-list'), HTTP_USERID=str(self.user.id)).data
+        self.assertEqual(listed, [])
+        download = self.client.get(reverse('File-download', kwargs={'pk': file_id}), HTTP_USERID=str(self.user.id))
+        self.assertEqual(download.status_code, 404)
+        trashed = self.client.get(reverse('File-trash'), HTTP_USERID=str(self.user.id)).data
+        self.assertEqual([row['id'] for row in trashed], [file_id])
+        self.assertEqual(self._usage(), len(b'restorable'))
+
+        response = self.client.post(reverse('File-restore', kwargs={'pk': file_id}), HTTP_USERID=str(self.user.id))
+        self.assertIsNone(response.data['deleted_at'])
+        download = self.client.get(reverse('File-download', kwargs={'pk': file_id}), HTTP_USERID=str(self.user.id))
+        self.assertEqual(b''.join(download.streaming_content), b'restorable')
+
+    def test_reaper_hands_the_blob_to_a_surviving_reference(self):
+        original = self._upload('original.txt', b'shared content')
+        copy = self._upload('copy.txt', b'shared content')
+        path = File.objects.get(pk=original).file.path
+        self._delete(original)
+
+        # Not due until the retention period has passed
+        self.assertEqual(trash.reap(), (0, 0))
+        self.assertEqual(trash.reap(now=timezone.now() + timedelta(days=31)), (1, 0))
+
+        heir = File.objects.get(pk=copy)
+        self.assertFalse(heir.is_duplicate)
+        self.assertEqual(heir.file.path, path)
+        self.assertEqual(self._usage(), len(b'shared content'))
+        download = self.client.get(reverse('File-download', kwargs={'pk': copy}), HTTP_USERID=str(self.user.id))
+        self.assertEqual(b''.join(download.streaming_content), b'shared content')
+
+        self.client.delete(reverse('File-detail', kwargs={'pk': copy}) + '?permanent=true', HTTP_USERID=str(self.user.id))
+        with self.captureOnCommitCallbacks(execute=True):
+            self.assertEqual(trash.reap(), (1, len(b'shared content')))
+        self.assertFalse(os.path.exists(path))
+        self.assertEqual(self._usage(), 0)
+
+    def test_reaper_works_in_bounded_batches(self):
+        for index in range(5):
+            self._delete(self._upload(f'{index}.txt', f'content {index}'.encode()))
+        self.client.delete(reverse('File-trash'), HTTP_USERID=str(self.user.id))
+
+        self.assertEqual(trash.reap(batch_size=2)[0], 2)
+        self.assertEqual(File.objects.count(), 3)
+        call_command('reap_trash', '--batch-size', '2', stdout=open(os.devnull, 'w'))
+        self.assertFalse(File.objects.exists())
+        self.assertEqual(self._usage(), 0)
+
+    def test_failed_purge_keeps_the_file_and_its_charge(self):
+        file_id = self._upload('kept.txt', b'still charged')
+        self._delete(file_id)
+        self.client.delete(reverse('File-trash'), HTTP_USERID=str(self.user.id))
+
+        path = File.objects.get(pk=file_id).file.path
+        with mock.patch('files.counters.charge_storage', side_effect=RuntimeError('database locked')), \
+                self.assertLogs('files.trash', 'ERROR'), self.captureOnCommitCallbacks(execute=True):
+            self.assertEqual(trash.reap(), (0, 0))
+        self.assertTrue(File.objects.filter(pk=file_id).exists())
+        self.assertTrue(os.path.exists(path))
+        self.assertEqual(self._usage(), len(b'still charged'))
+
+        with self.captureOnCommitCallbacks(execute=True):
+            self.assertEqual(trash.reap(), (1, len(b'still charged')))
+        self.assertFalse(os.path.exists(path))
+        self.assertEqual(self._usage(), 0)
@@ -0,0 +1,177 @@
+from django.test import TestCase, override_settings
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.urls import reverse
+from files.models import File, FileVersion, UserProfile
+from files import delta, trash, versioning
+from .base import FileVaultTestCase
+import io
+import os
+import random
+
+BINARY = 'application/octet-stream'
+
+
+def edited(content, rng, edits=3):
+    """Return content with a few small insertions, deletions and overwrites."""
+    data = bytearray(content)
+    for _ in range(edits):
+        position = rng.randrange(len(data))
+        choice = rng.randrange(3)
+        if choice == 0:
+            data[position:position] = rng.randbytes(rng.randint(1, 200))
+        elif choice == 1:
+            del data[position:position + rng.randint(1, 200)]
+        else:
+            data[position:position + 50] = rng.randbytes(50)
+    return bytes(data)
+
+
+class DeltaTests(TestCase):
+    def test_round_trip_after_edits(self):
+        """A delta of an edited file rebuilds it exactly and is much smaller"""
+        rng = random.Random(1)
+        base = rng.randbytes(200 * 1024)
+        target = edited(base, rng)
+
+        data = delta.encode(target, base)
+        rebuilt = b''.join(delta.patch_stream(data, io.BytesIO(base), chunk_size=4096))
+        self.assertEqual(rebuilt, target)
+        self.assertEqual(delta.target_size(data), len(target))
+        self.assertLess(len(data), len(target) // 20)
+
+    def test_unrelated_content_is_not_worth_a_delta(self):
+        rng = random.Random(2)
+        with self.assertRaises(delta.DeltaNotWorthwhile):
+            delta.encode(rng.randbytes(64 * 1024), rng.randbytes(64 * 1024))
+
+
+class VersioningTests(FileVaultTestCase):
+    def setUp(self):
+        super().setUp()
+        UserProfile.objects.filter(user=self.user).update(storage_limit_mb=100)
+        self.rng = random.Random(3)
+
+    def _upload_version(self, file_id, content, name='doc.bin'):
+        return self.client.post(
+            reverse('File-versions', kwargs={'pk': file_id}),
+            {'file': SimpleUploadedFile(name, content, content_type='application/octet-stream')},
+            format='multipart',
+            HTTP_USERID=str(self.user.id)
+        )
+
+    def _download_version(self, file_id, number):
+        response = self.client.get(
+            reverse('File-version-download', kwargs={'pk': file_id, 'number': number}),
+            HTTP_USERID=str(self.user.id)
+        )
+        self.assertEqual(response.status_code, 200)
+        content = b''.join(response.streaming_content)
+        response.close()
+        return content
+
+    def test_versions_are_rebuilt_from_deltas(self):
+        """Older versions are stored as small deltas and read back byte for byte"""
+        contents = [self.rng.randbytes(100 * 1024)]
+        file_id = self._upload('doc.bin', contents[0], BINARY)
+        for _ in range(3):
+            contents.append(edited(contents[-1], self.rng))
+            response = self._upload_version(file_id, contents[-1])
+            self.assertEqual(response.status_code, 201)
+        self.assertEqual(response.data['version'], 4)
+
+        response = self.client.get(reverse('File-versions', kwargs={'pk': file_id}), HTTP_USERID=str(self.user.id))
+        self.assertEqual(response.data['current_version'], 4)
+        self.assertEqual([v['number'] for v in response.data['versions']], [3, 2, 1])
+        self.assertFalse(any(v['is_keyframe'] for v in response.data['versions']))
+
+        for number, content in enumerate(contents, start=1):
+            self.assertEqual(self._download_version(file_id, number), content)
+
+        # The current content is charged in full and older versions at their stored size
+        stats = self.client.get(reverse('storage-stats'), HTTP_USERID=str(self.user.id)).data
+        profile = UserProfile.objects.get(user=self.user)
+        self.assertEqual(profile.current_storage_used, len(contents[-1]) + stats['version_storage_used'])
+        self.assertEqual(stats['version_count'], 3)
+        self.assertLess(stats['version_storage_used'], 10 * 1024)
+        self.assertEqual(
+            stats['version_storage_used'] + stats['version_delta_savings'],
+            sum(len(content) for content in contents[:-1]),
+        )
+
+    @override_settings(VERSIONING={'MAX_CHAIN': 2})
+    def test_chain_length_is_bounded_by_keyframes(self):
+        contents = [self.rng.randbytes(32 * 1024)]
+        file_id = self._upload('doc.bin', contents[0], BINARY)
+        for _ in range(6):
+            contents.append(edited(contents[-1], self.rng))
+            self._upload_version(file_id, contents[-1])
+
+        keyframes = list(FileVersion.objects.filter(file_id=file_id, is_keyframe=True).values_list('number', flat=True))
+        self.assertEqual(keyframes, [6, 3])
+        for number, content in enumerate(contents, start=1):
+            self.assertEqual(self._download_version(file_id, number), content)
+
+    def test_new_version_of_an_original_keeps_its_duplicates_intact(self):
+        content = self.rng.randbytes(16 * 1024)
+        original_id = self._upload('a.bin', content, BINARY)
+        duplicate_id = self._upload('b.bin', content, BINARY)
+        self.assertTrue(File.objects.get(pk=duplicate_id).is_duplicate)
+
+        changed = edited(content, self.rng)
+        self.assertEqual(self._upload_version(original_id, changed).status_code, 201)
+
+        duplicate = File.objects.get(pk=duplicate_id)
+        self.assertFalse(duplicate.is_duplicate)
+        with duplicate.file.open('rb') as f:
+            self.assertEqual(f.read(), content)
+        self.assertEqual(self._download_version(original_id, 1), content)
+
+        # Both contents are now stored for this user, along with the old version
+        profile = UserProfile.objects.get(user=self.user)
+        stored = FileVersion.objects.get(file_id=original_id).stored_size
+        self.assertEqual(profile.current_storage_used, len(content) + len(changed) + stored)
+
+    def test_deleting_a_file_removes_its_versions(self):
+        content = self.rng.randbytes(16 * 1024)
+        file_id = self._upload('doc.bin', content, BINARY)
+        self._upload_version(file_id, edited(content, self.rng))
+        self.assertTrue(os.listdir(versioning.version_dir(file_id)))
+
+        self.client.delete(reverse('File-detail', kwargs={'pk': file_id}) + '?permanent=true', HTTP_USERID=str(self.user.id))
+        with self.captureOnCommitCallbacks(execute=True):
+            trash.reap()
+        self.assertFalse(FileVersion.objects.filter(file_id=file_id).exists())
+        self.assertFalse(os.path.exists(versioning.version_dir(file_id)))
+        self.assertEqual(UserProfile.objects.get(user=self.user).current_storage_used, 0)
+
+    def test_versions_count_towards_the_quota(self):
+        """Unrelated versions are kept in full, so they run into the quota like new files"""
+        UserProfile.objects.filter(user=self.user).update(storage_limit_mb=1)
+        size = 900 * 1024
+        file_id = self._upload('doc.bin', self.rng.randbytes(size), BINARY)
+
+        response = self._upload_version(file_id, self.rng.randbytes(size))
+        self.assertEqual(response.status_code, 413)
+        self.assertEqual(File.objects.get(pk=file_id).version, 1)
+        self.assertEqual(UserProfile.objects.get(user=self.user).current_storage_used, size)
+
+        # Small enough for both contents to fit
+        self.assertEqual(self._upload_version(file_id, self.rng.randbytes(100 * 1024)).status_code, 201)
+        profile = UserProfile.objects.get(user=self.user)
+        self.assertEqual(profile.current_storage_used, 100 * 1024 + size)
+
+    def test_preview_revalidates_after_a_new_version(self):
+        """Previews aren't cached as immutable, and a new version changes their ETag"""
+        content = self.rng.randbytes(16 * 1024)
+        file_id = self._upload('doc.bin', content, BINARY)
+        url = reverse('File-preview', kwargs={'pk': file_id})
+        response = self.client.get(url, HTTP_USERID=str(self.user.id))
+        self.assertNotIn('immutable', response['Cache-Control'])
+        etag = response['ETag']
+        response.close()
+
+        self._upload_version(file_id, edited(content, self.rng))
+        response = self.client.get(url, HTTP_USERID=str(self.user.id), HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 200)
+        self.assertNotEqual(response['ETag'], etag)
+        response.close()
@@ -0,0 +1,95 @@
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.db import transaction
+from django.urls import reverse
+from files.models import JournalCheckpoint, UserFileType, UserProfile
+from files import counters, journal
+from .base import FileVaultTestCase
+from unittest import mock
+import os
+import sqlite3
+
+
+class WriteBehindTests(FileVaultTestCase):
+    username = 'burstuser'
+
+    def get_settings_overrides(self):
+        return {
+            **self.settings_overrides,
+            # The test flushes explicitly; the background flusher never wakes up
+            'WRITE_BEHIND': {'ENABLED': True, 'PATH': os.path.join(self.media_root, 'journal.sqlite3'),
+                             'FLUSH_INTERVAL_MS': 10 ** 9},
+        }
+
+    def setUp(self):
+        super().setUp()
+        UserProfile.objects.filter(user=self.user).update(storage_limit_mb=1)
+
+    def tearDown(self):
+        journal.get_journal().stop()
+        super().tearDown()
+
+    def _upload_response(self, *args, **kwargs):
+        # Journaled charges are queued when the upload commits
+        with self.captureOnCommitCallbacks(execute=True):
+            return super()._upload_response(*args, **kwargs)
+
+    def _stored_usage(self):
+        return UserProfile.objects.get(user=self.user).current_storage_used
+
+    def test_counters_are_queued_then_flushed_in_one_batch(self):
+        for index in range(5):
+            self.assertEqual(self._upload_response(f'{index}.txt', b'x' * (100 + index), 'text/plain').status_code, 201)
+
+        # Nothing has reached the profile row yet, but reads include the queued charges
+        self.assertEqual(self._stored_usage(), 0)
+        self.assertEqual(counters.storage_used(self.user.id), 510)
+        self.assertFalse(UserFileType.objects.filter(user=self.user).exists())
+
+        self.assertGreater(journal.get_journal().flush_all(), 0)
+        self.assertEqual(self._stored_usage(), 510)
+        self.assertEqual(UserFileType.objects.get(user=self.user, file_type='text/plain').file_count, 5)
+        self.assertEqual(counters.storage_used(self.user.id), 510)
+
+    def test_quota_counts_queued_reservations(self):
+        self.assertEqual(self._upload_response('a.bin', b'a' * 600 * 1024).status_code, 201)
+        self.assertEqual(self._stored_usage(), 0)
+
+        response = self._upload_response('b.bin', b'b' * 600 * 1024)
+        self.assertEqual(response.status_code, 429)
+        self.assertIsNone(counters.reserve_storage(self.user.id, 600 * 1024, 1024 * 1024))
+
+    def test_rolled_back_charges_are_not_queued(self):
+        file_id = self._upload_response('a.bin', b'a' * 1000).data['id']
+        with self.assertRaises(RuntimeError), transaction.atomic():
+            counters.charge_storage(self.user.id, 5000)
+            raise RuntimeError()
+        self.assertEqual(counters.storage_used(self.user.id), 1000)
+
+        # A new version that fails after its reservation gives the reservation back
+        with mock.patch('files.versioning.add_version', side_effect=OSError('disk full')), self.assertRaises(OSError):
+            self.client.post(
+                reverse('File-versions', kwargs={'pk': file_id}),
+                {'file': SimpleUploadedFile('a.bin', b'a' * 3000)},
+                format='multipart',
+                HTTP_USERID=str(self.user.id)
+            )
+        self.assertEqual(counters.storage_used(self.user.id), 1000)
+
+    def test_replay_after_a_crash_does_not_double_count(self):
+        self._upload_response('a.bin', b'a' * 1000)
+        store = journal.get_journal()
+        connection = sqlite3.connect(store.path)
+        rows = connection.execute('SELECT model, keys, deltas, user_id, charged_bytes FROM deltas ORDER BY id').fetchall()
+        store.flush_all()
+        checkpoint = JournalCheckpoint.objects.get(journal_id=store.journal_id)
+
+        # As if the process died after the database commit but before the journal delete
+        with connection:
+            connection.executemany(
+                'INSERT INTO deltas (id, model, keys, deltas, user_id, charged_bytes) VALUES (?, ?, ?, ?, ?, ?)',
+                [(checkpoint.applied_id - index, *row) for index, row in enumerate(reversed(rows))],
+            )
+        connection.close()
+        self.assertEqual(counters.storage_used(self.user.id), 1000)
+        self.assertEqual(store.flush_all(), 0)
+        self.assertEqual(self._stored_usage(), 1000)